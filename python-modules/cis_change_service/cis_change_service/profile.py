@@ -5,6 +5,9 @@ import uuid
 from cis_aws import connect
 from cis_change_service import common
 from cis_identity_vault.models import user
+from cis_profile.batch import all_verified
+from cis_profile.batch import verify_signatures_many
+from cis_profile.common import profile_digest
 from cis_profile.profile import User
 from cis_profile.exceptions import PublisherVerificationFailure
 from cis_profile.exceptions import SignatureVerificationFailure
@@ -45,6 +48,43 @@ class Vault(object):
             return False
         return True
 
+    def _verify_many(self, profile_list):
+        """Verifies many profiles at once. Signatures are verified in parallel, see cis_profile.batch.
+        Returns a list of bool, one per profile."""
+        users = [User(user_structure_json=profile_json) for profile_json in profile_list]
+        verified = [True] * len(users)
+
+        if self.config("verify_publishers", namespace="cis") == "true":
+            for i, cis_profile in enumerate(users):
+                try:
+                    cis_profile.verify_all_publishers(User())
+                except PublisherVerificationFailure:
+                    verified[i] = False
+
+        if self.config("verify_signatures", namespace="cis") == "true":
+            results = verify_signatures_many(users)
+            for i, result in enumerate(results):
+                if not all_verified(result):
+                    verified[i] = False
+        return verified
+
+    def _vault(self):
+        if self.config("dynamodb_transactions", namespace="cis") == "true":
+            return user.Profile(
+                self.identity_vault_client.get("table"), self.identity_vault_client.get("client"), transactions=True
+            )
+        else:
+            return user.Profile(
+                self.identity_vault_client.get("table"), self.identity_vault_client.get("client"), transactions=False
+            )
+
+    def _is_unchanged(self, profile_json, digest, stored):
+        """Returns True if the profile has the same @digest as the @stored vault item (see Profile.find_digests())."""
+        if stored is not None and stored["profile_digest"] == digest:
+            logger.info("The profile is unchanged, skipping it for user: {}".format(profile_json["user_id"]["value"]))
+            return True
+        return False
+
     def _update_attr_owned_by_cis(self, profile_json):
         """Updates the attributes owned by cisv2.  Takes profiles profile_json
         and returns a profile json with updated values and sigs."""
@@ -62,24 +102,20 @@ class Vault(object):
         if isinstance(profile_json, str):
             profile_json = json.loads(profile_json)
 
+        # Unchanged profiles are neither signed, verified nor written, which only takes a read of their digest.
+        # The digest leaves out the attributes updated below.
+        vault = self._vault()
+        digest = profile_digest(profile_json)
+        user_id = profile_json["user_id"]["value"]
+        stored = vault.find_digests([user_id]).get(user_id)
+        if self._is_unchanged(profile_json, digest, stored):
+            return {"status": 200, "sequence_number": stored["sequence_number"]}
+
         # Run some code that updates attrs and metadata for attributes cis is trusted to assert
         self._update_attr_owned_by_cis(profile_json)
         verified = self._verify(profile_json)
 
         if verified:
-            if self.config("dynamodb_transactions", namespace="cis") == "true":
-                vault = user.Profile(
-                    self.identity_vault_client.get("table"),
-                    self.identity_vault_client.get("client"),
-                    transactions=True,
-                )
-            else:
-                vault = user.Profile(
-                    self.identity_vault_client.get("table"),
-                    self.identity_vault_client.get("client"),
-                    transactions=False,
-                )
-
             user_profile = dict(
                 id=profile_json["user_id"]["value"],
                 primary_email=profile_json["primary_email"]["value"],
@@ -87,9 +123,13 @@ class Vault(object):
                 primary_username=profile_json["primary_username"]["value"],
                 sequence_number=self.sequence_number,
                 profile=json.dumps(profile_json),
+                profile_digest=digest,
             )
 
-            res = vault.find_or_create(user_profile)
+            if stored is not None:
+                res = vault.update(user_profile)
+            else:
+                res = vault.create(user_profile)
             return res
         else:
             # XXX TBD do something else.
@@ -99,26 +139,28 @@ class Vault(object):
         """Write profile to the identity vault."""
         self._connect()
 
-        if self.config("dynamodb_transactions", namespace="cis") == "true":
-            logger.info("Attempting to put batch of profiles using transacations.")
-            vault = user.Profile(
-                self.identity_vault_client.get("table"), self.identity_vault_client.get("client"), transactions=True
-            )
-        else:
-            logger.info("Attempting to put batch of profiles without transactions.")
-            vault = user.Profile(
-                self.identity_vault_client.get("table"), self.identity_vault_client.get("client"), transactions=False
-            )
+        vault = self._vault()
+        logger.info("Attempting to put batch of profiles (transactions: {}).".format(vault.transactions))
 
         user_profiles = []
+        profiles = []
+        digests = []
 
+        profile_list = [json.loads(p) if isinstance(p, str) else p for p in profile_list]
+
+        # Unchanged profiles are neither signed, verified nor written, see put_profile()
+        stored = vault.find_digests([profile_json["user_id"]["value"] for profile_json in profile_list])
         for profile_json in profile_list:
-            if isinstance(profile_json, str):
-                profile_json = json.loads(profile_json)
+            digest = profile_digest(profile_json)
+            if self._is_unchanged(profile_json, digest, stored.get(profile_json["user_id"]["value"])):
+                continue
 
             # Run some code that updates attrs and metadata for attributes cis is trusted to assert
             self._update_attr_owned_by_cis(profile_json)
-            verified = self._verify(profile_json)
+            profiles.append(profile_json)
+            digests.append(digest)
+
+        for profile_json, digest, verified in zip(profiles, digests, self._verify_many(profiles)):
             if verified:
                 logger.info("Profiles have been verified. Constructing dictionary for storage.")
                 user_profile = dict(
@@ -128,13 +170,14 @@ class Vault(object):
                     primary_username=profile_json["primary_username"]["value"],
                     sequence_number=self.sequence_number,
                     profile=json.dumps(profile_json),
+                    profile_digest=digest,
                 )
                 user_profiles.append(user_profile)
             else:
                 # XXX TBD Do something else
                 pass
         logger.info("Attempting to send batch of {} profiles as a transaction.".format(len(user_profiles)))
-        return vault.find_or_create_batch(user_profiles)
+        return vault.find_or_create_batch(user_profiles, stored=stored)
 
     def _get_id(self, profile_json):
         if isinstance(profile_json, str):
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Compares the cost of signing and verifying a profile attribute with RS256 (RSA-2048) and EdDSA (Ed25519) keys, using
+cis_crypto.operation.Sign and Verify with the test fixture keys. The verified signature cache is disabled.
+
+Usage: python benchmarks/bench_sign_algorithms.py [iterations]
+"""
+
+import os
+import sys
+import timeit
+
+ATTRIBUTE = {
+    "metadata": {
+        "classification": "PUBLIC",
+        "last_modified": "2018-01-01T00:00:00Z",
+        "created": "2018-01-01T00:00:00Z",
+        "verified": False,
+        "display": "public",
+    },
+    "value": "test@example.net",
+}
+
+KEYS = [
+    ("RS256", "fake-access-file-key.priv.pem", "fake-access-file-key.pub.pem"),
+    ("EdDSA", "fake-publisher-key_ed25519.priv.pem", "fake-publisher-key_ed25519.pub.pem"),
+]
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    os.environ["CIS_SECRET_MANAGER_FILE_PATH"] = os.path.join(os.path.dirname(__file__), "../tests/fixture")
+    os.environ["CIS_SECRET_MANAGER"] = "file"
+    os.environ["CIS_WELL_KNOWN_MODE"] = "file"
+    os.environ["CIS_SIGNATURE_CACHE_SIZE"] = "0"
+
+    from cis_crypto import operation
+
+    for name, private_key, public_key in KEYS:
+        os.environ["CIS_SIGNING_KEY_NAME"] = private_key
+        os.environ["CIS_PUBLIC_KEY_NAME"] = public_key
+        signop = operation.Sign()
+        verifyop = operation.Verify()
+        signop.load(ATTRIBUTE)
+        verifyop.load(signop.jws())
+        assert signop.algorithm() == name
+
+        sign = min(timeit.repeat(signop.jws, number=iterations, repeat=3))
+        verify = min(timeit.repeat(verifyop.jws, number=iterations, repeat=3))
+        print(
+            "{:>6}: sign {:8.1f} us/op, verify {:8.1f} us/op".format(
+                name, sign / iterations * 1e6, verify / iterations * 1e6
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
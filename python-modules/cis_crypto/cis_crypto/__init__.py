@@ -6,5 +6,6 @@ from cis_crypto import cli
 from cis_crypto import operation
 from cis_crypto import secret
 from cis_crypto import common
+from cis_crypto import auth
 
-__all__ = [cli, operation, secret, common]
+__all__ = [cli, operation, secret, common, auth]
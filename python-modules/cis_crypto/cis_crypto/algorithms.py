@@ -0,0 +1,126 @@
+"""Signature algorithms supported by cis_crypto: RS256 (python-jose) and Ed25519 (EdDSA, RFC 8037)."""
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+from jose import jwk
+from jose.backends.base import Key
+from jose.exceptions import JWKError
+from jose.utils import base64url_decode
+from jose.utils import base64url_encode
+
+RS256 = "RS256"
+EDDSA = "EdDSA"
+# Algorithms accepted in the `alg` header of the signatures to verify
+SUPPORTED_ALGORITHMS = [RS256, EDDSA]
+
+
+class Ed25519Key(Key):
+    """Ed25519 key for python-jose, so that jws.sign() and jws.verify() support the EdDSA algorithm."""
+
+    def __init__(self, key, algorithm):
+        if algorithm != EDDSA:
+            raise JWKError("{} is not a valid algorithm for Ed25519 keys".format(algorithm))
+
+        if isinstance(key, (Ed25519PrivateKey, Ed25519PublicKey)):
+            self.prepared_key = key
+        elif isinstance(key, dict):
+            self.prepared_key = self._process_jwk(key)
+        else:
+            if isinstance(key, str):
+                key = key.encode("utf-8")
+            try:
+                if b"PRIVATE" in key:
+                    self.prepared_key = serialization.load_pem_private_key(key, password=None)
+                else:
+                    self.prepared_key = serialization.load_pem_public_key(key)
+            except ValueError as e:
+                raise JWKError(e)
+            if not isinstance(self.prepared_key, (Ed25519PrivateKey, Ed25519PublicKey)):
+                raise JWKError("Not an Ed25519 key")
+
+    def _process_jwk(self, jwk_dict):
+        if jwk_dict.get("kty") != "OKP" or jwk_dict.get("crv") != "Ed25519":
+            raise JWKError("Incorrect key type. Expected: 'OKP' with curve 'Ed25519'")
+        if "d" in jwk_dict:
+            return Ed25519PrivateKey.from_private_bytes(base64url_decode(jwk_dict["d"].encode("utf-8")))
+        return Ed25519PublicKey.from_public_bytes(base64url_decode(jwk_dict["x"].encode("utf-8")))
+
+    def is_public(self):
+        return isinstance(self.prepared_key, Ed25519PublicKey)
+
+    def sign(self, msg):
+        return self.prepared_key.sign(msg)
+
+    def verify(self, msg, sig):
+        try:
+            self.public_key().prepared_key.verify(sig, msg)
+            return True
+        except InvalidSignature:
+            return False
+
+    def public_key(self):
+        if self.is_public():
+            return self
+        return Ed25519Key(self.prepared_key.public_key(), EDDSA)
+
+    def to_pem(self):
+        if self.is_public():
+            return self.prepared_key.public_bytes(
+                encoding=serialization.Encoding.PEM, format=serialization.PublicFormat.SubjectPublicKeyInfo
+            )
+        return self.prepared_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption(),
+        )
+
+    def to_dict(self):
+        public = self.public_key().prepared_key
+        data = {
+            "alg": EDDSA,
+            "kty": "OKP",
+            "crv": "Ed25519",
+            "x": base64url_encode(
+                public.public_bytes(encoding=serialization.Encoding.Raw, format=serialization.PublicFormat.Raw)
+            ).decode("ascii"),
+        }
+        if not self.is_public():
+            private_bytes = self.prepared_key.private_bytes(
+                encoding=serialization.Encoding.Raw,
+                format=serialization.PrivateFormat.Raw,
+                encryption_algorithm=serialization.NoEncryption(),
+            )
+            data["d"] = base64url_encode(private_bytes).decode("ascii")
+        return data
+
+
+jwk.register_key(EDDSA, Ed25519Key)
+
+
+def key_algorithm(key):
+    """Returns the JWS algorithm to use with a jose key object: EdDSA for Ed25519 keys, RS256 otherwise."""
+    if isinstance(key, Ed25519Key):
+        return EDDSA
+    return RS256
+
+
+def construct(key_data):
+    """Returns a jose key object for key_data (a jwk dict or a PEM), RSA or Ed25519."""
+    if isinstance(key_data, dict):
+        algorithm = key_data.get("alg") or (EDDSA if key_data.get("kty") == "OKP" else RS256)
+        return jwk.construct(key_data, algorithm)
+
+    if isinstance(key_data, str):
+        key_data = key_data.encode("utf-8")
+    try:
+        if b"PRIVATE" in key_data:
+            key = serialization.load_pem_private_key(key_data, password=None)
+        else:
+            key = serialization.load_pem_public_key(key_data)
+    except ValueError:
+        # Let python-jose handle (or reject) the other formats
+        return jwk.construct(key_data, RS256)
+    if isinstance(key, (Ed25519PrivateKey, Ed25519PublicKey)):
+        return Ed25519Key(key, EDDSA)
+    return jwk.construct(key, RS256)
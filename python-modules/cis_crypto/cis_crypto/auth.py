@@ -0,0 +1,230 @@
+"""Verification of the bearer tokens (JWTs) of API clients, shared by the CIS APIs.
+
+The JWKS of the token issuer is fetched once per process and its keys parsed into a KeyRing, indexed by kid.  It is
+fetched again after `jwks_cache_ttl` seconds, or when a token names a kid the ring does not have (at most every
+`jwks_refresh_interval` seconds, so that bogus tokens cannot make us hammer the issuer).  Verified token claims are
+cached until the token expires, so that each token is verified once per process for a given JWKS, audience, issuer
+and set of algorithms."""
+import collections
+import hashlib
+import logging
+import requests
+import threading
+import time
+from jose import jwt
+from jose.exceptions import JWTError
+from cis_crypto import common
+from cis_crypto import keyring
+
+logger = logging.getLogger(__name__)
+
+# Process-wide JWKS caches, per url, see get_jwks_cache()
+_jwks_caches = {}
+_token_cache = None
+_lock = threading.Lock()
+
+
+class UnknownKeyError(JWTError):
+    """The key the token was signed with is not in the JWKS of the issuer."""
+
+
+def _fetch_jwks(url):
+    response = requests.get(url, timeout=10)
+    response.raise_for_status()
+    return response.json()
+
+
+class JWKSCache(object):
+    """The keys of a JWKS, parsed once and refreshed on expiry or on unknown kid.
+
+    Fetches are made at most once every `refresh_interval` seconds, outside of the lock. While the JWKS is being
+    fetched, or if fetching it fails, the keys loaded previously are used."""
+
+    def __init__(self, fetch, ttl=None, refresh_interval=None):
+        """fetch is a callable returning the JWKS (dict with a `keys` list)."""
+        config = common.get_config()
+        self.fetch = fetch
+        if ttl is None:
+            ttl = int(config("jwks_cache_ttl", namespace="cis", default="3600"))
+        if refresh_interval is None:
+            refresh_interval = int(config("jwks_refresh_interval", namespace="cis", default="30"))
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self._ring = None
+        # Time of the last successful fetch, and of the last attempt
+        self._fetched = 0
+        self._attempted = 0
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+
+    def _refresh(self, ring):
+        """Returns the key ring of a new fetch of the JWKS.
+
+        ring is the key ring the caller has.  It is returned as is if another thread is fetching the JWKS, or if the
+        fetch fails.  Errors are only raised when no key ring was loaded."""
+        if not self._fetch_lock.acquire(ring is None):
+            return ring
+        try:
+            with self._lock:
+                if self._ring is not ring:
+                    # Refreshed by another thread in the meantime
+                    return self._ring
+                self._attempted = time.time()
+            try:
+                jwks = self.fetch()
+            except Exception as e:
+                if ring is None:
+                    raise
+                logger.warning("Could not refresh the JWKS, using the keys loaded previously ({}).".format(e))
+                return ring
+            new_ring = keyring.KeyRing(fingerprint=keyring._digest(jwks))
+            for key in jwks.get("keys", []):
+                try:
+                    new_ring.add(key)
+                except Exception as e:
+                    logger.warning("Skipping JWKS key {}: {}".format(key.get("kid"), e))
+            with self._lock:
+                self._ring = new_ring
+                self._fetched = time.time()
+            logger.debug("Loaded {} JWKS keys.".format(len(new_ring)))
+            return new_ring
+        finally:
+            self._fetch_lock.release()
+
+    def get_key(self, kid):
+        """Returns the jose key object with this kid, or None."""
+        return self._get_key(kid)[1]
+
+    def _get_key(self, kid):
+        """Returns (fingerprint of the JWKS, the key with this kid or None)."""
+        ring = self._ring
+        now = time.time()
+        if ring is None or (now - self._fetched > self.ttl and now - self._attempted > self.refresh_interval):
+            ring = self._refresh(ring)
+        key = ring.get(kid)
+        if key is None and time.time() - self._attempted > self.refresh_interval:
+            logger.debug("Unknown kid {}, refreshing the JWKS.".format(kid))
+            ring = self._refresh(ring)
+            key = ring.get(kid)
+        return ring.fingerprint, key
+
+    @property
+    def fingerprint(self):
+        """Digest of the JWKS currently loaded, None before it is first fetched."""
+        ring = self._ring
+        return ring.fingerprint if ring is not None else None
+
+    def flush(self):
+        with self._lock:
+            self._ring = None
+
+
+def get_jwks_cache(url, fetch=None):
+    """Returns the process-wide JWKSCache of the JWKS at url.  fetch overrides how the JWKS is fetched."""
+    with _lock:
+        cache = _jwks_caches.get(url)
+        if cache is None:
+            cache = JWKSCache(fetch or (lambda: _fetch_jwks(url)))
+            _jwks_caches[url] = cache
+    return cache
+
+
+class TokenCache(object):
+    """Bounded LRU cache of verified token claims, kept until the token expires.
+
+    Entries are keyed by a digest of the token and the context it was verified in (see _context()), so that a token
+    verified for one audience, issuer or JWKS is not accepted for another."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, token, context):
+        if isinstance(token, str):
+            token = token.encode("utf-8")
+        return (hashlib.sha256(token).digest(), context)
+
+    def get(self, token, context=()):
+        """Returns the claims of a token previously verified in this context that has not expired yet, or None."""
+        key = self._key(token, context)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, token, claims, context=()):
+        """Records the claims of a token verified in this context.  Tokens without an expiry are not cached."""
+        try:
+            expiry = float(claims["exp"])
+        except (KeyError, TypeError, ValueError):
+            return
+        if self.max_entries <= 0:
+            return
+        key = self._key(token, context)
+        with self._lock:
+            self._entries[key] = (expiry, claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def flush(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def get_token_cache():
+    """Returns the process-wide TokenCache, sized by the `token_cache_size` setting (0 disables it)."""
+    global _token_cache
+    if _token_cache is None:
+        with _lock:
+            if _token_cache is None:
+                max_entries = int(common.get_config()("token_cache_size", namespace="cis", default="10000"))
+                _token_cache = TokenCache(max_entries=max_entries)
+    return _token_cache
+
+
+def _context(fingerprint, audience, issuer, algorithms):
+    """Returns the part of the token cache key describing how a token was verified."""
+    if isinstance(algorithms, str):
+        algorithms = [algorithms]
+    return (fingerprint, audience, issuer, tuple(sorted(algorithms or [])))
+
+
+def verify_token(token, jwks, audience, issuer, algorithms="RS256"):
+    """Returns dict the claims of the verified token.  jwks is a JWKSCache.
+
+    Raises the errors of jose.jwt.decode (ExpiredSignatureError, JWTClaimsError, JWTError), and UnknownKeyError if
+    the token's kid is not in the JWKS."""
+    token_cache = get_token_cache()
+    header = jwt.get_unverified_header(token)
+    fingerprint, key = jwks._get_key(header.get("kid"))
+    if key is None:
+        raise UnknownKeyError("Unable to find appropriate key")
+    context = _context(fingerprint, audience, issuer, algorithms)
+    claims = token_cache.get(token, context)
+    if claims is not None:
+        return claims
+
+    claims = jwt.decode(token, key, algorithms=algorithms, audience=audience, issuer=issuer)
+    token_cache.put(token, claims, context)
+    return claims
+
+
+def verified_claims(token, jwks, audience, issuer, algorithms="RS256"):
+    """Returns the claims of the token if verify_token() verified it with the same arguments and it has not expired
+    yet, or None.  The JWKS is not fetched."""
+    if jwks.fingerprint is None:
+        return None
+    return get_token_cache().get(token, _context(jwks.fingerprint, audience, issuer, algorithms))
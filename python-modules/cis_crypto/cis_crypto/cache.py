@@ -0,0 +1,91 @@
+"""Optional process-wide cache of verified signatures, so that signatures are not verified again and again.
+
+It is disabled by default: deployments opt in by setting `signature_cache_size` to the number of signatures to keep."""
+import collections
+import hashlib
+import logging
+import threading
+import time
+from cis_crypto import common
+
+logger = logging.getLogger(__name__)
+
+_signature_cache = None
+_signature_cache_lock = threading.Lock()
+
+
+class SignatureCache(object):
+    """Bounded LRU cache of verified signatures with TTL based eviction.
+
+    Entries are keyed by a digest of the compact JWS and of the id of the key(s) it was verified with, and hold the
+    decoded payload. Only successful verifications are cached. The whole cache is flushed when the keys of a key set
+    (e.g. the keys of a publisher) change."""
+
+    def __init__(self, max_entries=10000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._key_sets = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, jws_signature, kid):
+        if isinstance(jws_signature, str):
+            jws_signature = jws_signature.encode("utf-8")
+        return hashlib.sha256(jws_signature + b"." + kid.encode("utf-8")).digest()
+
+    def get(self, jws_signature, kid):
+        """Returns the payload of a previously verified signature, or None."""
+        key = self._key(jws_signature, kid)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, jws_signature, kid, payload):
+        """Records a verified signature and its payload."""
+        key = self._key(jws_signature, kid)
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def flush(self):
+        with self._lock:
+            self._entries.clear()
+
+    def check_key_set(self, name, kid):
+        """Flushes the cache if the key set `name` (e.g. a publisher name) does not have the id `kid` anymore."""
+        with self._lock:
+            previous = self._key_sets.get(name)
+            if previous != kid:
+                if previous is not None:
+                    logger.debug("Keys of {} changed, flushing the signature cache.".format(name))
+                    self._entries.clear()
+                self._key_sets[name] = kid
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def get_signature_cache():
+    """Returns the process-wide SignatureCache, or None if it is disabled (`signature_cache_size` is 0, the default)."""
+    global _signature_cache
+    if _signature_cache is None:
+        with _signature_cache_lock:
+            if _signature_cache is None:
+                config = common.get_config()
+                max_entries = int(config("signature_cache_size", namespace="cis", default="0"))
+                ttl = int(config("signature_cache_ttl", namespace="cis", default="3600"))
+                _signature_cache = SignatureCache(max_entries=max_entries, ttl=ttl)
+    if _signature_cache.max_entries <= 0:
+        return None
+    return _signature_cache
@@ -0,0 +1,151 @@
+"""Verification key rings: keys are loaded and parsed once, then indexed by key id (`kid`) and by publisher."""
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+from cis_crypto import algorithms
+
+logger = logging.getLogger(__name__)
+
+# Process-wide key rings, see get_file_keyring() and get_well_known_keyring()
+_file_keyrings = {}
+_well_known_keyrings = {}
+_well_known_keyrings_by_id = {}
+_keyrings_lock = threading.Lock()
+# Required members of the JWK thumbprint, per key type (RFC 7638 and RFC 8037)
+_THUMBPRINT_MEMBERS = {"RSA": ["e", "kty", "n"], "OKP": ["crv", "kty", "x"]}
+
+
+def thumbprint(key):
+    """Returns the RFC 7638 JWK thumbprint of a jose key object (private or public), used as its default kid."""
+    public = key.public_key().to_dict()
+    members = {k: public[k] for k in _THUMBPRINT_MEMBERS.get(public.get("kty"), ["e", "kty", "n"]) if k in public}
+    for k, v in members.items():
+        if isinstance(v, bytes):
+            members[k] = v.decode("utf-8")
+    digest = hashlib.sha256(json.dumps(members, sort_keys=True, separators=(",", ":")).encode("utf-8")).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("utf-8")
+
+
+class KeyRing(object):
+    """A set of verification keys, indexed by kid and by publisher.
+
+    Each key is reachable by its declared `kid` (if any) and by its thumbprint, which is the kid `Sign` emits by
+    default."""
+
+    def __init__(self, fingerprint=None):
+        self.fingerprint = fingerprint  # Digest of the key material the ring was built from
+        self._by_kid = {}  # kid: (key, set of publishers)
+        self._by_publisher = {}  # publisher: list of (kid, key)
+        self._keys = []  # list of (kid, key)
+
+    def add(self, key_material, publisher=None):
+        """Parses and adds a key (RSA or Ed25519).  key_material is a jwk dict or a PEM.  Returns the key's kid."""
+        if isinstance(key_material, dict):
+            kid = key_material.get("kid")
+            key_material = {k: v for k, v in key_material.items() if k not in ["x5t", "x5c"]}
+        else:
+            kid = None
+        key = algorithms.construct(key_material)
+        key_thumbprint = thumbprint(key)
+
+        for k in set([kid, key_thumbprint]):
+            if k is None:
+                continue
+            entry = self._by_kid.setdefault(k, (key, set()))
+            if publisher is not None:
+                entry[1].add(publisher)
+        kid = kid or key_thumbprint
+        self._keys.append((kid, key))
+        if publisher is not None:
+            self._by_publisher.setdefault(publisher, []).append((kid, key))
+        return kid
+
+    def select(self, kid=None, publisher=None):
+        """Returns a list of (kid, key) candidates to verify a signature with.
+
+        If the kid is known, this is exactly that key (or no key if it does not belong to the publisher).  Else, this
+        is all keys of the publisher, or all keys if there is no publisher."""
+        if kid is not None and kid in self._by_kid:
+            key, publishers = self._by_kid[kid]
+            if publisher is not None and publisher not in publishers and len(publishers) > 0:
+                logger.debug("Key {} does not belong to publisher {}.".format(kid, publisher))
+                return []
+            return [(kid, key)]
+        if publisher is not None:
+            return self._by_publisher.get(publisher, [])
+        return self._keys
+
+    def get(self, kid):
+        """Returns the key with this kid, or None."""
+        entry = self._by_kid.get(kid)
+        return entry[0] if entry is not None else None
+
+    def __len__(self):
+        return len(self._keys)
+
+
+def _digest(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def get_file_keyring(path):
+    """Returns the KeyRing of a public key PEM file.  The file is only read again when it changes."""
+    mtime = os.stat(path).st_mtime
+    cached = _file_keyrings.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, "rb") as fh:
+        key_content = fh.read()
+    ring = KeyRing(fingerprint=hashlib.sha256(key_content).hexdigest())
+    ring.add(key_content)
+    logger.debug("Loaded key ring from {}.".format(path))
+    with _keyrings_lock:
+        _file_keyrings[path] = (mtime, ring)
+    return ring
+
+
+def _well_known_jwks(well_known):
+    """Returns dict the jwks keys of each publisher of well-known data, including the `access_file` keys."""
+    jwks = {}
+    if "access_file" in well_known:
+        jwks["access_file"] = well_known["access_file"].get("jwks_keys", [])
+    for publisher, data in well_known.get("publishers_supported", {}).items():
+        jwks[publisher] = data.get("jwks_keys", [])
+    for publisher, data in well_known.get("api", {}).get("publishers_jwks", {}).items():
+        jwks.setdefault(publisher, data.get("keys", []))
+    return jwks
+
+
+def get_well_known_keyring(well_known):
+    """Returns the KeyRing of the keys listed in well-known data.
+
+    Rings are rebuilt only when the keys of the well-known data change."""
+    cached = _well_known_keyrings_by_id.get(id(well_known))
+    if cached is not None and cached[0] is well_known:
+        return cached[1]
+
+    jwks = _well_known_jwks(well_known)
+    fingerprint = _digest(jwks)
+    with _keyrings_lock:
+        ring = _well_known_keyrings.get(fingerprint)
+        if ring is None:
+            logger.debug("Building key ring for well-known keys {}.".format(fingerprint))
+            ring = KeyRing(fingerprint=fingerprint)
+            for publisher, keys in jwks.items():
+                for key in keys:
+                    try:
+                        ring.add(key, publisher=publisher)
+                    except Exception as e:
+                        logger.warning("Skipping unsupported key of publisher {} ({}).".format(publisher, e))
+            # Only keep the current rings
+            _well_known_keyrings.clear()
+            _well_known_keyrings[fingerprint] = ring
+        if len(_well_known_keyrings_by_id) >= 32:
+            _well_known_keyrings_by_id.clear()
+        # Keep a reference to the well-known data so that its id() cannot be reused by another object
+        _well_known_keyrings_by_id[id(well_known)] = (well_known, ring)
+    return ring
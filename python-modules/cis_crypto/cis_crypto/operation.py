@@ -2,13 +2,32 @@ import json
 import logging
 import os
 import yaml
-from jose import jwk
 from jose import jws
 from jose.exceptions import JWSError
+from jose.utils import base64url_encode
 from cis_crypto import secret
+from cis_crypto import algorithms
 from cis_crypto import common
+from cis_crypto import keyring
+from cis_crypto.cache import get_signature_cache
 
 logger = logging.getLogger(__name__)
+
+
+def canonical_json(payload):
+    """Returns bytes the canonical JSON serialization of a payload: sorted keys and no whitespace."""
+    return json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def _encode_payload(payload):
+    """Returns bytes the payload as signed: canonical JSON for dicts, UTF-8 for strings."""
+    if isinstance(payload, dict):
+        return canonical_json(payload)
+    elif isinstance(payload, str):
+        return payload.encode("utf-8")
+    return payload
+
+
 # Note:
 # These attrs on sign/verify could be refactored to use object inheritance.  Leaving as is for now for readability.
 
@@ -17,38 +36,57 @@ class Sign(object):
     def __init__(self):
         self.config = common.get_config()
         self.key_name = self.config("signing_key_name", namespace="cis", default="file")
-        self._jwk = None
+        self._manager = None
+        self._kid = None  # (key, kid) of the last key used
         self.secret_manager = self.config("secret_manager", namespace="cis", default="file")
+        # Detached payload signatures (RFC 7515 appendix F) do not embed a copy of the payload
+        self.detached = self.config("signature_detached_payload", namespace="cis", default="false") == "true"
         self.payload = None
 
     def load(self, data):
         """Loads a payload to the object and ensures that the thing is serializable."""
-        try:
-            data = yaml.safe_load(data)
-        except yaml.scanner.ScannerError:
-            logger.info("This file is likely not YAML.  Attempting JSON load.")
-        except AttributeError:
-            logger.info("This file is likely not YAML.  Attempting JSON load.")
-
-        if isinstance(data, str):
-            data = json.loads(data)
-        else:
-            pass
+        if isinstance(data, (str, bytes)):
+            try:
+                data = json.loads(data)
+            except ValueError:
+                logger.debug("This payload is likely not JSON.  Attempting YAML load.")
+                data = yaml.safe_load(data)
 
         self.payload = data
         return self.payload
 
-    def jws(self):
-        """Assumes you loaded a payload.  Returns a jws."""
-        jwk = self._get_key()
-        sig = jws.sign(self.payload, jwk.to_dict(), algorithm="RS256")
+    def jws(self, detached=None):
+        """Assumes you loaded a payload.  Returns a jws, without its payload if detached (defaults to self.detached)."""
+        # The key object is passed as-is, so that it is not serialized and parsed again for every signature
+        # The key, its algorithm and kid are resolved once per signature
+        key = self._get_key()
+        payload = _encode_payload(self.payload)
+        # The kid header lets verifiers pick the right key instead of trying all of them
+        sig = jws.sign(payload, key, headers={"kid": self._get_kid(key)}, algorithm=algorithms.key_algorithm(key))
+        if detached or (detached is None and self.detached):
+            header, _, signature = sig.split(".")
+            sig = "{}..{}".format(header, signature)
         return sig
 
+    def algorithm(self):
+        """Returns the JWS algorithm of the signing key: RS256, or EdDSA for Ed25519 keys."""
+        return algorithms.key_algorithm(self._get_key())
+
     def _get_key(self):
-        if self._jwk is None:
-            manager = secret.Manager(provider_type=self.secret_manager)
-            self._jwk = manager.get_key(key_name=self.key_name)
-        return self._jwk
+        # Keys are cached (and refreshed) process-wide by the secret manager, so that they are fetched once per process
+        if self._manager is None:
+            self._manager = secret.Manager(provider_type=self.secret_manager)
+        return self._manager.get_key(key_name=self.key_name)
+
+    def _get_kid(self, key=None):
+        """Returns the kid of the signing key @key (defaults to the current one): the `signing_key_id` setting, or the
+        thumbprint of the key."""
+        if key is None:
+            key = self._get_key()
+        if self._kid is None or self._kid[0] is not key:
+            kid = self.config("signing_key_id", namespace="cis", default="")
+            self._kid = (key, kid or keyring.thumbprint(key))
+        return self._kid[1]
 
 
 class Verify(object):
@@ -58,15 +96,32 @@ class Verify(object):
         self.well_known_mode = self.config("well_known_mode", namespace="cis", default="file")
         self.public_key_name = None  # Optional for use with file based well known mode
         self.jws_signature = None
+        self.payload = None  # Payload of detached payload signatures
         self.well_known = None  # Well known JSON data
+        # Process-wide cache of verified signatures, None if disabled
+        self.signature_cache = get_signature_cache()
 
-    def load(self, jws_signature):
-        """Takes data in the form of a dict() and a JWS sig."""
+    def load(self, jws_signature, payload=None):
+        """Takes a JWS sig, and the signed data (str, bytes or dict) if the sig has a detached payload."""
         # Store the original form in the jws_signature attribute
         self.jws_signature = jws_signature
-
-    def _get_public_key(self, keyname=None):
-        """Returns a jwk construct for the public key and mode specified."""
+        self.payload = payload
+
+    def _attach_payload(self):
+        """Returns the loaded JWS with its payload, which is rebuilt from self.payload if it was detached."""
+        signature = self.jws_signature
+        if isinstance(signature, bytes):
+            signature = signature.decode("utf-8")
+        parts = signature.split(".") if isinstance(signature, str) else []
+        if len(parts) != 3 or parts[1] != "":
+            return self.jws_signature
+        if self.payload is None:
+            raise JWSError("The signature payload is detached and no payload was loaded.")
+        parts[1] = base64url_encode(_encode_payload(self.payload)).decode("ascii")
+        return ".".join(parts)
+
+    def _get_keyring(self):
+        """Returns the KeyRing of the trusted keys for the mode specified.  Keys are only parsed again on change."""
         if self.well_known_mode == "file":
             key_dir = self.config(
                 "secret_manager_file_path",
@@ -74,43 +129,63 @@ class Verify(object):
                 default=("{}/.mozilla-iam/keys/".format(os.path.expanduser("~"))),
             )
             key_name = self.config("public_key_name", namespace="cis", default="access-file-key")
-            file_name = "{}".format(key_name)
-            fh = open((os.path.join(key_dir, file_name)), "rb")
-            key_content = fh.read()
-            key_construct = jwk.construct(key_content, "RS256")
-            return [key_construct.to_dict()]
+            return keyring.get_file_keyring(os.path.join(key_dir, key_name))
         elif self.well_known_mode == "http" or self.well_known_mode == "https":
-            return self._reduce_keys(keyname)
-
-    def _reduce_keys(self, keyname=None):
-        access_file_keys = self.well_known["access_file"]["jwks_keys"]
-        publishers_supported = self.well_known["publishers_supported"]
-
-        keys = []
+            return keyring.get_well_known_keyring(self.well_known)
 
+    def _get_publisher(self, keyname=None):
+        """Returns the name of the key set of the well-known data to verify against, or None for any key."""
+        if self.well_known_mode == "file":
+            return None
         if "access-file-key" in self.config("public_key_name", namespace="cis", default="access-file-key"):
-            return access_file_keys
-        else:
-            # If not an access key verification this will attempt to verify against any listed publisher.
-            keys = publishers_supported[keyname]["jwks_keys"]
-            for key in range(len(keys)):
-                keys.append(key)
-        return keys
+            return "access_file"
+        return keyname
+
+    def _get_public_key(self, keyname=None):
+        """Returns a list of jwk dicts of the public key(s) for the mode specified."""
+        ring = self._get_keyring()
+        return [key.to_dict() for kid, key in ring.select(publisher=self._get_publisher(keyname))]
 
     def jws(self, keyname=None):
         """Assumes you loaded a payload.  Return the same jws or raise a custom exception."""
-        key_material = self._get_public_key(keyname)
-
-        if isinstance(key_material, list):
-            logger.debug("Multiple keys returned.  Attempting match.")
-            for key in key_material:
-                key.pop("x5t", None)
-                key.pop("x5c", None)
-                logger.info("Attempting to match against: {}".format(key))
-                try:
-                    sig = jws.verify(self.jws_signature, key, algorithms="RS256", verify=True)
-                    logger.info("Matched a verified signature for: {}".format(key))
-                    return sig
-                except JWSError as e:
-                    logger.error(e)
+        ring = self._get_keyring()
+        jws_signature = self._attach_payload()
+        try:
+            header = jws.get_unverified_header(jws_signature)
+        except JWSError:
+            header = {}
+        publisher = self._get_publisher(keyname)
+        keys = ring.select(kid=header.get("kid"), publisher=publisher)
+        # RS256 and EdDSA signatures can coexist, only try the keys of the signature algorithm
+        keys = [(kid, key) for kid, key in keys if algorithms.key_algorithm(key) == header.get("alg")]
+
+        if self.signature_cache is None:
+            return self._verify(jws_signature, keys)[1]
+
+        # Key rotation flushes the cache, and cached signatures are only valid for the key they were verified with
+        self.signature_cache.check_key_set("{}:{}".format(self.well_known_mode, keyname), ring.fingerprint)
+        for kid, key in keys:
+            payload = self.signature_cache.get(jws_signature, self._cache_id(publisher, kid))
+            if payload is not None:
+                logger.debug("Signature found in the verified signature cache for key: {}".format(kid))
+                return payload
+        kid, payload = self._verify(jws_signature, keys)
+        self.signature_cache.put(jws_signature, self._cache_id(publisher, kid), payload)
+        return payload
+
+    def _cache_id(self, publisher, kid):
+        """Returns the id under which signatures verified with the key @kid of @publisher are cached."""
+        return "{}:{}:{}".format(self.well_known_mode, publisher, kid)
+
+    def _verify(self, jws_signature, keys):
+        """Verifies a signature against candidate (kid, key) pairs. Return (kid, payload) or raise JWSError."""
+        if len(keys) > 1:
+            logger.debug("Signature without a known kid, attempting to match {} keys.".format(len(keys)))
+        for kid, key in keys:
+            try:
+                sig = jws.verify(jws_signature, key, algorithms=algorithms.SUPPORTED_ALGORITHMS, verify=True)
+                logger.debug("Matched a verified signature for key: {}".format(kid))
+                return kid, sig
+            except JWSError as e:
+                logger.debug("Signature does not match key {}: {}".format(kid, e))
         raise JWSError("The signature could not be verified for any trusted key.")
@@ -1,65 +1,200 @@
 """Class for following a default provider chain in the fetching of key material for sign/verify operations."""
 import boto3
 import json
+import logging
 import os
+import threading
+import time
+from cis_crypto import algorithms
 from cis_crypto import common
-from jose import jwk
+
+logger = logging.getLogger(__name__)
+
+# Process-wide cache of keys: (provider type, key location, key name): (expiry time, key)
+_key_cache = {}
+_key_cache_lock = threading.Lock()
+# Cache keys being refreshed in the background
+_refreshing = set()
+# SSM clients, per region
+_ssm_clients = {}
+_ssm_clients_lock = threading.Lock()
+
+
+def flush():
+    """Drops all cached keys, e.g. after a key rotation."""
+    with _key_cache_lock:
+        _key_cache.clear()
+
+
+def prewarm(key_names=None, provider_type=None):
+    """Loads keys in the cache ahead of time, e.g. during AWS Lambda init.
+
+    Defaults to the signing key (`signing_key_name` setting) and to the `secret_manager` setting."""
+    config = common.get_config()
+    if key_names is None:
+        key_names = [config("signing_key_name", namespace="cis", default="file")]
+    if provider_type is None:
+        provider_type = config("secret_manager", namespace="cis", default="file")
+    manager = Manager(provider_type=provider_type)
+    for key_name in key_names:
+        manager.get_key(key_name)
 
 
 class Manager(object):
-    """Top level manager object.  Will instantiate the appropriate provider based on configuration."""
+    """Top level manager object.  Will instantiate the appropriate provider based on configuration.
+
+    Keys are cached process-wide for `secret_cache_ttl` seconds (0 disables the cache).  Expired keys are still served
+    while they are refreshed in the background."""
 
     def __init__(self, provider_type):
         self.provider_type = provider_type
+        self.ttl = int(common.get_config()("secret_cache_ttl", namespace="cis", default="3600"))
+        self._provider = None
+        self._location = None
 
     def get_key(self, key_name):
-        provider = self._load_provider()
-        return provider.key(key_name)
+        if self.ttl <= 0:
+            return self._get_provider().key(key_name)
+
+        # Cached keys are served without building a provider (and reading its configuration) again
+        cache_key = self._cache_key(key_name)
+        entry = _key_cache.get(cache_key)
+        if entry is None:
+            return self._fetch(cache_key, key_name)
+        if entry[0] < time.time():
+            self._refresh(cache_key, key_name)
+        return entry[1]
+
+    def _get_provider(self):
+        if self._provider is None:
+            self._provider = self._load_provider()
+        return self._provider
+
+    def _cache_key(self, key_name):
+        if self._location is None:
+            self._location = self._get_provider().location()
+        return (self.provider_type.lower(), self._location, key_name)
+
+    def _fetch(self, cache_key, key_name):
+        key = self._get_provider().key(key_name)
+        with _key_cache_lock:
+            _key_cache[cache_key] = (time.time() + self.ttl, key)
+        return key
+
+    def _refresh(self, cache_key, key_name):
+        """Refreshes an expired key in a background thread."""
+        with _key_cache_lock:
+            if cache_key in _refreshing:
+                return
+            _refreshing.add(cache_key)
+
+        def refresh():
+            try:
+                self._fetch(cache_key, key_name)
+                logger.debug("Refreshed key {}.".format(key_name))
+            except Exception as e:
+                logger.warning("Could not refresh key {}, using the cached key ({}).".format(key_name, e))
+            finally:
+                with _key_cache_lock:
+                    _refreshing.discard(cache_key)
+
+        thread = threading.Thread(target=refresh, name="cis-secret-refresh")
+        thread.daemon = True
+        thread.start()
 
     def _load_provider(self):
         if self.provider_type.lower() == "file":
             return FileProvider()
         elif self.provider_type.lower() == "aws-ssm":
             return AWSParameterstoreProvider()
+        elif self.provider_type.lower() == "file-ssm":
+            return FileParameterstoreProvider()
         else:
-            raise ValueError("The secret provider selected is not yet supported file|aws-ssm are currently available.")
+            raise ValueError(
+                "The secret provider selected is not yet supported file|aws-ssm|file-ssm are currently available."
+            )
 
 
 class FileProvider(object):
     """Support loading key material from disk."""
 
-    def key(self, key_name):
-        """Takes key_name returns bytes"""
+    def __init__(self):
         config = common.get_config()
-        key_dir = config(
+        self.key_dir = config(
             "secret_manager_file_path",
             namespace="cis",
             default=("{}/.mozilla-iam/keys/".format(os.path.expanduser("~"))),
         )
+
+    def location(self):
+        return self.key_dir
+
+    def key(self, key_name):
+        """Takes key_name returns a jose key object (RSA or Ed25519)"""
         file_name = "{}".format(key_name)
-        fh = open((os.path.join(key_dir, file_name)), "rb")
+        fh = open((os.path.join(self.key_dir, file_name)), "rb")
         key_content = fh.read()
-        key_construct = jwk.construct(key_content, "RS256")
+        key_construct = algorithms.construct(key_content)
         return key_construct
 
 
+def _get_ssm_client(region_name):
+    """Returns an SSM client for the region, shared by all providers of the process."""
+    with _ssm_clients_lock:
+        client = _ssm_clients.get(region_name)
+        if client is None:
+            # boto3 sessions are not thread safe, so clients are created one at a time
+            boto_session = boto3.session.Session(region_name=region_name)
+            client = boto_session.client("ssm")
+            _ssm_clients[region_name] = client
+    return client
+
+
 class AWSParameterstoreProvider(object):
     """Support loading secure strings from AWS parameter store."""
 
     def __init__(self):
         self.config = common.get_config()
         self.region_name = self.config("secret_manager_ssm_region", namespace="cis", default="us-west-2")
-        self.boto_session = boto3.session.Session(region_name=self.region_name)
-        self.ssm_client = self.boto_session.client("ssm")
+        self.ssm_namespace = self.config("secret_manager_ssm_path", namespace="cis", default="/iam")
 
-    def key(self, key_name):
-        ssm_namespace = self.config("secret_manager_ssm_path", namespace="cis", default="/iam")
-        ssm_response = self.ssm_client.get_parameter(Name="{}/{}".format(ssm_namespace, key_name), WithDecryption=True)
+    @property
+    def ssm_client(self):
+        return _get_ssm_client(self.region_name)
+
+    def location(self):
+        return "{}:{}".format(self.region_name, self.ssm_namespace)
 
-        result = ssm_response.get("Parameter")
+    def key(self, key_name):
+        value = self._get_parameter("{}/{}".format(self.ssm_namespace, key_name))
         try:
-            key_dict = json.loads(result.get("Value"))
-            key_construct = jwk.construct(key_dict, "RS256")
+            key_dict = json.loads(value)
+            key_construct = algorithms.construct(key_dict)
         except json.decoder.JSONDecodeError:
-            key_construct = jwk.construct(result.get("Value"), "RS256")
+            key_construct = algorithms.construct(value)
         return key_construct
+
+    def _get_parameter(self, name):
+        ssm_response = self.ssm_client.get_parameter(Name=name, WithDecryption=True)
+        return ssm_response.get("Parameter").get("Value")
+
+
+class FileParameterstoreProvider(AWSParameterstoreProvider):
+    """Support loading secure strings from files laid out like AWS parameter store, as a local stand-in for it.
+
+    The parameter `<secret_manager_ssm_path>/<key name>` is read from the same path under `secret_manager_file_path`."""
+
+    def __init__(self):
+        super(FileParameterstoreProvider, self).__init__()
+        self.key_dir = self.config(
+            "secret_manager_file_path",
+            namespace="cis",
+            default=("{}/.mozilla-iam/keys/".format(os.path.expanduser("~"))),
+        )
+
+    def location(self):
+        return "{}:{}".format(self.key_dir, self.ssm_namespace)
+
+    def _get_parameter(self, name):
+        with open(os.path.join(self.key_dir, name.lstrip("/"))) as fh:
+            return fh.read()
@@ -0,0 +1,80 @@
+import json
+import os
+import pytest
+from jose import jws
+from jose.exceptions import JWSError
+
+
+class TestAlgorithms(object):
+    def setup(self):
+        os.environ["CIS_SECRET_MANAGER_FILE_PATH"] = "tests/fixture"
+        os.environ["CIS_SECRET_MANAGER"] = "file"
+        os.environ["CIS_SIGNING_KEY_NAME"] = "fake-publisher-key_ed25519.priv.pem"
+        os.environ["CIS_PUBLIC_KEY_NAME"] = "fake-publisher-key_ed25519.pub.pem"
+        os.environ["CIS_WELL_KNOWN_MODE"] = "file"
+
+    def teardown(self):
+        os.environ["CIS_SIGNING_KEY_NAME"] = "fake-access-file-key.priv.pem"
+        os.environ["CIS_PUBLIC_KEY_NAME"] = "fake-access-file-key.pub.pem"
+
+    def test_ed25519_key(self):
+        from cis_crypto import algorithms
+
+        with open("tests/fixture/fake-publisher-key_ed25519.priv.pem", "rb") as fh:
+            key = algorithms.construct(fh.read())
+        assert isinstance(key, algorithms.Ed25519Key)
+        assert algorithms.key_algorithm(key) == "EdDSA"
+
+        public = algorithms.construct(key.public_key().to_dict())
+        assert public.is_public()
+        assert "d" not in public.to_dict()
+        assert public.verify(b"data", key.sign(b"data"))
+        assert not public.verify(b"other data", key.sign(b"data"))
+
+    def test_sign_verify_ed25519(self):
+        from cis_crypto import operation
+
+        s = operation.Sign()
+        s.load({"values": {"test_key": "test_data"}})
+        sig = s.jws()
+        assert s.algorithm() == "EdDSA"
+        assert jws.get_unverified_header(sig)["alg"] == "EdDSA"
+
+        o = operation.Verify()
+        o.load(sig)
+        assert json.loads(o.jws()) == {"values": {"test_key": "test_data"}}
+
+        header, payload, signature = sig.split(".")
+        o.load(".".join([header, operation.jws.base64url_encode(b'{"values":{}}').decode(), signature]))
+        with pytest.raises(JWSError):
+            o.jws()
+
+    def test_rs256_and_ed25519_coexist(self):
+        from cis_crypto import algorithms
+        from cis_crypto import operation
+
+        with open("tests/fixture/mozilla-iam.json") as fh:
+            well_known = json.load(fh)
+        with open("tests/fixture/fake-publisher-key_ed25519.pub.pem", "rb") as fh:
+            ed25519_jwk = algorithms.construct(fh.read()).to_dict()
+        with open("tests/fixture/fake-access-file-key.pub.pem", "rb") as fh:
+            rsa_jwk = algorithms.construct(fh.read()).to_dict()
+        well_known["publishers_supported"]["migrating"] = {"jwks_keys": [rsa_jwk, ed25519_jwk]}
+
+        signatures = []
+        for key_name in ["fake-access-file-key.priv.pem", "fake-publisher-key_ed25519.priv.pem"]:
+            os.environ["CIS_SIGNING_KEY_NAME"] = key_name
+            s = operation.Sign()
+            s.load({"values": {"test_key": key_name}})
+            signatures.append(s.jws())
+
+        os.environ["CIS_WELL_KNOWN_MODE"] = "https"
+        os.environ["CIS_PUBLIC_KEY_NAME"] = "migrating"
+        try:
+            o = operation.Verify()
+            o.well_known = well_known
+            for sig in signatures:
+                o.load(sig)
+                assert o.jws() is not None
+        finally:
+            os.environ["CIS_WELL_KNOWN_MODE"] = "file"
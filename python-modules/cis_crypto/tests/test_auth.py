@@ -0,0 +1,166 @@
+import pytest
+import time
+from jose import jwk
+from jose import jwt
+
+
+class TestAuth(object):
+    def setup(self):
+        from cis_crypto import auth
+
+        with open("tests/fixture/fake-access-file-key.priv.pem") as fh:
+            self.private_key = fh.read()
+        public_jwk = jwk.construct(self.private_key, "RS256").public_key().to_dict()
+        public_jwk.update(kid="test-kid", use="sig")
+        self.jwks = {"keys": [public_jwk]}
+        self.fetches = 0
+        auth.get_token_cache().flush()
+
+    def fetch(self):
+        self.fetches += 1
+        return self.jwks
+
+    def token(self, kid="test-kid", expires_in=300, **claims):
+        claims.update(aud="https://api.example.net", iss="https://auth.example.net/", exp=int(time.time()) + expires_in)
+        return jwt.encode(claims, self.private_key, algorithm="RS256", headers={"kid": kid})
+
+    def verify(self, token, jwks, audience="https://api.example.net"):
+        from cis_crypto import auth
+
+        return auth.verify_token(token, jwks, audience=audience, issuer="https://auth.example.net/")
+
+    def verified_claims(self, token, jwks):
+        from cis_crypto import auth
+
+        return auth.verified_claims(token, jwks, audience="https://api.example.net", issuer="https://auth.example.net/")
+
+    def test_verify_token(self):
+        from cis_crypto import auth
+
+        jwks = auth.JWKSCache(self.fetch, ttl=3600, refresh_interval=3600)
+        token = self.token(scope="read:fullprofile")
+        assert self.verified_claims(token, jwks) is None
+        assert self.verify(token, jwks)["scope"] == "read:fullprofile"
+        assert self.verified_claims(token, jwks)["scope"] == "read:fullprofile"
+
+        # The JWKS is fetched once, and each token is verified once
+        hits = auth.get_token_cache().hits
+        assert self.verify(token, jwks)["scope"] == "read:fullprofile"
+        assert self.verify(self.token(), jwks) is not None
+        assert self.fetches == 1
+        assert auth.get_token_cache().hits == hits + 1
+
+        with pytest.raises(jwt.ExpiredSignatureError):
+            self.verify(self.token(expires_in=-10), jwks)
+        other_audience = jwt.encode({"aud": "other"}, self.private_key, algorithm="RS256", headers={"kid": "test-kid"})
+        with pytest.raises(jwt.JWTClaimsError):
+            self.verify(other_audience, jwks)
+
+    def test_unknown_kid_refreshes_jwks(self):
+        from cis_crypto import auth
+
+        jwks = auth.JWKSCache(self.fetch, ttl=3600, refresh_interval=0)
+        assert self.verify(self.token(), jwks) is not None
+        assert self.fetches == 1
+
+        with pytest.raises(auth.UnknownKeyError):
+            self.verify(self.token(kid="rotated-kid"), jwks)
+        assert self.fetches == 2
+
+        # The issuer rotated its keys
+        self.jwks["keys"][0]["kid"] = "rotated-kid"
+        time.sleep(0.01)
+        assert self.verify(self.token(kid="rotated-kid"), jwks) is not None
+        assert self.fetches == 3
+
+    def test_cached_token_is_scoped(self):
+        from cis_crypto import auth
+
+        jwks = auth.JWKSCache(self.fetch, ttl=3600, refresh_interval=3600)
+        token = self.token(scope="read:fullprofile")
+        assert self.verify(token, jwks) is not None
+
+        # A token verified for one audience is not accepted for another
+        with pytest.raises(jwt.JWTClaimsError):
+            self.verify(token, jwks, audience="https://other.example.net")
+        assert auth.verified_claims(token, jwks, audience="https://other.example.net", issuer=None) is None
+
+        # Nor with another JWKS
+        other_jwks = auth.JWKSCache(lambda: {"keys": []}, ttl=3600, refresh_interval=3600)
+        with pytest.raises(auth.UnknownKeyError):
+            self.verify(token, other_jwks)
+
+    def test_expired_jwks_is_refreshed_once(self):
+        from cis_crypto import auth
+
+        jwks = auth.JWKSCache(self.fetch, ttl=60, refresh_interval=30)
+        assert self.verify(self.token(), jwks) is not None
+        assert self.fetches == 1
+        jwks._fetched -= 120
+        jwks._attempted -= 120
+
+        # The expired JWKS is fetched again, the unknown kid does not trigger another fetch
+        with pytest.raises(auth.UnknownKeyError):
+            self.verify(self.token(kid="rotated-kid"), jwks)
+        assert self.fetches == 2
+
+    def test_failed_refresh_keeps_keys(self):
+        from cis_crypto import auth
+
+        jwks = auth.JWKSCache(self.fetch, ttl=60, refresh_interval=30)
+        assert self.verify(self.token(), jwks) is not None
+        fingerprint = jwks.fingerprint
+        jwks._fetched -= 120
+        jwks._attempted -= 120
+
+        def fail():
+            self.fetches += 1
+            raise Exception("JWKS unavailable")
+
+        # The keys loaded previously are used, and the fetch is not retried before refresh_interval
+        jwks.fetch = fail
+        for _ in range(3):
+            assert self.verify(self.token(), jwks) is not None
+            with pytest.raises(auth.UnknownKeyError):
+                self.verify(self.token(kid="rotated-kid"), jwks)
+        assert self.fetches == 2
+        assert jwks.fingerprint == fingerprint
+
+        jwks._attempted -= 60
+        assert self.verify(self.token(), jwks) is not None
+        assert self.fetches == 3
+
+        # Without keys loaded, the error is raised
+        jwks.flush()
+        with pytest.raises(Exception, match="JWKS unavailable"):
+            self.verify(self.token(), jwks)
+
+    def test_keys_are_served_during_refresh(self):
+        import threading
+        from cis_crypto import auth
+
+        jwks = auth.JWKSCache(self.fetch, ttl=60, refresh_interval=30)
+        assert self.verify(self.token(), jwks) is not None
+        jwks._fetched -= 120
+        jwks._attempted -= 120
+
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_fetch():
+            started.set()
+            release.wait(5)
+            return self.fetch()
+
+        jwks.fetch = slow_fetch
+        thread = threading.Thread(target=jwks.get_key, args=("test-kid",))
+        thread.start()
+        try:
+            assert started.wait(5)
+            # The fetch does not block other requests, which use the keys loaded previously
+            assert jwks.get_key("test-kid") is not None
+            assert self.fetches == 1
+        finally:
+            release.set()
+            thread.join()
+        assert self.fetches == 2
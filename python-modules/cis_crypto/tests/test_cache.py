@@ -0,0 +1,100 @@
+import os
+import time
+
+
+class TestCache(object):
+    def setup(self):
+        os.environ["CIS_SECRET_MANAGER_FILE_PATH"] = "tests/fixture"
+        os.environ["CIS_SECRET_MANAGER"] = "file"
+        os.environ["CIS_SIGNING_KEY_NAME"] = "fake-access-file-key.priv.pem"
+        os.environ["CIS_PUBLIC_KEY_NAME"] = "fake-access-file-key.pub.pem"
+        os.environ["CIS_WELL_KNOWN_MODE"] = "file"
+
+    def test_signature_cache(self):
+        from cis_crypto.cache import SignatureCache
+
+        cache = SignatureCache(max_entries=2, ttl=60)
+        cache.put("sig1", "kid", b"payload1")
+        cache.put("sig2", "kid", b"payload2")
+        assert cache.get("sig1", "kid") == b"payload1"
+        assert cache.get("sig1", "otherkid") is None
+
+        # sig2 is the least recently used entry
+        cache.put("sig3", "kid", b"payload3")
+        assert len(cache) == 2
+        assert cache.get("sig2", "kid") is None
+        assert cache.get("sig3", "kid") == b"payload3"
+
+        # Key sets changes flush the cache
+        cache.check_key_set("publisher", "kid")
+        assert cache.get("sig3", "kid") == b"payload3"
+        cache.check_key_set("publisher", "newkid")
+        assert len(cache) == 0
+
+    def test_signature_cache_ttl(self):
+        from cis_crypto.cache import SignatureCache
+
+        cache = SignatureCache(max_entries=2, ttl=0)
+        cache.put("sig1", "kid", b"payload1")
+        time.sleep(0.01)
+        assert cache.get("sig1", "kid") is None
+        assert len(cache) == 0
+
+    def test_cache_is_opt_in(self, monkeypatch):
+        from cis_crypto import cache
+        from cis_crypto import operation
+
+        monkeypatch.delenv("CIS_SIGNATURE_CACHE_SIZE", raising=False)
+        monkeypatch.setattr(cache, "_signature_cache", None)
+        assert cache.get_signature_cache() is None
+        assert operation.Verify().signature_cache is None
+
+    def test_verify_uses_cache(self, monkeypatch):
+        from cis_crypto import cache
+        from cis_crypto import operation
+        from cis_crypto.cache import get_signature_cache
+
+        monkeypatch.setenv("CIS_SIGNATURE_CACHE_SIZE", "1000")
+        monkeypatch.setattr(cache, "_signature_cache", None)
+        s = operation.Sign()
+        s.load({"values": {"test_key": "test_data"}})
+        sig = s.jws()
+
+        o = operation.Verify()
+        assert o.signature_cache is not None
+        assert o.signature_cache is get_signature_cache()
+        o.load(sig)
+        payload = o.jws()
+        hits = o.signature_cache.hits
+        o.load(sig)
+        assert o.jws() == payload
+        assert o.signature_cache.hits == hits + 1
+
+    def test_cached_signature_is_scoped_to_publisher(self):
+        import json
+        import pytest
+        from cis_crypto import operation
+        from cis_crypto.cache import SignatureCache
+        from jose.exceptions import JWSError
+
+        os.environ["CIS_SIGNING_KEY_NAME"] = "fake-publisher-key_0.priv.pem"
+        os.environ["CIS_PUBLIC_KEY_NAME"] = "fake-publisher-key_0.pub.pem"
+        s = operation.Sign()
+        s.load({"values": {"test_key": "test_data"}})
+        sig = s.jws()
+
+        with open("tests/fixture/mozilla-iam.json") as fh:
+            well_known = json.load(fh)
+        o = operation.Verify()
+        o.signature_cache = SignatureCache()
+        o.well_known_mode = "https"
+        o.well_known = well_known
+        o.load(sig)
+        payload = o.jws("fake-publisher-thompson_info")
+        o.load(sig)
+        assert o.jws("fake-publisher-thompson_info") == payload
+
+        # The signature is cached for the key of thompson_info, it must not be accepted for another publisher
+        o.load(sig)
+        with pytest.raises(JWSError):
+            o.jws("fake-publisher-medina_com")
@@ -0,0 +1,72 @@
+import json
+import os
+from jose import jws
+
+
+class TestKeyRing(object):
+    def setup(self):
+        os.environ["CIS_SECRET_MANAGER_FILE_PATH"] = "tests/fixture"
+        os.environ["CIS_SECRET_MANAGER"] = "file"
+        os.environ["CIS_SIGNING_KEY_NAME"] = "fake-access-file-key.priv.pem"
+        os.environ["CIS_PUBLIC_KEY_NAME"] = "fake-access-file-key.pub.pem"
+        os.environ["CIS_WELL_KNOWN_MODE"] = "file"
+
+    def test_sign_emits_kid(self):
+        from cis_crypto import keyring
+        from cis_crypto import operation
+
+        s = operation.Sign()
+        s.load({"values": {"test_key": "test_data"}})
+        header = jws.get_unverified_header(s.jws())
+
+        ring = keyring.get_file_keyring("tests/fixture/fake-access-file-key.pub.pem")
+        assert header["kid"] == keyring.thumbprint(s._get_key())
+        assert len(ring.select(kid=header["kid"])) == 1
+
+    def test_file_keyring_is_cached(self):
+        from cis_crypto import keyring
+
+        ring = keyring.get_file_keyring("tests/fixture/fake-access-file-key.pub.pem")
+        assert keyring.get_file_keyring("tests/fixture/fake-access-file-key.pub.pem") is ring
+        assert len(ring) == 1
+
+    def test_well_known_keyring(self):
+        from cis_crypto import keyring
+
+        with open("tests/fixture/mozilla-iam.json") as fh:
+            well_known = json.load(fh)
+
+        ring = keyring.get_well_known_keyring(well_known)
+        assert keyring.get_well_known_keyring(well_known) is ring
+
+        publisher_key = well_known["publishers_supported"]["fake-publisher-medina_com"]["jwks_keys"][0]
+        selected = ring.select(kid=publisher_key["kid"], publisher="fake-publisher-medina_com")
+        assert len(selected) == 1
+        assert selected[0][0] == publisher_key["kid"]
+
+        # A key of another key set is not trusted
+        access_file_key = well_known["access_file"]["jwks_keys"][0]
+        if access_file_key["n"] != publisher_key["n"]:
+            assert ring.select(kid=access_file_key["kid"], publisher="fake-publisher-medina_com") == []
+
+        # Unknown kids fall back to all keys of the publisher
+        assert len(ring.select(kid="unknown", publisher="access_file")) == len(well_known["access_file"]["jwks_keys"])
+
+        # Changed keys are picked up
+        changed = json.loads(json.dumps(well_known))
+        changed["publishers_supported"]["fake-publisher-medina_com"]["jwks_keys"] = []
+        changed_ring = keyring.get_well_known_keyring(changed)
+        assert changed_ring is not ring
+        assert changed_ring.fingerprint != ring.fingerprint
+        assert changed_ring.select(publisher="fake-publisher-medina_com") == []
+
+    def test_verify_signature_without_kid(self):
+        from cis_crypto import operation
+
+        with open("tests/fixture/good-signature") as fh:
+            signature = fh.read().rstrip("\n")
+        assert "kid" not in jws.get_unverified_header(signature)
+
+        o = operation.Verify()
+        o.load(signature)
+        assert o.jws() is not None
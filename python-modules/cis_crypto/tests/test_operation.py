@@ -121,6 +121,32 @@ class TestOperation(object):
         res = o.jws()
         assert res is not None
 
+    def test_detached_payload(self):
+        from cis_crypto import operation
+        from jose.exceptions import JWSError
+
+        os.environ["CIS_SECRET_MANAGER_FILE_PATH"] = "tests/fixture"
+        os.environ["CIS_SECRET_MANAGER"] = "file"
+        os.environ["CIS_SIGNING_KEY_NAME"] = "fake-access-file-key.priv.pem"
+        os.environ["CIS_PUBLIC_KEY_NAME"] = "fake-access-file-key.pub.pem"
+        os.environ["CIS_WELL_KNOWN_MODE"] = "file"
+
+        sample_payload = {"values": {"my blog": "https://example.net/blog"}}
+        s = operation.Sign()
+        s.load(sample_payload)
+        sig = s.jws(detached=True)
+        assert sig.split(".")[1] == ""
+
+        o = operation.Verify()
+        o.load(sig)
+        with pytest.raises(JWSError):
+            o.jws()
+        o.load(sig, payload=sample_payload)
+        assert json.loads(o.jws()) == sample_payload
+        o.load(sig, payload={"values": {}})
+        with pytest.raises(JWSError):
+            o.jws()
+
     def test_verify_operation_without_bad_sig(self):
         from cis_crypto import operation
         from jose.exceptions import JWSError
@@ -2,6 +2,7 @@ import boto3
 import json
 import os
 import pytest
+import time
 
 from jose import jwk
 from moto import mock_ssm
@@ -16,6 +17,85 @@ class TestSecretManager(object):
         key_material = manager.get_key("fake-access-file-key.priv.pem")
         assert key_material is not None
 
+    def test_key_cache(self):
+        from cis_crypto import secret
+
+        os.environ["CIS_SECRET_MANAGER_FILE_PATH"] = "tests/fixture"
+        secret.flush()
+        secret.prewarm(["fake-access-file-key.priv.pem"], provider_type="file")
+        manager = secret.Manager(provider_type="file")
+        key_material = manager.get_key("fake-access-file-key.priv.pem")
+        assert secret.Manager(provider_type="file").get_key("fake-access-file-key.priv.pem") is key_material
+
+        # Expired keys are served while they are refreshed in the background
+        cache_key = ("file", "tests/fixture", "fake-access-file-key.priv.pem")
+        secret._key_cache[cache_key] = (0, key_material)
+        assert manager.get_key("fake-access-file-key.priv.pem") is key_material
+        for _ in range(100):
+            if secret._key_cache[cache_key][1] is not key_material:
+                break
+            time.sleep(0.01)
+        assert secret._key_cache[cache_key][0] > time.time()
+        assert secret._key_cache[cache_key][1] is not key_material
+
+    def test_provider_is_loaded_once(self, monkeypatch):
+        from cis_crypto import operation
+        from cis_crypto import secret
+
+        os.environ["CIS_SECRET_MANAGER_FILE_PATH"] = "tests/fixture"
+        os.environ["CIS_SIGNING_KEY_NAME"] = "fake-access-file-key.priv.pem"
+        secret.flush()
+        loads = []
+        load_provider = secret.Manager._load_provider
+        monkeypatch.setattr(secret.Manager, "_load_provider", lambda self: loads.append(1) or load_provider(self))
+        manager = secret.Manager(provider_type="file")
+        key_material = manager.get_key("fake-access-file-key.priv.pem")
+        assert manager.get_key("fake-access-file-key.priv.pem") is key_material
+        assert len(loads) == 1
+
+        # The key is resolved once per signature
+        gets = []
+        get_key = secret.Manager.get_key
+        monkeypatch.setattr(secret.Manager, "get_key", lambda self, key_name: gets.append(1) or get_key(self, key_name))
+        s = operation.Sign()
+        s.load({"values": {"test_key": "test_data"}})
+        s.jws()
+        assert len(gets) == 1
+
+    def test_file_ssm_provider_fetches_once_per_process(self, monkeypatch, tmp_path):
+        from cis_crypto import operation
+        from cis_crypto import secret
+
+        with open("tests/fixture/fake-access-file-key.priv.pem", "rb") as fh:
+            key_dict = jwk.construct(fh.read(), "RS256").to_dict()
+        for k, v in key_dict.items():
+            if isinstance(v, bytes):
+                key_dict[k] = v.decode()
+        (tmp_path / "baz").mkdir()
+        (tmp_path / "baz" / "fake-access-file-key").write_text(json.dumps(key_dict))
+
+        monkeypatch.setenv("CIS_SECRET_MANAGER", "file-ssm")
+        monkeypatch.setenv("CIS_SECRET_MANAGER_FILE_PATH", str(tmp_path))
+        monkeypatch.setenv("CIS_SECRET_MANAGER_SSM_PATH", "/baz")
+        monkeypatch.setenv("CIS_SIGNING_KEY_NAME", "fake-access-file-key")
+        secret.flush()
+        fetches = []
+        get_parameter = secret.FileParameterstoreProvider._get_parameter
+        monkeypatch.setattr(
+            secret.FileParameterstoreProvider,
+            "_get_parameter",
+            lambda self, name: fetches.append(name) or get_parameter(self, name),
+        )
+
+        # Every profile has its own Sign operation, and its own secret manager
+        signatures = []
+        for i in range(5):
+            s = operation.Sign()
+            s.load({"values": {"test_key": i}})
+            signatures.append(s.jws())
+        assert len(set(signatures)) == 5
+        assert fetches == ["/baz/fake-access-file-key"]
+
     @mock_ssm
     def test_ssm_provider(self):
         from cis_crypto import secret
@@ -46,6 +126,8 @@ class TestSecretManager(object):
         manager = secret.Manager(provider_type="aws-ssm")
         key_material = manager.get_key("fake-access-file-key")
         assert key_material is not None
+        # Cached, without another SSM call
+        assert manager.get_key("fake-access-file-key") is key_material
 
     @mock_ssm
     @pytest.mark.xfail
@@ -5,5 +5,6 @@
 from cis_identity_vault import common
 from cis_identity_vault import vault
 from cis_identity_vault import autoscale
+from cis_identity_vault import cache
 
-__all__ = [common, vault, autoscale]
+__all__ = [common, vault, autoscale, cache]
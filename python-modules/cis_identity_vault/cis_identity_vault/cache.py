@@ -0,0 +1,298 @@
+"""In-process read-through cache of identity vault lookups, optionally invalidated from the vault DynamoDB stream.
+
+Hot profiles are then served from memory rather than with a Query (and its read capacity) per request.  Entries expire
+after `vault_cache_ttl` seconds (30 by default), and the cache is bounded both in number of entries
+(`vault_cache_max_entries`) and in approximate bytes (`vault_cache_max_bytes`), evicting the least recently used first.
+
+A StreamInvalidator thread, running in the process that holds the cache, drops entries as soon as the vault items
+change.  DynamoDB Streams throttle more than two concurrent readers per shard, so this only suits long-running
+deployments with few processes.  Deployments without a StreamInvalidator thread (e.g. on AWS Lambda, where each
+container holds its own cache) rely on the TTL alone: lookups may be up to `vault_cache_ttl` seconds stale.
+"""
+import boto3
+import collections
+import logging
+import threading
+import time
+from cis_identity_vault.common import get_config
+from cis_identity_vault.models.user import Profile
+from cis_identity_vault.models.user import _item_size
+
+
+logger = logging.getLogger(__name__)
+
+# Vault item attributes profiles are looked up by, see Profile.find_by_*()
+LOOKUP_ATTRIBUTES = ("id", "uuid", "primary_email", "primary_username")
+
+# Process-wide cache, see get_cache()
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Returns the process-wide LookupCache, created from the settings on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LookupCache()
+        return _cache
+
+
+def _stream_strings(image):
+    """Returns dict the string attributes of a (low-level, typed) DynamoDB stream record image."""
+    return {k: v["S"] for k, v in (image or {}).items() if isinstance(v, dict) and "S" in v}
+
+
+class LookupCache(object):
+    """LRU cache of the items returned by vault lookups, keyed by (attribute, value).
+
+    Lookups that matched no item are cached too, so that repeated requests for unknown users do not reach DynamoDB."""
+
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None):
+        config = get_config()
+        if max_entries is None:
+            max_entries = int(config("vault_cache_max_entries", namespace="cis", default="10000"))
+        if max_bytes is None:
+            max_bytes = int(config("vault_cache_max_bytes", namespace="cis", default=str(64 * 1024 * 1024)))
+        if ttl is None:
+            ttl = int(config("vault_cache_ttl", namespace="cis", default="30"))
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # (attribute, value): (expiry time, items, size)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        # Bumped by each invalidation, so that lookups racing with an invalidation do not cache stale items
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, attribute, value):
+        """Returns list of the cached items for the lookup, possibly empty, or None if it is not cached."""
+        key = (attribute, value)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if not entry[1]:
+                self.negative_hits += 1
+            return [dict(item) for item in entry[1]]
+
+    def put(self, attribute, value, items, generation=None):
+        """Caches the @items found for the lookup, unless the cache was invalidated since @generation."""
+        key = (attribute, value)
+        size = len(attribute) + len(value) + _item_size(items)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if self.ttl <= 0 or size > self.max_bytes:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + self.ttl, [dict(item) for item in items], size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def invalidate_item(self, item):
+        """Drops the cached lookups that may return @item (a vault item, or any dict with its lookup attributes)."""
+        with self._lock:
+            self.generation += 1
+            for attribute in LOOKUP_ATTRIBUTES:
+                if item.get(attribute):
+                    self._remove((attribute, item[attribute]))
+            self.invalidations += 1
+
+    def invalidate_records(self, records):
+        """Drops the cached lookups affected by DynamoDB stream @records (e.g. the `Records` of a Lambda event).
+
+        Both the old and the new image of modified items are invalidated, as their lookup attributes may differ."""
+        for record in records:
+            data = record.get("dynamodb", {})
+            for image in (data.get("Keys"), data.get("OldImage"), data.get("NewImage")):
+                strings = _stream_strings(image)
+                if strings:
+                    self.invalidate_item(strings)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Returns dict of the counters of the cache."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "negative_hits": self.negative_hits,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class CachedProfile(Profile):
+    """Profile whose find_by_* lookups are served from a LookupCache (the process-wide one by default)."""
+
+    def __init__(
+        self, dynamodb_table_resource=None, dynamodb_client=None, transactions=True, compress=None, cache=None
+    ):
+        super(CachedProfile, self).__init__(dynamodb_table_resource, dynamodb_client, transactions, compress)
+        self.cache = cache if cache is not None else get_cache()
+
+    def _cached(self, attribute, value, find_by):
+        items = self.cache.get(attribute, value)
+        if items is not None:
+            return {"Items": items, "Count": len(items)}
+        generation = self.cache.generation
+        result = find_by(value)
+        self.cache.put(attribute, value, result["Items"], generation)
+        return result
+
+    def find_by_id(self, id):
+        return self._cached("id", id, super(CachedProfile, self).find_by_id)
+
+    def find_by_uuid(self, uuid):
+        return self._cached("uuid", uuid, super(CachedProfile, self).find_by_uuid)
+
+    def find_by_email(self, primary_email):
+        return self._cached("primary_email", primary_email, super(CachedProfile, self).find_by_email)
+
+    def find_by_username(self, primary_username):
+        return self._cached("primary_username", primary_username, super(CachedProfile, self).find_by_username)
+
+
+class StreamInvalidator(object):
+    """Consumes the DynamoDB stream of the vault table (see IdentityVault.enable_stream()) in a background thread,
+    invalidating the cached lookups of the items that changed."""
+
+    # Seconds between two listings of the shards of the stream, which change as the stream is resharded
+    SHARD_REFRESH_INTERVAL = 60
+
+    def __init__(self, table, cache=None, streams_client=None, poll_interval=None):
+        self.table = table
+        self.cache = cache if cache is not None else get_cache()
+        if streams_client is None:
+            streams_client = boto3.client("dynamodbstreams", region_name=table.meta.client.meta.region_name)
+        self.streams_client = streams_client
+        if poll_interval is None:
+            poll_interval = float(get_config()("vault_cache_stream_poll_interval", namespace="cis", default="1"))
+        self.poll_interval = poll_interval
+        self.stream_arn = None
+        # shard id: shard iterator, None once the shard is closed and fully read
+        self._iterators = {}
+        # shard id: (shard iterator type, sequence number) where reading the shard resumes from, see _resume()
+        self._positions = {}
+        self._shards_refreshed = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _refresh_shards(self):
+        """Starts reading the shards of the stream that are not read yet: open shards from now on, shards created
+        since the previous refresh from their start."""
+        first = not self._iterators
+        description = self.streams_client.describe_stream(StreamArn=self.stream_arn)["StreamDescription"]
+        for shard in description.get("Shards", []):
+            shard_id = shard["ShardId"]
+            if shard_id in self._iterators:
+                continue
+            closed = "EndingSequenceNumber" in shard.get("SequenceNumberRange", {})
+            if first and closed:
+                # Changes from before we started do not matter
+                self._iterators[shard_id] = None
+                continue
+            self._positions[shard_id] = ("LATEST" if first else "TRIM_HORIZON", None)
+            self._iterators[shard_id] = self._get_iterator(shard_id)
+        self._shards_refreshed = time.time()
+
+    def _get_iterator(self, shard_id):
+        iterator_type, sequence_number = self._positions[shard_id]
+        kwargs = {"SequenceNumber": sequence_number} if sequence_number is not None else {}
+        response = self.streams_client.get_shard_iterator(
+            StreamArn=self.stream_arn, ShardId=shard_id, ShardIteratorType=iterator_type, **kwargs
+        )
+        return response["ShardIterator"]
+
+    def _resume(self):
+        """Gets new iterators (e.g. after expired ones) from the last record read of each shard, so that no record is
+        skipped. Shards read from LATEST that had no record yet cannot be resumed: the cache is cleared instead."""
+        for shard_id, iterator in list(self._iterators.items()):
+            if iterator is None:
+                continue
+            if self._positions[shard_id][0] == "LATEST":
+                self.cache.clear()
+            self._iterators[shard_id] = self._get_iterator(shard_id)
+
+    def poll(self):
+        """Reads the new records of all shards once and invalidates the lookups they affect. Returns int the number
+        of records read."""
+        if self.stream_arn is None:
+            self.table.reload()
+            self.stream_arn = self.table.latest_stream_arn
+            if self.stream_arn is None:
+                raise ValueError("The stream of table {} is not enabled.".format(self.table.name))
+        if not self._iterators or time.time() - self._shards_refreshed > self.SHARD_REFRESH_INTERVAL:
+            self._refresh_shards()
+
+        count = 0
+        for shard_id, iterator in list(self._iterators.items()):
+            if iterator is None:
+                continue
+            response = self.streams_client.get_records(ShardIterator=iterator)
+            records = response.get("Records", [])
+            self.cache.invalidate_records(records)
+            count += len(records)
+            if records:
+                self._positions[shard_id] = ("AFTER_SEQUENCE_NUMBER", records[-1]["dynamodb"]["SequenceNumber"])
+            self._iterators[shard_id] = response.get("NextShardIterator")
+            if self._iterators[shard_id] is None:
+                # The shard was closed: its children are found by the next refresh
+                self._shards_refreshed = 0
+        return count
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning("Could not read the vault stream, resuming from the last record read: {}".format(e))
+                try:
+                    self._resume()
+                except Exception as e:
+                    # e.g. the records were trimmed from the stream: start over, without the entries we may have
+                    # missed the invalidation of
+                    logger.warning("Could not resume reading the vault stream, starting over: {}".format(e))
+                    self._iterators = {}
+                    self._positions = {}
+                    self.cache.clear()
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        """Starts consuming the stream in a background thread. Returns self."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="cis-vault-stream")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
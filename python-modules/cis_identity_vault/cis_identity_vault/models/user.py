@@ -9,23 +9,205 @@ user_profile must be passed to this in the form required by dynamodb
     'profile': 'jsondumpofuserfullprofile'
 }
 """
+import concurrent.futures
 import json
 import logging
+import queue
+import random
+import threading
+import time
 import uuid
+import zlib
 from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import Binary
 from botocore.exceptions import ClientError
 from botocore.exceptions import ParamValidationError
+from cis_identity_vault.common import get_config
 
 
 logger = logging.getLogger(__name__)
 
+# BatchGetItem accepts at most 100 keys per call
+BATCH_GET_SIZE = 100
+# Number of BatchGetItem calls run concurrently, see Profile.find_digests()
+BATCH_GET_WORKERS = 4
+# Number of attempts to fetch the keys DynamoDB left unprocessed (e.g. when throttled)
+BATCH_GET_ATTEMPTS = 5
+# TransactWriteItems limits: number of items and request size (4 MB, less some room for the request envelope)
+TRANSACTION_MAX_ITEMS = 100
+TRANSACTION_MAX_BYTES = 4 * 1024 * 1024 - 64 * 1024
+# Number of transactions run concurrently, see Profile._run_transaction_batch()
+TRANSACTION_WORKERS = 4
+# Number of attempts of a throttled or cancelled (conflicting) transaction
+TRANSACTION_ATTEMPTS = 5
+# Default number of segments of parallel scans, each scanned by its own thread, see Profile.scan()
+SCAN_SEGMENTS = 4
+# Marker (and version) of zlib compressed `profile` attribute values, see encode_profile()
+COMPRESSED_PROFILE_MARKER = b"cisz1:"
+# Optional attribute holding the digest of the profile content (see cis_profile.common.profile_digest()), used to skip
+# writes that would not change anything
+DIGEST_ATTRIBUTE = "profile_digest"
+# Errors after which a transaction is retried, as error codes or cancellation reason codes
+TRANSACTION_RETRYABLE_ERRORS = [
+    "ProvisionedThroughputExceeded",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "ThrottlingError",
+    "ThrottlingException",
+    "TransactionConflict",
+    "TransactionInProgressException",
+    "InternalServerError",
+]
+
+
+def _outcome(user_profile, status, error=None):
+    """Returns dict the outcome of the write of a profile in a batch."""
+    outcome = {"id": user_profile["id"], "sequence_number": user_profile["sequence_number"], "status": status}
+    if error is not None:
+        outcome["error"] = error
+    return outcome
+
+
+def _batch_status(outcomes):
+    """Returns int the status of a batch: 200 if all profiles were written, 207 if only some were."""
+    failures = [outcome["status"] for outcome in outcomes if outcome["status"] != 200]
+    if not failures:
+        return 200
+    elif len(failures) < len(outcomes):
+        return 207
+    return failures[0]
+
+
+def _cancellation_reasons(error):
+    """
+    Returns list of the cancellation reasons (dicts with a `Code` and maybe a `Message`) of each item of a cancelled
+    transaction, or None. Reasons are parsed from the error message if the response does not list them.
+    """
+    reasons = error.response.get("CancellationReasons")
+    if reasons is None:
+        message = error.response.get("Error", {}).get("Message", "")
+        if message.endswith("]") and "[" in message:
+            codes = message.rsplit("[", 1)[1].rstrip("]").split(",")
+            reasons = [{"Code": code.strip()} for code in codes]
+    return reasons
+
+
+def encode_profile(profile, compress=False):
+    """
+    Returns the value to store in the `profile` attribute for the profile JSON str @profile: the str itself, or
+    binary zlib compressed JSON prefixed with COMPRESSED_PROFILE_MARKER if @compress is True.
+    """
+    if not compress or not isinstance(profile, str):
+        return profile
+    return COMPRESSED_PROFILE_MARKER + zlib.compress(profile.encode("utf-8"))
+
+
+def decode_profile(value):
+    """Returns the profile JSON str of a `profile` attribute value, whether it is compressed or not."""
+    if isinstance(value, Binary):
+        value = value.value
+    if isinstance(value, (bytes, bytearray)):
+        if not value.startswith(COMPRESSED_PROFILE_MARKER):
+            raise ValueError("Unknown profile encoding")
+        start = len(COMPRESSED_PROFILE_MARKER)
+        return zlib.decompress(value[start:]).decode("utf-8")
+    return value
+
+
+def _decode_item(item):
+    """Decodes the `profile` attribute of a vault item in place. Returns the item."""
+    if "profile" in item:
+        item["profile"] = decode_profile(item["profile"])
+    return item
+
+
+def _item_size(o):
+    """Returns int the approximate serialized size in bytes of a (low-level) DynamoDB request item."""
+    if isinstance(o, dict):
+        return sum(len(k) + _item_size(v) for k, v in o.items())
+    elif isinstance(o, list):
+        return sum(_item_size(v) for v in o)
+    elif isinstance(o, str):
+        return len(o.encode("utf-8"))
+    elif isinstance(o, (bytes, bytearray)):
+        return len(o)
+    return len(str(o))
+
+
+def _put_until(q, item, stop):
+    """Puts @item in the queue @q, unless the @stop event is set first."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
 
 class Profile(object):
-    def __init__(self, dynamodb_table_resource=None, dynamodb_client=None, transactions=True):
-        """Take a dynamodb table resource to use for operations."""
+    def __init__(self, dynamodb_table_resource=None, dynamodb_client=None, transactions=True, compress=None):
+        """Take a dynamodb table resource to use for operations.
+
+        Profiles are written compressed if @compress is True, which defaults to the `vault_compress_profiles` setting.
+        Compressed and uncompressed items are read alike, so writers can switch compression on one at a time."""
         self.table = dynamodb_table_resource
         self.client = dynamodb_client
         self.transactions = transactions
+        if compress is None:
+            compress = get_config()("vault_compress_profiles", namespace="cis", default="false") == "true"
+        self.compress = compress
+
+    def _encode_item(self, user_profile):
+        """Returns a copy of the vault item @user_profile with its `profile` attribute encoded for storage."""
+        return dict(user_profile, profile=encode_profile(user_profile["profile"], self.compress))
+
+    def _profile_attribute(self, user_profile):
+        """Returns the low-level (typed) value of the `profile` attribute of the vault item @user_profile."""
+        value = encode_profile(user_profile["profile"], self.compress)
+        if isinstance(value, bytes):
+            return {"B": value}
+        return {"S": value}
+
+    def _put_item(self, user_profile):
+        """Returns the low-level (typed) item of a transactional Put of the vault item @user_profile."""
+        item = {
+            "id": {"S": user_profile["id"]},
+            "uuid": {"S": user_profile["uuid"]},
+            "profile": self._profile_attribute(user_profile),
+            "primary_email": {"S": user_profile["primary_email"]},
+            "primary_username": {"S": user_profile["primary_username"]},
+            "sequence_number": {"S": user_profile["sequence_number"]},
+        }
+        if user_profile.get(DIGEST_ATTRIBUTE):
+            item[DIGEST_ATTRIBUTE] = {"S": user_profile[DIGEST_ATTRIBUTE]}
+        return item
+
+    def _update_item(self, user_profile):
+        """Returns the low-level (typed) transactional Update of the vault item @user_profile."""
+        values = {
+            ":p": self._profile_attribute(user_profile),
+            ":u": {"S": user_profile["uuid"]},
+            ":pe": {"S": user_profile["primary_email"]},
+            ":pn": {"S": user_profile["primary_username"]},
+            ":sn": {"S": user_profile["sequence_number"]},
+        }
+        # `uuid` is a reserved word
+        expression = "SET profile = :p, primary_email = :pe, sequence_number = :sn, #u = :u, primary_username = :pn"
+        if user_profile.get(DIGEST_ATTRIBUTE):
+            values[":d"] = {"S": user_profile[DIGEST_ATTRIBUTE]}
+            expression = expression + ", {} = :d".format(DIGEST_ATTRIBUTE)
+        else:
+            # A digest left from a previous write no longer matches the profile
+            expression = expression + " REMOVE {}".format(DIGEST_ATTRIBUTE)
+        return {
+            "Key": {"id": {"S": user_profile["id"]}},
+            "ExpressionAttributeNames": {"#u": "uuid"},
+            "ExpressionAttributeValues": values,
+            "ConditionExpression": "attribute_exists(id)",
+            "UpdateExpression": expression,
+            "TableName": self.table.name,
+            "ReturnValuesOnConditionCheckFailure": "NONE",
+        }
 
     def _run_transaction(self, transact_items):
         response = self.client.transact_write_items(
@@ -48,21 +230,14 @@ class Profile(object):
     def _create_without_transaction(self, user_profile):
         if user_profile["sequence_number"] is None:
             user_profile["sequence_number"] = str(uuid.uuid4().int)
-        return self.table.put_item(Item=user_profile)
+        return self.table.put_item(Item=self._encode_item(user_profile))
 
     def _create_with_transaction(self, user_profile):
         if user_profile["sequence_number"] is None:
             user_profile["sequence_number"] = str(uuid.uuid4().int)
         transact_items = {
             "Put": {
-                "Item": {
-                    "id": {"S": user_profile["id"]},
-                    "uuid": {"S": user_profile["uuid"]},
-                    "profile": {"S": user_profile["profile"]},
-                    "primary_email": {"S": user_profile["primary_email"]},
-                    "primary_username": {"S": user_profile["primary_username"]},
-                    "sequence_number": {"S": user_profile["sequence_number"]},
-                },
+                "Item": self._put_item(user_profile),
                 "ConditionExpression": "attribute_not_exists(id)",
                 "TableName": self.table.name,
                 "ReturnValuesOnConditionCheckFailure": "NONE",
@@ -78,26 +253,11 @@ class Profile(object):
         return res
 
     def _update_with_transaction(self, user_profile):
-        transact_items = {
-            "Update": {
-                "Key": {"id": {"S": user_profile["id"]}},
-                "ExpressionAttributeValues": {
-                    ":p": {"S": user_profile["profile"]},
-                    ":u": {"S": user_profile["uuid"]},
-                    ":pe": {"S": user_profile["primary_email"]},
-                    ":pn": {"S": user_profile["primary_username"]},
-                    ":sn": {"S": user_profile["sequence_number"]},
-                },
-                "ConditionExpression": "attribute_exists(id)",
-                "UpdateExpression": "SET profile = :p, primary_email = :pe, sequence_number = :sn, uuid = :u, primary_username = :pe",
-                "TableName": self.table.name,
-                "ReturnValuesOnConditionCheckFailure": "NONE",
-            }
-        }
+        transact_items = {"Update": self._update_item(user_profile)}
         return self._run_transaction([transact_items])
 
     def _update_without_transaction(self, user_profile):
-        return self.table.put_item(Item=user_profile)
+        return self.table.put_item(Item=self._encode_item(user_profile))
 
     def delete(self, user_profile):
         if self.transactions:
@@ -126,24 +286,26 @@ class Profile(object):
         for profile in list_of_profiles:
             sequence_numbers.append(profile["sequence_number"])
         if self.transactions:
-            res = self._create_items_with_transaction(list_of_profiles)
-
-            if res.get("ResponseMetadata", False):
-                status_code = res["ResponseMetadata"]["HTTPStatusCode"]
-
-            return {"status": status_code, "sequence_numbers": sequence_numbers}
+            outcomes = self._create_items_with_transaction(list_of_profiles)
+            return {"status": _batch_status(outcomes), "sequence_numbers": sequence_numbers, "profiles": outcomes}
         else:
-            try:
-                res = self._put_items_without_transaction(list_of_profiles)
-                return {"status": "200", "sequence_numbers": sequence_numbers}
-            except Exception as e:
-                logger.error("Could not write batch due to: {}".format(e))
-                return {"status": "500", "sequence_numbers": sequence_numbers}
+            return self._write_batch_without_transaction(list_of_profiles, sequence_numbers)
+
+    def _write_batch_without_transaction(self, list_of_profiles, sequence_numbers):
+        """Puts the profiles in one batch and returns the outcome of the batch, which succeeds or fails as a whole."""
+        try:
+            self._put_items_without_transaction(list_of_profiles)
+            outcomes = [_outcome(profile, 200) for profile in list_of_profiles]
+            return {"status": 200, "sequence_numbers": sequence_numbers, "profiles": outcomes}
+        except Exception as e:
+            logger.error("Could not write batch due to: {}".format(e))
+            outcomes = [_outcome(profile, 500, str(e)) for profile in list_of_profiles]
+            return {"status": 500, "sequence_numbers": sequence_numbers, "profiles": outcomes}
 
     def _put_items_without_transaction(self, list_of_profiles):
         with self.table.batch_writer() as batch:
             for profile in list_of_profiles:
-                batch.put_item(Item=profile)
+                batch.put_item(Item=self._encode_item(profile))
 
     def _create_items_with_transaction(self, list_of_profiles):
         transact_items = []
@@ -152,14 +314,7 @@ class Profile(object):
                 user_profile["sequence_number"] = str(uuid.uuid4().int)
             transact_item = {
                 "Put": {
-                    "Item": {
-                        "id": {"S": user_profile["id"]},
-                        "uuid": {"S": user_profile["uuid"]},
-                        "profile": {"S": user_profile["profile"]},
-                        "primary_email": {"S": user_profile["primary_email"]},
-                        "primary_username": {"S": user_profile["primary_username"]},
-                        "sequence_number": {"S": user_profile["sequence_number"]},
-                    },
+                    "Item": self._put_item(user_profile),
                     "ConditionExpression": "attribute_not_exists(id)",
                     "TableName": self.table.name,
                     "ReturnValuesOnConditionCheckFailure": "NONE",
@@ -167,40 +322,110 @@ class Profile(object):
             }
             transact_items.append(transact_item)
         logger.debug("Attempting to create batch of transactions for: {}".format(transact_items))
-        return self._run_transaction(transact_items)
+        return self._run_transaction_batch(transact_items, list_of_profiles)
 
     def update_batch(self, list_of_profiles):
+        sequence_numbers = [profile["sequence_number"] for profile in list_of_profiles]
         if self.transactions:
-            res = self._update_batch_with_transaction(list_of_profiles)
+            outcomes = self._update_batch_with_transaction(list_of_profiles)
+            return {"status": _batch_status(outcomes), "sequence_numbers": sequence_numbers, "profiles": outcomes}
         else:
-            res = self._put_items_without_transaction(list_of_profiles)
-        return res
+            return self._write_batch_without_transaction(list_of_profiles, sequence_numbers)
 
     def _update_batch_with_transaction(self, list_of_profiles):
         transact_items = []
         for user_profile in list_of_profiles:
-            transact_item = {
-                "Update": {
-                    "Key": {"id": {"S": user_profile["id"]}},
-                    "ExpressionAttributeValues": {
-                        ":p": {"S": user_profile["profile"]},
-                        ":u": {"S": user_profile["uuid"]},
-                        ":pe": {"S": user_profile["primary_email"]},
-                        ":pn": {"S": user_profile["primary_username"]},
-                        ":sn": {"S": user_profile["sequence_number"]},
-                    },
-                    "ConditionExpression": "attribute_exists(id)",
-                    "UpdateExpression": "SET profile = :p, primary_email = :pe, sequence_number = :sn, uuid = :u, primary_username = : pn",
-                    "TableName": self.table.name,
-                    "ReturnValuesOnConditionCheckFailure": "NONE",
-                }
-            }
-            transact_items.append(transact_item)
+            transact_items.append({"Update": self._update_item(user_profile)})
         logger.debug("Attempting to update batch of transactions for: {}".format(transact_items))
-        return self._run_transaction(transact_items)
+        return self._run_transaction_batch(transact_items, list_of_profiles)
+
+    def _chunk_transaction_items(self, transact_items):
+        """Returns list of lists of item indexes, each within the TransactWriteItems item count and size limits."""
+        chunks = []
+        chunk = []
+        chunk_size = 0
+        for index, transact_item in enumerate(transact_items):
+            item_size = _item_size(transact_item)
+            if chunk and (len(chunk) >= TRANSACTION_MAX_ITEMS or chunk_size + item_size > TRANSACTION_MAX_BYTES):
+                chunks.append(chunk)
+                chunk = []
+                chunk_size = 0
+            chunk.append(index)
+            chunk_size += item_size
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def _run_transaction_chunk(self, transact_items):
+        """
+        Runs one transaction, retrying it with jittered exponential backoff when it is throttled or cancelled because
+        of a conflict. Items whose own condition fails are dropped from the retried transaction.
+        Returns dict of item index (in @transact_items) to (status code, error message or None).
+        """
+        pending = list(range(len(transact_items)))
+        results = {}
+        for attempt in range(TRANSACTION_ATTEMPTS):
+            if attempt > 0:
+                time.sleep(random.uniform(0, 0.1 * 2**attempt))
+            try:
+                self._run_transaction([transact_items[i] for i in pending])
+                results.update({i: (200, None) for i in pending})
+                return results
+            except ParamValidationError as e:
+                results.update({i: (400, str(e)) for i in pending})
+                return results
+            except ClientError as e:
+                code = e.response.get("Error", {}).get("Code")
+                reasons = _cancellation_reasons(e)
+                if code == "TransactionCanceledException" and reasons and len(reasons) == len(pending):
+                    retry = []
+                    for i, reason in zip(pending, reasons):
+                        reason_code = reason.get("Code", "None")
+                        if reason_code in ["None", None] or reason_code in TRANSACTION_RETRYABLE_ERRORS:
+                            retry.append(i)
+                        elif reason_code == "ConditionalCheckFailed":
+                            results[i] = (409, reason.get("Message") or reason_code)
+                        else:
+                            results[i] = (500, reason.get("Message") or reason_code)
+                    pending = retry
+                    if not pending:
+                        return results
+                    logger.debug("Transaction cancelled, retrying {} items: {}".format(len(pending), e))
+                elif code in TRANSACTION_RETRYABLE_ERRORS:
+                    logger.debug("Transaction throttled, retrying {} items: {}".format(len(pending), e))
+                else:
+                    results.update({i: (500, str(e)) for i in pending})
+                    return results
+        logger.error("Transaction failed after {} attempts.".format(TRANSACTION_ATTEMPTS))
+        results.update({i: (429, "Transaction throttled or cancelled too many times") for i in pending})
+        return results
+
+    def _run_transaction_batch(self, transact_items, list_of_profiles):
+        """
+        Writes @transact_items in as many transactions as needed, submitted concurrently.
+        Returns list of the outcome of each profile of @list_of_profiles (in the same order), see _outcome().
+        """
+        chunks = self._chunk_transaction_items(transact_items)
+        logger.debug("Writing {} items in {} transactions.".format(len(transact_items), len(chunks)))
+
+        def run(chunk):
+            results = self._run_transaction_chunk([transact_items[i] for i in chunk])
+            return [(chunk[i], status, error) for i, (status, error) in results.items()]
+
+        outcomes = [None] * len(transact_items)
+        if len(chunks) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=TRANSACTION_WORKERS) as executor:
+                chunk_results = list(executor.map(run, chunks))
+        else:
+            chunk_results = [run(chunk) for chunk in chunks]
+        for results in chunk_results:
+            for index, status, error in results:
+                outcomes[index] = _outcome(list_of_profiles[index], status, error)
+        return outcomes
 
     def find_by_id(self, id):
         result = self.table.query(KeyConditionExpression=Key("id").eq(id))
+        result["Items"] = [_decode_item(item) for item in result.get("Items", [])]
         return result
 
     def find_by_email(self, primary_email):
@@ -208,12 +433,14 @@ class Profile(object):
             IndexName="{}-primary_email".format(self.table.table_name),
             KeyConditionExpression=Key("primary_email").eq(primary_email),
         )
+        result["Items"] = [_decode_item(item) for item in result.get("Items", [])]
         return result
 
     def find_by_uuid(self, uuid):
         result = self.table.query(
             IndexName="{}-uuid".format(self.table.table_name), KeyConditionExpression=Key("uuid").eq(uuid)
         )
+        result["Items"] = [_decode_item(item) for item in result.get("Items", [])]
         return result
 
     def find_by_username(self, primary_username):
@@ -221,33 +448,186 @@ class Profile(object):
             IndexName="{}-primary_username".format(self.table.table_name),
             KeyConditionExpression=Key("primary_username").eq(primary_username),
         )
+        result["Items"] = [_decode_item(item) for item in result.get("Items", [])]
         return result
 
+    def _scan_segment(self, kwargs, segment, total_segments, pages, stop):
+        """Scans one segment of the table, putting each page of items in the @pages queue. Runs in its own thread."""
+        client = self.table.meta.client
+        kwargs = dict(kwargs, TableName=self.table.name, Segment=segment, TotalSegments=total_segments)
+        try:
+            while not stop.is_set():
+                response = client.scan(**kwargs)
+                _put_until(pages, response.get("Items", []), stop)
+                if "LastEvaluatedKey" not in response:
+                    break
+                kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        except Exception as e:
+            _put_until(pages, e, stop)
+        finally:
+            _put_until(pages, None, stop)
+
+    def scan(
+        self,
+        total_segments=None,
+        projection_expression=None,
+        filter_expression=None,
+        expression_attribute_names=None,
+        expression_attribute_values=None,
+    ):
+        """
+        Returns a generator over the items of the table, fetched with a parallel (segmented) Scan.
+        Each segment is scanned by its own thread, and items are yielded as soon as their page arrives (in no
+        particular order) rather than accumulated, so that memory use does not depend on the size of the table.
+        @total_segments int number of segments (and threads), defaults to SCAN_SEGMENTS
+        @projection_expression str the attributes to fetch (e.g. "id, primary_email"), defaults to all attributes
+        @filter_expression str or boto3.dynamodb.conditions.Attr condition the items must match
+        @expression_attribute_names dict placeholders (e.g. {"#id": "id"}) used by the expressions
+        @expression_attribute_values dict values (e.g. {":active": True}) used by the expressions
+        """
+        total_segments = total_segments or SCAN_SEGMENTS
+        kwargs = {}
+        if projection_expression is not None:
+            kwargs["ProjectionExpression"] = projection_expression
+        if filter_expression is not None:
+            kwargs["FilterExpression"] = filter_expression
+        if expression_attribute_names is not None:
+            kwargs["ExpressionAttributeNames"] = expression_attribute_names
+        if expression_attribute_values is not None:
+            kwargs["ExpressionAttributeValues"] = expression_attribute_values
+
+        # Bounded, so that segments do not scan much further than what has been consumed
+        pages = queue.Queue(maxsize=total_segments * 2)
+        stop = threading.Event()
+        threads = []
+        for segment in range(total_segments):
+            thread = threading.Thread(
+                target=self._scan_segment,
+                args=(kwargs, segment, total_segments, pages, stop),
+                name="cis-vault-scan-{}".format(segment),
+            )
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        try:
+            running = total_segments
+            while running > 0:
+                page = pages.get()
+                if page is None:
+                    running -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    for item in page:
+                        yield _decode_item(item)
+        finally:
+            # The consumer may stop early or a segment may have failed: stop the other segments
+            stop.set()
+
     @property
     def all(self):
-        response = self.table.scan()
-        users = response.get("Items")
-        while "LastEvaluatedKey" in response:
-            response = self.table.scan(ExclusiveStartKey=response["LastEvaluatedKey"])
-            users.extend(response["Items"])
-        return users
+        """All items of the table, as a list. Prefer scan(), which does not hold all the items in memory."""
+        return list(self.scan())
+
+    def _batch_get_digests(self, ids):
+        """
+        Returns dict of the @ids (at most BATCH_GET_SIZE) that exist in the table to their `profile_digest` and
+        `sequence_number` attributes, with a single BatchGetItem.
+        """
+        client = self.table.meta.client
+        request = {
+            self.table.name: {
+                "Keys": [{"id": id} for id in ids],
+                "ProjectionExpression": "#id, #d, #sn",
+                "ExpressionAttributeNames": {"#id": "id", "#d": DIGEST_ATTRIBUTE, "#sn": "sequence_number"},
+            }
+        }
+        found = {}
+        for attempt in range(BATCH_GET_ATTEMPTS):
+            response = client.batch_get_item(RequestItems=request)
+            for item in response.get("Responses", {}).get(self.table.name, []):
+                found[item["id"]] = item
+            request = response.get("UnprocessedKeys")
+            if not request:
+                return found
+            logger.debug("Retrying {} unprocessed keys.".format(len(request[self.table.name]["Keys"])))
+            time.sleep(0.05 * 2**attempt)
+
+        # Still throttled, fall back to one query per key
+        for key in request[self.table.name]["Keys"]:
+            for item in self.find_by_id(key["id"])["Items"]:
+                found[key["id"]] = item
+        return found
+
+    def find_digests(self, ids):
+        """
+        Returns dict of the @ids that exist in the table to dicts of their `profile_digest` (None for items written
+        without one) and `sequence_number`.
+        Only these attributes are fetched, with chunked BatchGetItem calls run over a small thread pool.
+        """
+        ids = list(dict.fromkeys(ids))  # BatchGetItem rejects duplicate keys
+        chunks = []
+        for start in range(0, len(ids), BATCH_GET_SIZE):
+            end = start + BATCH_GET_SIZE
+            chunks.append(ids[start:end])
+        if len(chunks) <= 1:
+            results = [self._batch_get_digests(chunk) for chunk in chunks]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=BATCH_GET_WORKERS) as executor:
+                results = list(executor.map(self._batch_get_digests, chunks))
+
+        digests = {}
+        for result in results:
+            for id, item in result.items():
+                digests[id] = {
+                    "profile_digest": item.get(DIGEST_ATTRIBUTE),
+                    "sequence_number": item.get("sequence_number"),
+                }
+        return digests
+
+    def find_existing_ids(self, ids):
+        """Returns the set of the @ids that exist in the table, see find_digests()."""
+        return set(self.find_digests(ids))
+
+    def _is_unchanged(self, user_profile, stored):
+        """Returns True if the vault item @user_profile has the same digest as the @stored item (see find_digests())."""
+        digest = user_profile.get(DIGEST_ATTRIBUTE)
+        return stored is not None and digest is not None and stored["profile_digest"] == digest
 
     def find_or_create(self, user_profile):
         profilev2 = json.loads(user_profile["profile"])
-        if len(self.find_by_id(profilev2["user_id"]["value"])["Items"]) > 0:
+        user_id = profilev2["user_id"]["value"]
+        stored = self.find_digests([user_id]).get(user_id)
+        if self._is_unchanged(user_profile, stored):
+            # Nothing to write: report the sequence number of the stored profile, which is the current one
+            logger.info("The user profile is unchanged for: {}".format(user_id))
+            res = {"status": 200, "sequence_number": stored["sequence_number"]}
+        elif stored is not None:
             res = self.update(user_profile)
-            logger.info("A user profile exists already for: {}".format(profilev2["user_id"]["value"]))
+            logger.info("A user profile exists already for: {}".format(user_id))
         else:
             res = self.create(user_profile)
-            logger.info("A user profile does not exist for: {}".format(profilev2["user_id"]["value"]))
+            logger.info("A user profile does not exist for: {}".format(user_id))
         return res
 
-    def find_or_create_batch(self, user_profiles):
+    def find_or_create_batch(self, user_profiles, stored=None):
+        """
+        Creates or updates @user_profiles, skipping the profiles whose digest did not change.
+        @stored dict the result of find_digests() for these profiles, if the caller fetched it already
+        """
         updates = []
         creations = []
-        for user_profile in user_profiles:
-            profilev2 = json.loads(user_profile["profile"])
-            if len(self.find_by_id(profilev2["user_id"]["value"])["Items"]) > 0:
+        unchanged = 0
+        profiles = [json.loads(user_profile["profile"]) for user_profile in user_profiles]
+        if stored is None:
+            stored = self.find_digests([profilev2["user_id"]["value"] for profilev2 in profiles])
+        for user_profile, profilev2 in zip(user_profiles, profiles):
+            user_id = profilev2["user_id"]["value"]
+            if self._is_unchanged(user_profile, stored.get(user_id)):
+                logger.debug("Skipping unchanged profile: {}".format(user_id))
+                unchanged = unchanged + 1
+            elif user_id in stored:
                 logger.debug("Adding profile to the list of updates to perform: {}".format(profilev2))
                 updates.append(user_profile)
             else:
@@ -282,6 +662,7 @@ class Profile(object):
 
         logger.info("Updates were: {}".format(len(updates)))
         logger.info("Creates were: {}".format(len(creations)))
+        logger.info("Unchanged were: {}".format(unchanged))
 
         return [res_create, res_update]
 
@@ -290,4 +671,5 @@ class Profile(object):
             response = self.table.scan(Limit=limit, ExclusiveStartKey=next_page)
         else:
             response = self.table.scan(Limit=limit)
+        response["Items"] = [_decode_item(item) for item in response.get("Items", [])]
         return response
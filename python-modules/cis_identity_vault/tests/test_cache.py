@@ -0,0 +1,118 @@
+import boto3
+import json
+import os
+import pytest
+from cis_identity_vault import vault
+from cis_profile import FakeUser
+from moto import mock_dynamodb2
+from moto import mock_dynamodbstreams
+
+
+def vault_json_datastructure(profile, sequence_number="12345678"):
+    return {
+        "id": profile.get("user_id").get("value"),
+        "uuid": profile["uuid"]["value"],
+        "primary_email": profile.get("primary_email").get("value"),
+        "primary_username": profile.get("primary_username").get("value"),
+        "sequence_number": sequence_number,
+        "profile": json.dumps(profile),
+    }
+
+
+@mock_dynamodb2
+@mock_dynamodbstreams
+class TestLookupCache(object):
+    def setup(self):
+        os.environ["CIS_ENVIRONMENT"] = "testing"
+        os.environ["CIS_REGION_NAME"] = "us-east-1"
+        self.vault_client = vault.IdentityVault()
+        self.vault_client.connect()
+        self.vault_client.find_or_create()
+
+        self.boto_session = boto3.session.Session(region_name="us-east-1")
+        self.dynamodb_client = self.boto_session.client("dynamodb")
+        self.table = self.boto_session.resource("dynamodb").Table("testing-identity-vault")
+        if self.table.latest_stream_arn is None:
+            self.vault_client.enable_stream()
+        self.user_profile = FakeUser().as_dict()
+        self.vault_json_datastructure = vault_json_datastructure(self.user_profile)
+
+    def test_cached_lookups(self):
+        from cis_identity_vault.cache import CachedProfile
+        from cis_identity_vault.cache import LookupCache
+
+        cache = LookupCache(max_entries=10, max_bytes=1024 * 1024, ttl=60)
+        profile = CachedProfile(self.table, self.dynamodb_client, transactions=False, cache=cache)
+        profile.create(self.vault_json_datastructure)
+        user_id = self.vault_json_datastructure["id"]
+        primary_email = self.vault_json_datastructure["primary_email"]
+
+        assert profile.find_by_id(user_id)["Items"][0]["id"] == user_id
+        assert profile.find_by_id(user_id)["Items"][0]["id"] == user_id
+        assert profile.find_by_email(primary_email)["Count"] == 1
+        assert profile.find_by_id("ad|Mozilla-LDAP|missing")["Items"] == []
+        assert profile.find_by_id("ad|Mozilla-LDAP|missing")["Items"] == []
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["negative_hits"], stats["entries"]) == (2, 3, 1, 3)
+
+        # Stale entries are served until invalidated
+        self.vault_json_datastructure["primary_email"] = "changed@example.net"
+        profile.update(self.vault_json_datastructure)
+        assert profile.find_by_id(user_id)["Items"][0]["primary_email"] == primary_email
+        cache.invalidate_item(self.vault_json_datastructure)
+        assert profile.find_by_id(user_id)["Items"][0]["primary_email"] == "changed@example.net"
+
+    def test_bounds(self):
+        from cis_identity_vault.cache import LookupCache
+
+        cache = LookupCache(max_entries=2, max_bytes=100, ttl=60)
+        cache.put("id", "a", [])
+        cache.put("id", "b", [])
+        cache.get("id", "a")
+        cache.put("id", "c", [])
+        # "b" was the least recently used
+        assert cache.get("id", "b") is None
+        assert cache.get("id", "a") == []
+
+        cache.put("id", "big", [{"profile": "x" * 100}])
+        assert cache.get("id", "big") is None
+        cache.put("id", "d", [{"profile": "x" * 80}])
+        assert cache.stats()["bytes"] <= 100
+        assert cache.stats()["evictions"] == 2
+
+        # Lookups racing with an invalidation are not cached
+        generation = cache.generation
+        cache.invalidate_item({"id": "a"})
+        cache.put("id", "e", [], generation)
+        assert cache.get("id", "e") is None
+
+    def test_stream_invalidation(self):
+        from cis_identity_vault.cache import CachedProfile
+        from cis_identity_vault.cache import LookupCache
+        from cis_identity_vault.cache import StreamInvalidator
+
+        cache = LookupCache(max_entries=10, max_bytes=1024 * 1024, ttl=60)
+        profile = CachedProfile(self.table, self.dynamodb_client, transactions=False, cache=cache)
+        invalidator = StreamInvalidator(self.table, cache, self.boto_session.client("dynamodbstreams"))
+        assert invalidator.poll() == 0
+
+        # Negative results are invalidated when the item is created
+        user_id = self.vault_json_datastructure["id"]
+        assert profile.find_by_username(self.vault_json_datastructure["primary_username"])["Items"] == []
+        assert profile.find_by_id(user_id)["Items"] == []
+        profile.create(self.vault_json_datastructure)
+        assert invalidator.poll() == 1
+        assert cache.stats()["entries"] == 0
+        assert profile.find_by_id(user_id)["Count"] == 1
+
+        # Expired iterators are resumed after the last record read, without missing the records written meanwhile
+        profile.find_by_id(user_id)
+        assert cache.stats()["entries"] == 1
+        profile.update(dict(self.vault_json_datastructure, sequence_number="12345679"))
+        invalidator._iterators = {k: "expired" if v is not None else None for k, v in invalidator._iterators.items()}
+        with pytest.raises(Exception):
+            invalidator.poll()
+        invalidator._resume()
+        assert cache.stats()["entries"] == 1
+        assert invalidator.poll() == 1
+        assert cache.stats()["entries"] == 0
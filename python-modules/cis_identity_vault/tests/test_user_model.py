@@ -175,3 +175,253 @@ class TestUsersDynalite(object):
 
         result_for_username = profile.find_by_username(user["primary_username"]["value"])
         assert len(result_for_username.get("Items")) > 0
+
+    def test_find_existing_ids(self):
+        from cis_identity_vault.models import user
+
+        profile = user.Profile(self.table, self.dynamodb_client, transactions=False)
+        profile.create(self.vault_json_datastructure)
+        existing_id = self.vault_json_datastructure["id"]
+
+        # More ids than a single BatchGetItem call accepts, with duplicates
+        ids = ["ad|Mozilla-LDAP|missing-{}".format(i) for i in range(user.BATCH_GET_SIZE + 10)]
+        ids.extend([existing_id, existing_id])
+        assert profile.find_existing_ids(ids) == set([existing_id])
+        assert profile.find_existing_ids([]) == set()
+
+    def test_unchanged_profiles_are_not_written(self):
+        from cis_identity_vault.models import user
+
+        profile = user.Profile(self.table, self.dynamodb_client, transactions=True)
+        vault_json_datastructure = dict(self.vault_json_datastructure, profile_digest="digest-1")
+        profile.find_or_create(vault_json_datastructure)
+        existing_id = vault_json_datastructure["id"]
+        stored = profile.find_digests([existing_id, "ad|Mozilla-LDAP|missing"])
+        assert stored == {existing_id: {"profile_digest": "digest-1", "sequence_number": "12345678"}}
+
+        # Same digest: nothing is written and the stored sequence number is reported
+        unchanged = dict(vault_json_datastructure, sequence_number="12345679")
+        assert profile.find_or_create(unchanged) == {"status": 200, "sequence_number": "12345678"}
+        assert profile.find_or_create_batch([unchanged]) == [None, None]
+        assert profile.find_by_id(existing_id)["Items"][0]["sequence_number"] == "12345678"
+
+        # New digest: the profile is updated along with its digest
+        changed = dict(unchanged, profile_digest="digest-2")
+        res_create, res_update = profile.find_or_create_batch([changed])
+        assert res_update["status"] == 200
+        assert profile.find_digests([existing_id])[existing_id]["profile_digest"] == "digest-2"
+
+        # Updated without a digest: the stored digest no longer describes the profile and is removed
+        without_digest = dict(changed, sequence_number="12345680")
+        del without_digest["profile_digest"]
+        assert profile.update(without_digest) is not None
+        assert profile.find_digests([existing_id])[existing_id]["profile_digest"] is None
+        # So the next write of the profile is not skipped
+        profile.find_or_create(changed)
+        assert profile.find_by_id(existing_id)["Items"][0]["sequence_number"] == "12345679"
+
+    def test_find_or_create_batch(self):
+        from cis_identity_vault.models import user
+
+        profile = user.Profile(self.table, self.dynamodb_client, transactions=False)
+        profile.create(self.vault_json_datastructure)
+
+        new_profile = FakeUser().as_dict()
+        new_vault_json_datastructure = {
+            "id": new_profile.get("user_id").get("value"),
+            "uuid": new_profile["uuid"]["value"],
+            "primary_email": new_profile.get("primary_email").get("value"),
+            "primary_username": new_profile.get("primary_username").get("value"),
+            "sequence_number": "12345679",
+            "profile": json.dumps(new_profile),
+        }
+        res_create, res_update = profile.find_or_create_batch(
+            [self.vault_json_datastructure, new_vault_json_datastructure]
+        )
+        assert res_create["status"] == 200
+        assert res_create["sequence_numbers"] == ["12345679"]
+        assert [outcome["status"] for outcome in res_create["profiles"]] == [200]
+        assert res_update["status"] == 200
+        assert res_update["sequence_numbers"] == [self.vault_json_datastructure["sequence_number"]]
+        assert res_update["profiles"] == [
+            {
+                "id": self.vault_json_datastructure["id"],
+                "sequence_number": self.vault_json_datastructure["sequence_number"],
+                "status": 200,
+            }
+        ]
+        assert len(profile.find_by_id(new_vault_json_datastructure["id"])["Items"]) == 1
+
+    def test_create_batch_in_chunks(self):
+        from cis_identity_vault.models import user
+
+        vault_json_datastructures = []
+        for i in range(3):
+            fake_profile = FakeUser().as_dict()
+            vault_json_datastructures.append(
+                {
+                    # Fake user ids may collide, which would fail the whole transaction
+                    "id": "ad|Mozilla-LDAP|chunk-{}".format(i),
+                    "uuid": fake_profile["uuid"]["value"],
+                    "primary_email": fake_profile.get("primary_email").get("value"),
+                    "primary_username": fake_profile.get("primary_username").get("value"),
+                    "sequence_number": str(i),
+                    "profile": json.dumps(fake_profile),
+                }
+            )
+
+        profile = user.Profile(self.table, self.dynamodb_client, transactions=True)
+        max_items = user.TRANSACTION_MAX_ITEMS
+        user.TRANSACTION_MAX_ITEMS = 2
+        try:
+            assert profile._chunk_transaction_items(["a", "b", "c"]) == [[0, 1], [2]]
+            result = profile.create_batch(vault_json_datastructures)
+            assert result["status"] == 200
+            assert [outcome["status"] for outcome in result["profiles"]] == [200, 200, 200]
+            for vault_json_datastructure in vault_json_datastructures:
+                assert len(profile.find_by_id(vault_json_datastructure["id"])["Items"]) == 1
+
+            # The profiles exist already, so their creation conditions fail
+            result = profile.create_batch(vault_json_datastructures)
+            assert result["status"] == 409
+            assert [outcome["status"] for outcome in result["profiles"]] == [409, 409, 409]
+        finally:
+            user.TRANSACTION_MAX_ITEMS = max_items
+
+    def test_update_batch_with_transaction(self):
+        from cis_identity_vault.models import user
+
+        profile = user.Profile(self.table, self.dynamodb_client, transactions=True)
+        vault_json_datastructures = []
+        for i in range(3):
+            fake_profile = FakeUser().as_dict()
+            vault_json_datastructures.append(
+                {
+                    "id": "ad|Mozilla-LDAP|update-{}".format(i),
+                    "uuid": fake_profile["uuid"]["value"],
+                    "primary_email": fake_profile.get("primary_email").get("value"),
+                    "primary_username": fake_profile.get("primary_username").get("value"),
+                    "sequence_number": str(i),
+                    "profile": json.dumps(fake_profile),
+                }
+            )
+        assert profile.create_batch(vault_json_datastructures[:2])["status"] == 200
+
+        updated = [
+            dict(item, uuid=str(uuid.uuid4()), primary_username="updated-{}".format(i), sequence_number="1{}".format(i))
+            for i, item in enumerate(vault_json_datastructures)
+        ]
+        # The first two profiles exist, the last one does not so its update condition fails
+        result = profile.update_batch(updated)
+        assert result["status"] == 207
+        assert result["sequence_numbers"] == ["10", "11", "12"]
+        assert [outcome["id"] for outcome in result["profiles"]] == [item["id"] for item in updated]
+        assert [outcome["status"] for outcome in result["profiles"]] == [200, 200, 409]
+        assert "error" in result["profiles"][2]
+        for item in updated[:2]:
+            stored = profile.find_by_id(item["id"])["Items"][0]
+            assert (stored["uuid"], stored["primary_username"], stored["sequence_number"]) == (
+                item["uuid"],
+                item["primary_username"],
+                item["sequence_number"],
+            )
+        assert profile.find_by_id(updated[2]["id"])["Items"] == []
+
+        result = profile.update_batch(updated[:2])
+        assert result["status"] == 200
+        assert [outcome["status"] for outcome in result["profiles"]] == [200, 200]
+
+    def test_update_batch_without_transaction(self, monkeypatch):
+        from cis_identity_vault.models import user
+
+        profile = user.Profile(self.table, self.dynamodb_client, transactions=False)
+        profile.create(self.vault_json_datastructure)
+        updated = dict(self.vault_json_datastructure, primary_username="updated", sequence_number="12345680")
+        result = profile.update_batch([updated])
+        assert result == {
+            "status": 200,
+            "sequence_numbers": ["12345680"],
+            "profiles": [{"id": updated["id"], "sequence_number": "12345680", "status": 200}],
+        }
+        assert profile.find_by_id(updated["id"])["Items"][0]["primary_username"] == "updated"
+
+        def fail(list_of_profiles):
+            raise Exception("throttled")
+
+        # The batch fails as a whole
+        monkeypatch.setattr(profile, "_put_items_without_transaction", fail)
+        result = profile.update_batch([updated])
+        assert result["status"] == 500
+        assert result["profiles"] == [
+            {"id": updated["id"], "sequence_number": "12345680", "status": 500, "error": "throttled"}
+        ]
+
+    def test_scan(self):
+        from boto3.dynamodb.conditions import Attr
+        from cis_identity_vault.models import user
+
+        profile = user.Profile(self.table, self.dynamodb_client, transactions=False)
+        for i in range(5):
+            fake_profile = FakeUser().as_dict()
+            profile.create(
+                {
+                    "id": "ad|Mozilla-LDAP|scan-{}".format(i),
+                    "uuid": fake_profile["uuid"]["value"],
+                    "primary_email": fake_profile.get("primary_email").get("value"),
+                    "primary_username": fake_profile.get("primary_username").get("value"),
+                    "sequence_number": str(i),
+                    "profile": json.dumps(fake_profile),
+                }
+            )
+
+        items = list(profile.scan(total_segments=1))
+        assert len(set(item["id"] for item in items)) == len(items)
+        # moto ignores segments (each segment returns all items), so only compare the ids
+        assert set(item["id"] for item in profile.scan(total_segments=3)) == set(item["id"] for item in items)
+
+        items = list(
+            profile.scan(
+                total_segments=1,
+                projection_expression="#id",
+                filter_expression=Attr("id").begins_with("ad|Mozilla-LDAP|scan-"),
+                expression_attribute_names={"#id": "id"},
+            )
+        )
+        assert sorted(item["id"] for item in items) == ["ad|Mozilla-LDAP|scan-{}".format(i) for i in range(5)]
+        assert all(list(item.keys()) == ["id"] for item in items)
+
+        # Consumers can stop early
+        scan = profile.scan(total_segments=2)
+        assert next(scan) is not None
+        scan.close()
+
+    def test_compressed_profiles(self):
+        from cis_identity_vault.models import user
+
+        compressed = user.encode_profile(self.vault_json_datastructure["profile"], compress=True)
+        assert compressed.startswith(user.COMPRESSED_PROFILE_MARKER)
+        assert len(compressed) < len(self.vault_json_datastructure["profile"])
+        assert user.decode_profile(compressed) == self.vault_json_datastructure["profile"]
+
+        # Mixed compressed and uncompressed items, written with and without transactions
+        items = []
+        for i, (transactions, compress) in enumerate([(False, False), (False, True), (True, True)]):
+            fake_profile = FakeUser().as_dict()
+            item = {
+                "id": "ad|Mozilla-LDAP|compressed-{}".format(i),
+                "uuid": fake_profile["uuid"]["value"],
+                "primary_email": fake_profile.get("primary_email").get("value"),
+                "primary_username": fake_profile.get("primary_username").get("value"),
+                "sequence_number": str(i),
+                "profile": json.dumps(fake_profile),
+            }
+            user.Profile(self.table, self.dynamodb_client, transactions=transactions, compress=compress).create(item)
+            items.append(item)
+
+        profile = user.Profile(self.table, self.dynamodb_client, transactions=False)
+        for item in items:
+            assert profile.find_by_id(item["id"])["Items"][0]["profile"] == item["profile"]
+            assert profile.find_by_uuid(item["uuid"])["Items"][0]["profile"] == item["profile"]
+        profiles = {vault_item["id"]: vault_item["profile"] for vault_item in profile.all}
+        assert all(profiles[item["id"]] == item["profile"] for item in items)
+        assert all(isinstance(vault_item["profile"], str) for vault_item in profile.all_by_page(limit=100)["Items"])
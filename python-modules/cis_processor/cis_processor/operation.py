@@ -2,6 +2,7 @@ import json
 from cis_processor import profile
 from cis_processor.common import get_config
 from cis_identity_vault.models import user
+from cis_profile.common import profile_digest
 
 
 from logging import getLogger
@@ -17,13 +18,29 @@ class BaseProcessor(object):
         self.dynamodb_client = dynamodb_client
         self.dynamodb_table = dynamodb_table
         self.config = get_config()
+        # Digest of the profile of the event as published, stored with it in the vault, see _is_unchanged()
+        self.digest = None
 
-    def _load_profiles(self):
-        profile_delegate = profile.ProfileDelegate(self.event_record, self.dynamodb_client, self.dynamodb_table)
+    def _load_profiles(self, profile_delegate=None):
+        if profile_delegate is None:
+            profile_delegate = profile.ProfileDelegate(self.event_record, self.dynamodb_client, self.dynamodb_table)
         self.profiles = profile_delegate.profiles
 
+    def _is_unchanged(self, profile_delegate):
+        """
+        Returns True if the profile of the event has the same digest as the profile stored in the vault, in which
+        case there is nothing to validate or write. Vault items written without a digest are never unchanged.
+
+        The vault digest of a profile is always the digest of the profile as its publisher sent it (here the profile
+        of the event, as the change service stores it), not of the profile after it went through cis_profile.User,
+        so that the same published profile always has the same digest whichever path wrote it.
+        """
+        stored_digest = profile_delegate.old_item.get(user.DIGEST_ATTRIBUTE)
+        return stored_digest is not None and stored_digest == self.digest
+
     def _profile_to_vault_structure(self, user_profile):
         return {
+            user.DIGEST_ATTRIBUTE: self.digest,
             "sequence_number": self.event_record["kinesis"]["sequenceNumber"],
             "primary_email": user_profile["primary_email"]["value"],
             "primary_username": user_profile["primary_username"]["value"],
@@ -33,13 +50,26 @@ class BaseProcessor(object):
         }
 
     def process(self):
-        self._load_profiles()
+        profile_delegate = profile.ProfileDelegate(self.event_record, self.dynamodb_client, self.dynamodb_table)
+        self.digest = profile_digest(profile_delegate.new_profile_json)
+        if self.config("processor_skip_unchanged", namespace="cis", default="True") == "True":
+            if self._is_unchanged(profile_delegate):
+                user_id = profile_delegate.new_profile_json["user_id"]["value"]
+                logger.info("The profile is unchanged, skipping the integration for user: {}".format(user_id))
+                return True
+
+        self._load_profiles(profile_delegate)
         publishers_valid = False
         signatures_valid = False
 
         if self.needs_integration(self.profiles["new_profile"], self.profiles["old_profile"]):
             # Check the rules
-            self.profiles["new_profile"].validate()
+            if self.config("processor_incremental_validation", namespace="cis", default="False") == "True":
+                # Only validate the attributes that changed since the profile currently stored in the vault. This
+                # trusts the stored profile to be valid: profiles of another schema version are validated in full.
+                self.profiles["new_profile"].validate(previous_user=self.profiles["old_profile"])
+            else:
+                self.profiles["new_profile"].validate()
 
             if self.config("processor_verify_publishers", namespace="cis", default="True") == "True":
                 publishers_valid = self.profiles["new_profile"].verify_all_publishers(
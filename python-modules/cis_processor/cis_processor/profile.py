@@ -13,23 +13,39 @@ class ProfileDelegate(object):
         self.event_record = event_record
         self.dynamodb_client = dynamodb_client
         self.dynamodb_table = dynamodb_table
+        # Decoded stream record profile and vault item, loaded at most once, see new_profile_json and old_item
+        self._new_profile_json = None
+        self._old_item = None
 
     @property
     def profiles(self):
         return dict(old_profile=self.load_old_user_profile(), new_profile=self.load_new_user_profile())
 
+    @property
+    def new_profile_json(self):
+        """The profile (dict) of the stream record, decoded once."""
+        if self._new_profile_json is None:
+            kinesis_data = self.event_record["kinesis"]["data"]
+            self._new_profile_json = json.loads(base64.b64decode(kinesis_data))
+        return self._new_profile_json
+
+    @property
+    def old_item(self):
+        """The vault item (dict) of the user of the stream record, fetched once. Empty if the user has none."""
+        if self._old_item is None:
+            vault_user = DynamoDbUser(self.dynamodb_table)
+            search_result = vault_user.find_by_id(self._get_user_id_from_stream())
+            items = search_result.get("Items")
+            self._old_item = items[0] if len(items) > 0 else {}
+        return self._old_item
+
     def _get_user_id_from_stream(self):
-        kinesis_data = self.event_record["kinesis"]["data"]
-        user_profile = json.loads(base64.b64decode(kinesis_data))
-        profile_v2_data = user_profile
-        return profile_v2_data["user_id"]["value"]
+        return self.new_profile_json["user_id"]["value"]
 
     def load_old_user_profile(self):
         user_id = self._get_user_id_from_stream()
-        vault_user = DynamoDbUser(self.dynamodb_table)
-        search_result = vault_user.find_by_id(user_id)
-        if len(search_result.get("Items")) > 0:
-            profile_data = search_result.get("Items")[0]
+        if self.old_item:
+            profile_data = self.old_item
             user_object = User(user_structure_json=json.loads(profile_data["profile"]))
             logger.info("A prior integration has been found for user: {}".format(user_id))
             return user_object
@@ -40,8 +56,5 @@ class ProfileDelegate(object):
 
     def load_new_user_profile(self):
         """Return an instance of cis_profile User."""
-        kinesis_data = self.event_record["kinesis"]["data"]
-        user_profile = json.loads(base64.b64decode(kinesis_data))
-        profile_v2_data = user_profile
-        user_object = User(user_structure_json=profile_v2_data)
+        user_object = User(user_structure_json=self.new_profile_json)
         return user_object
@@ -173,3 +173,35 @@ class TestOperation(object):
                 is True
             )
             assert base_operation.process() is False
+
+    @patch.object(profile.User, "verify_all_publishers")
+    @patch.object(profile.User, "verify_all_signatures")
+    def test_unchanged_profile_is_skipped(self, verify_sigs, verify_pubs):
+        verify_sigs.return_value = True
+        verify_pubs.return_value = True
+        os.environ["CIS_PROCESSOR_VERIFY_SIGNATURES"] = "True"
+        patched_profile = self.mr_mozilla_profile
+        patched_profile["last_name"]["value"] = "anupdatedlastname"
+        kinesis_record = kinesis_event_generate(patched_profile)["Records"][0]
+
+        from cis_processor import operation
+        from cis_identity_vault.models import user
+        from cis_profile.common import profile_digest
+
+        base_operation = operation.BaseProcessor(
+            event_record=kinesis_record, dynamodb_client=self.dynamodb_client, dynamodb_table=self.table
+        )
+        assert base_operation.process() is True
+        assert verify_sigs.call_count == 1
+        item = user.Profile(self.table).find_by_id(patched_profile["user_id"]["value"])["Items"][0]
+        assert item["profile_digest"] == base_operation.digest
+        # The digest of the profile as published, like the change service stores
+        assert item["profile_digest"] == profile_digest(patched_profile)
+
+        # The same profile again: nothing is checked nor written
+        verify_sigs.return_value = False
+        base_operation = operation.BaseProcessor(
+            event_record=kinesis_record, dynamodb_client=self.dynamodb_client, dynamodb_table=self.table
+        )
+        assert base_operation.process() is True
+        assert verify_sigs.call_count == 1
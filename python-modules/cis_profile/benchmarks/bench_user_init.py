@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Compares the cost of creating an empty (null) User:
+- `file`: what User() used to do, reading and parsing data/user_profile_null.json then wrapping it in DotDict
+- `template`: DotDict.clone() of the parsed template, as User() does now
+- `user`: User() itself
+
+Usage: python benchmarks/bench_user_init.py [iterations]
+"""
+
+import json
+import os
+import sys
+import timeit
+
+import cis_profile.common
+from cis_profile.common import DotDict
+from cis_profile.common import get_null_profile
+from cis_profile.profile import User
+
+
+def from_file():
+    path = os.path.join(os.path.dirname(os.path.realpath(cis_profile.common.__file__)), "data/user_profile_null.json")
+    with open(path) as fd:
+        return DotDict(DotDict(json.load(fd)))
+
+
+def from_template():
+    return DotDict.clone(get_null_profile())
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    # Warm up the shared caches (template, well-known documents)
+    User()
+
+    assert from_file() == from_template()
+    for name, fn in [("file", from_file), ("template", from_template), ("user", User)]:
+        best = min(timeit.repeat(fn, number=iterations, repeat=3))
+        print("{:>10}: {:8.1f} us/op".format(name, best / iterations * 1e6))
+
+
+if __name__ == "__main__":
+    main()
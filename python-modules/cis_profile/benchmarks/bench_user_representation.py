@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Compares the "dotdict" and "slots" User representations when loading many profiles, as bulk loads do:
+construction time, memory held by the loaded users, and as_dict() time.
+
+Usage: python benchmarks/bench_user_representation.py [number of profiles]
+"""
+
+import json
+import sys
+import time
+import tracemalloc
+
+from cis_profile import fake_profile
+from cis_profile.profile import User
+
+
+def load(profiles, representation):
+    tracemalloc.start()
+    start = time.perf_counter()
+    users = [User(user_structure_json=json.loads(p), representation=representation) for p in profiles]
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for u in users:
+        u.as_dict()
+    as_dict_elapsed = time.perf_counter() - start
+    return elapsed, size, as_dict_elapsed
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    profiles = [json.dumps(p) for p in fake_profile.batch_create_fake_profiles(seed=1337, number=number)]
+    # Warm up the shared caches (well-known documents, generated classes)
+    User(representation="slots")
+
+    for representation in ["dotdict", "slots"]:
+        elapsed, size, as_dict_elapsed = load(profiles, representation)
+        print(
+            "{:>8}: load {:7.1f} us/profile, {:6.1f} KiB/profile, as_dict {:6.2f} us/profile".format(
+                representation, elapsed / number * 1e6, size / number / 1024, as_dict_elapsed / number * 1e6
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
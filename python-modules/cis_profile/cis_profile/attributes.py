@@ -0,0 +1,277 @@
+"""
+Compact, `__slots__` based representation of the User Profile, generated from the profile schema.
+
+This is an alternative to `cis_profile.common.DotDict` for code that holds many profiles in memory (e.g. bulk loads),
+selected with `User(representation="slots")`.
+Each object kind of the schema (StandardAttributeString, Metadata, Signature, AccessInformationValuesArray, ...) gets
+its own generated class. Instances are views over the raw JSON data (i.e. plain dicts as returned by json.load()):
+- they only hold a reference to the raw data, which is never converted or copied,
+- nested objects are wrapped in their own view class lazily, when they are accessed,
+- changes are written through to the raw data, so that the raw data can be used (e.g. by User.as_json()) as-is.
+
+Ex:
+attr = wrap_attribute("user_id", {"value": "test", "metadata": {...}, "signature": {...}})
+attr.value = "bob"
+attr.metadata.display
+<"public">
+attr.as_dict()
+<{"value": "bob", "metadata": {...}, "signature": {...}}>
+
+Views make loading and serializing profiles cheaper. The raw data still has one dict per JSON object, like DotDict,
+but its short strings (metadata values, timestamps, publisher names, ...) are shared between attributes and profiles,
+see intern_strings(). as_dict() hands out the raw data like DotDict does (shallow copies), use clone() for a deep copy.
+"""
+
+import json
+import os
+import sys
+
+# Generated view classes, per schema definition name. See get_attribute_classes()
+_classes = None
+
+
+def clone(o):
+    """
+    Returns a deep copy of the JSON-like structure @o, made of plain `dict` and `list` objects.
+    Immutable values (str, int, None, ...) are shared with @o.
+    """
+    if isinstance(o, dict):
+        return {k: clone(v) for k, v in o.items()}
+    elif isinstance(o, list):
+        return [clone(v) for v in o]
+    return o
+
+
+# Strings longer than this are not interned: they are mostly unique (signatures, descriptions, ...)
+INTERN_MAX_LENGTH = 64
+
+
+def intern_strings(o):
+    """
+    Replaces, in place, the short string values of the JSON-like structure @o by their interned copy, so that the
+    values repeated across attributes and profiles (metadata, timestamps, ...) are held once. Returns @o.
+    Keys are not interned: json.loads() already shares the keys within a document.
+    """
+    for k, v in o.items() if isinstance(o, dict) else enumerate(o):
+        # Replacing the value of an existing key does not resize the dict, so it can be done while iterating
+        if v.__class__ is str:
+            if len(v) <= INTERN_MAX_LENGTH:
+                o[k] = sys.intern(v)
+        elif v.__class__ is dict or v.__class__ is list:
+            intern_strings(v)
+    return o
+
+
+def unwrap(o):
+    """
+    Returns the raw data of @o (not a copy) if it is a view, @o otherwise
+    """
+    if isinstance(o, AttributeView):
+        return o._raw
+    return o
+
+
+class AttributeView(object):
+    """
+    Base class of the generated view classes. Behaves like a DotDict for the raw data it wraps: items are reachable as
+    attributes or keys, and the usual dict methods are available.
+
+    Class attributes, set by the generator:
+    _fields frozenset the attribute names defined by the schema
+    _closed bool True if the schema does not allow additional attributes (`additionalProperties: false`)
+    _children dict the view class to use for each attribute that is itself an object
+    """
+
+    __slots__ = ("_raw",)
+    _fields = frozenset()
+    _closed = False
+    _children = {}
+
+    def __init__(self, raw):
+        object.__setattr__(self, "_raw", raw)
+
+    def _wrap(self, k, v):
+        cls = self._children.get(k)
+        if cls is not None and isinstance(v, dict):
+            return cls(v)
+        return v
+
+    def __getitem__(self, k):
+        return self._wrap(k, self._raw[k])
+
+    def __setitem__(self, k, v):
+        if self._closed and k not in self._fields:
+            raise KeyError("'{}' object does not allow attribute '{}'".format(self.__class__.__name__, k))
+        v = unwrap(v)
+        if isinstance(v, (dict, list)):
+            # Do not share data with another structure (e.g. another User), like DotDict does
+            v = clone(v)
+        self._raw[k] = v
+
+    def __delitem__(self, k):
+        del self._raw[k]
+
+    def __getattr__(self, k):
+        # Only called when `k` is not a slot or a class attribute
+        if k.startswith("__"):
+            raise AttributeError(k)
+        try:
+            return self[k]
+        except KeyError:
+            raise AttributeError("'{}' object has no attribute '{}'".format(self.__class__.__name__, k))
+
+    def __setattr__(self, k, v):
+        try:
+            self[k] = v
+        except KeyError as e:
+            raise AttributeError(e)
+
+    def __delattr__(self, k):
+        try:
+            del self[k]
+        except KeyError:
+            raise AttributeError("'{}' object has no attribute '{}'".format(self.__class__.__name__, k))
+
+    def __contains__(self, k):
+        return k in self._raw
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __eq__(self, other):
+        return self._raw == unwrap(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self._raw)
+
+    def __reduce__(self):
+        return (_restore, (self.__class__.__name__, self._raw))
+
+    def __deepcopy__(self, memo):
+        return self.__class__(clone(self._raw))
+
+    def __copy__(self):
+        return self.__class__(self._raw.copy())
+
+    def get(self, k, default=None):
+        try:
+            return self[k]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self._raw.keys()
+
+    def items(self):
+        return [(k, self._wrap(k, v)) for k, v in self._raw.items()]
+
+    def values(self):
+        return [self._wrap(k, v) for k, v in self._raw.items()]
+
+    def copy(self):
+        """
+        Returns dict a shallow copy of the raw data
+        """
+        return self._raw.copy()
+
+    def as_dict(self):
+        """
+        Returns dict a shallow copy of the raw data, as dict(attribute) does for DotDict. Use clone() for a deep copy.
+        """
+        return self._raw.copy()
+
+
+def _restore(name, raw):
+    """
+    Unpickles a view, see AttributeView.__reduce__
+    """
+    return get_attribute_classes().get(name, AttributeView)(raw)
+
+
+def _resolve(definitions, node):
+    """
+    Returns str the name of the definition describing the object @node, or None.
+    Attributes are described either by a `$ref` or by an `allOf` list of refs where only one ref describes the object
+    structure, the others only restrict metadata values (e.g. DisplayPublicOnly, ClassificationPublic).
+    """
+    refs = [node] if "$ref" in node else node.get("allOf", [])
+    for ref in refs:
+        name = ref.get("$ref", "").split("/")[-1]
+        properties = definitions.get(name, {}).get("properties", {})
+        if any("$ref" in p or "allOf" in p for p in properties.values()):
+            return name
+    return None
+
+
+def _generate(definitions, name, classes):
+    """
+    Generates the view class for the definition @name and the classes of all of its children, into @classes
+    """
+    if name in classes:
+        return classes[name]
+
+    definition = definitions[name]
+    properties = definition.get("properties", {})
+    cls = type(
+        str(name),
+        (AttributeView,),
+        {
+            "__slots__": (),
+            "__doc__": definition.get("title", name),
+            "_fields": frozenset(properties),
+            "_closed": definition.get("additionalProperties", True) is False,
+        },
+    )
+    classes[name] = cls
+
+    children = {}
+    for prop, node in properties.items():
+        child = _resolve(definitions, node)
+        if child is not None:
+            children[prop] = _generate(definitions, child, classes)
+    cls._children = children
+    return cls
+
+
+def get_attribute_classes():
+    """
+    Returns dict the view classes, per schema definition name (e.g. "StandardAttributeString", "Metadata", "Profile").
+    Classes are generated once from the builtin profile schema (data/profile.schema) and cached for the lifetime of the
+    process.
+    """
+    global _classes
+    if _classes is None:
+        path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data/profile.schema")
+        with open(path) as fd:
+            definitions = json.load(fd)["definitions"]
+
+        classes = {}
+        _generate(definitions, "Profile", classes)
+        _classes = classes
+    return _classes
+
+
+def wrap_attribute(name, raw):
+    """
+    Returns the view of the top level profile attribute @name (e.g. "user_id", "access_information") for its raw data.
+    Values that are not objects (e.g. "schema") are returned as-is.
+    """
+    if not isinstance(raw, dict):
+        return raw
+    cls = get_attribute_classes()["Profile"]._children.get(name, AttributeView)
+    return cls(raw)
+
+
+def wrap_profile(profile):
+    """
+    Returns dict the top level profile attributes of the raw profile @profile, wrapped in their views.
+    The raw data is not copied: changes made through the views are written to @profile. Its strings are interned, see
+    intern_strings().
+    """
+    intern_strings(profile)
+    return {k: wrap_attribute(k, v) for k, v in profile.items()}
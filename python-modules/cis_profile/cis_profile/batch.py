@@ -0,0 +1,253 @@
+"""
+Batch operations over many User objects at once.
+
+Signing and signature verification are CPU bound (RSA), so signing or verifying the signatures of many profiles is
+spread over a pool of processes. Signatures are grouped per publisher, so that each worker verifies signatures made
+with the same publisher key together.
+
+Ex:
+from cis_profile.batch import verify_signatures_many
+results = verify_signatures_many([user_a, user_b])
+<[{"user_id": True, "access_information.ldap": True, ...}, {"user_id": SignatureVerificationFailure(...), ...}]>
+sign_all_many([user_a, user_b], publisher_name="hris")
+"""
+
+import concurrent.futures
+import concurrent.futures.process
+import logging
+import os
+import threading
+
+from cis_profile.attributes import unwrap
+from cis_profile.attributes import clone
+from cis_profile.common import get_attribute
+from cis_profile.common import get_attribute_paths
+from cis_profile.common import get_config
+from cis_profile.exceptions import SignatureVerificationFailure
+from cis_profile.exceptions import SigningFailure
+from cis_profile.profile import User
+
+logger = logging.getLogger(__name__)
+
+# User object used by the current (worker) process to sign and verify signatures, see _verify_chunk()
+_worker_user = None
+# Process pool shared by all batch operations, see _get_pool()
+_pool = None
+_pool_processes = None
+# Set once processes are known to be unusable (e.g. in AWS Lambda, which has no /dev/shm)
+_pool_unavailable = False
+_pool_lock = threading.Lock()
+
+
+def _get_worker_user():
+    global _worker_user
+    if _worker_user is None:
+        _worker_user = User()
+    return _worker_user
+
+
+def _verify_chunk(items):
+    """
+    Verifies the signatures of a chunk of attributes. Runs in the worker processes.
+    @items list of (user index, attribute path, attribute) tuples
+    Returns list of (user index, attribute path, None or the verification failure message) tuples
+    """
+    verifier = _get_worker_user()
+    results = []
+    for index, path, attr in items:
+        try:
+            verifier._verify_attribute_signature(attr)
+            results.append((index, path, None))
+        except SignatureVerificationFailure as e:
+            results.append((index, path, str(e)))
+        except Exception as e:
+            # Do not fail the whole chunk for a single malformed attribute
+            results.append((index, path, "Attribute signature verification failure: {}".format(e)))
+    return results
+
+
+def _sign_chunk(args):
+    """
+    Signs a chunk of attributes. Runs in the worker processes.
+    @args tuple (publisher name, list of (user index, attribute path, attribute) tuples)
+    Returns list of (user index, attribute path, signature.publisher structure or None, None or the failure message)
+    tuples
+    """
+    publisher_name, items = args
+    signer = _get_worker_user()
+    results = []
+    for index, path, attr in items:
+        try:
+            signed = signer._sign_attribute(attr, publisher_name)
+            results.append((index, path, signed["signature"]["publisher"], None))
+        except Exception as e:
+            # Do not fail the whole chunk (i.e. other users) for a single attribute
+            results.append((index, path, None, "Attribute signing failure for {}: {}".format(path, e)))
+    return results
+
+
+def _get_processes(processes):
+    if processes is None:
+        config = get_config()
+        processes = int(config("signature_processes", namespace="cis", default=str(os.cpu_count() or 1)))
+    return processes
+
+
+def _get_pool(processes):
+    """
+    Returns the process pool shared by all batch operations, with @processes workers, or None if processes cannot be
+    used. The pool is created on first use and only replaced when another number of workers is requested.
+    """
+    global _pool, _pool_processes, _pool_unavailable
+    with _pool_lock:
+        if _pool_unavailable:
+            return None
+        if _pool is not None and _pool_processes == processes:
+            return _pool
+
+        if os.environ.get("AWS_LAMBDA_FUNCTION_NAME") is not None:
+            logger.info("Running in AWS Lambda, batch operations run in the current process")
+            _pool_unavailable = True
+            return None
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
+        try:
+            _pool = concurrent.futures.ProcessPoolExecutor(max_workers=processes)
+            _pool_processes = processes
+        except (OSError, NotImplementedError) as e:
+            logger.warning("Cannot use a process pool, batch operations run in the current process ({})".format(e))
+            _pool_unavailable = True
+        return _pool
+
+
+def _drop_pool(pool):
+    """
+    Forgets the shared process pool @pool (e.g. after one of its workers died), so that the next call creates another.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _run(func, chunks, processes):
+    """
+    Returns an iterator over the results of func(chunk) for each chunk of @chunks, computed over a pool of @processes
+    processes, or in the current process if there is a single process or if processes cannot be used (e.g. in AWS
+    Lambda)
+    """
+    if processes > 1 and len(chunks) > 1:
+        pool = _get_pool(processes)
+        if pool is not None:
+            try:
+                # Results are all collected at once, so that a pool failure is not half-way through
+                return list(pool.map(func, chunks))
+            except concurrent.futures.process.BrokenProcessPool as e:
+                logger.warning("The process pool failed, running in the current process ({})".format(e))
+                _drop_pool(pool)
+    return [func(chunk) for chunk in chunks]
+
+
+def _chunks(items, chunk_size):
+    for start in range(0, len(items), chunk_size):
+        end = start + chunk_size
+        yield items[start:end]
+
+
+def _group_by_publisher(users):
+    """
+    Returns dict the attributes to verify of all @users, per publisher name.
+    Only attributes with a non-empty value are verified, as sign_all() only signs those.
+    """
+    groups = {}
+    verifier = _get_worker_user()
+    for index, user in enumerate(users):
+        for path in get_attribute_paths():
+            attr = get_attribute(user.__dict__, path)
+            if attr is None or not verifier._attribute_value_set(attr, strict=False):
+                continue
+            # Plain dicts are cheaper to send to the worker processes than DotDicts
+            attr = clone(unwrap(attr))
+            publisher_name = attr.get("signature", {}).get("publisher", {}).get("name")
+            groups.setdefault(publisher_name, []).append((index, ".".join(path), attr))
+    return groups
+
+
+def verify_signatures_many(users, processes=None, chunk_size=None):
+    """
+    Verifies the signatures of all attributes of many users, without stopping at the first failure.
+    @users list of User objects
+    @processes int number of worker processes. Defaults to the `signature_processes` setting, or the number of CPUs.
+    With 1 (or if processes cannot be used, e.g. in AWS Lambda), signatures are verified in the current process.
+    @chunk_size int number of signatures sent to a worker at once. Defaults to spreading each publisher's signatures
+    evenly over the workers.
+    Returns list, for each user (in the same order): dict of attribute path (e.g. "access_information.ldap") to True if
+    the signature is valid, or to the SignatureVerificationFailure otherwise. Attributes without a value are not
+    verified and are not in the dict.
+    """
+    processes = _get_processes(processes)
+    results = [{} for _ in users]
+
+    chunks = []
+    for publisher_name, items in _group_by_publisher(users).items():
+        size = chunk_size or max(1, -(-len(items) // processes))
+        logger.debug("Verifying {} signatures for publisher {}".format(len(items), publisher_name))
+        chunks.extend(_chunks(items, size))
+
+    for chunk_results in _run(_verify_chunk, chunks, processes):
+        for index, path, error in chunk_results:
+            results[index][path] = True if error is None else SignatureVerificationFailure(error)
+    return results
+
+
+def sign_all_many(users, publisher_name, processes=None, chunk_size=None):
+    """
+    Signs all attributes with a value of many users, like User.sign_all() does for each of them.
+    The same WARNING as for User.sign_all() applies: this is to be used only when CREATING new profiles.
+    @users list of User objects, signed in place
+    @publisher_name str a publisher name (will be set in signature.publisher.name at signing time)
+    @processes int number of worker processes. Defaults to the `signature_processes` setting, or the number of CPUs.
+    With 1 (or if processes cannot be used, e.g. in AWS Lambda), attributes are signed in the current process.
+    @chunk_size int number of attributes sent to a worker at once. Defaults to spreading attributes evenly over the
+    workers.
+    Returns list, for each user (in the same order): None if all its attributes were signed, or the SigningFailure of
+    the first attribute that could not be signed. Users are signed independently: a failure only affects its own user.
+    """
+    processes = _get_processes(processes)
+    worker = _get_worker_user()
+    results = [None for _ in users]
+
+    items = []
+    attributes = {}
+    for index, user in enumerate(users):
+        for path in get_attribute_paths():
+            attr = get_attribute(user.__dict__, path)
+            if attr is None or not worker._attribute_value_set(attr, strict=False):
+                continue
+            path = ".".join(path)
+            attributes[(index, path)] = attr
+            items.append((index, path, clone(unwrap(attr))))
+
+    size = chunk_size or max(1, -(-len(items) // processes))
+    chunks = [(publisher_name, chunk) for chunk in _chunks(items, size)]
+    logger.debug("Signing {} attributes with publisher {}".format(len(items), publisher_name))
+
+    for chunk_results in _run(_sign_chunk, chunks, processes):
+        for index, path, signature, error in chunk_results:
+            if error is not None:
+                if results[index] is None:
+                    results[index] = SigningFailure(error)
+                continue
+            sigattr = attributes[(index, path)]["signature"]["publisher"]
+            for k, v in signature.items():
+                sigattr[k] = v
+    return results
+
+
+def all_verified(result):
+    """
+    Returns True if all signatures of a verify_signatures_many() user result are valid
+    """
+    return all(v is True for v in result.values())
@@ -1,9 +1,11 @@
+import hashlib
 import json
 import os
 import requests
 import requests.exceptions
-import requests_cache
 import logging
+import threading
+import time
 
 from everett.ext.inifile import ConfigIniEnv
 from everett.manager import ConfigManager
@@ -19,6 +21,110 @@ def get_config():
     )
 
 
+# Cached, parsed builtin null profile, see get_null_profile()
+_null_profile = None
+# Cached user attribute paths of the profile structure, see get_attribute_paths()
+_attribute_paths = None
+# Cached attribute names of the profile structure, see get_attribute_tree()
+_attribute_tree = None
+
+
+def get_null_profile():
+    """
+    Returns dict the builtin null profile (data/user_profile_null.json), parsed once and cached for the lifetime of
+    the process.
+    This is a shared template: do not modify it, use DotDict.clone(get_null_profile()) to get a private copy.
+    """
+    global _null_profile
+    if _null_profile is None:
+        path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data/user_profile_null.json")
+        with open(path) as fd:
+            _null_profile = json.load(fd)
+    return _null_profile
+
+
+def get_attribute_paths():
+    """
+    Returns tuple of the paths of all user attributes of the profile structure, such as ("user_id",) or
+    ("access_information", "ldap").
+    User attributes are the leaf nodes of the profile, i.e. the nodes carrying a signature and metadata. The paths are
+    built once from the builtin null profile (data/user_profile_null.json, which follows data/profile.schema) and cached
+    for the lifetime of the process.
+    """
+    global _attribute_paths
+    if _attribute_paths is None:
+        paths = []
+        for attr, node in get_null_profile().items():
+            if not isinstance(node, dict):
+                continue
+            if "signature" in node:
+                paths.append((attr,))
+            else:
+                # This is a 2nd level attribute such as `access_information`
+                # Note that we do not have a 3rd level so this is sufficient
+                for subattr in node:
+                    paths.append((attr, subattr))
+        _attribute_paths = tuple(paths)
+    return _attribute_paths
+
+
+def get_attribute_tree():
+    """
+    Returns dict the attribute names of the profile structure, built once from get_attribute_paths(): top level user
+    attributes map to None and 2nd level parents (e.g. `access_information`) to the frozenset of their user attributes.
+    Attributes of a profile that are not in there are not known to the builtin profile structure (e.g. added by a newer
+    schema).
+    """
+    global _attribute_tree
+    if _attribute_tree is None:
+        tree = {}
+        for path in get_attribute_paths():
+            if len(path) == 1:
+                tree[path[0]] = None
+            else:
+                tree[path[0]] = tree.get(path[0], frozenset()) | frozenset([path[1]])
+        _attribute_tree = tree
+    return _attribute_tree
+
+
+def get_attribute(profile, path):
+    """
+    Returns the user attribute found at @path in @profile, or None if the profile does not have it (e.g. a filtered
+    profile)
+    @profile dict a profile structure such as User.__dict__ or User.as_dict()
+    @path tuple an attribute path as returned by get_attribute_paths(), or str such as "access_information.ldap"
+    """
+    if isinstance(path, str):
+        path = path.split(".")
+    node = profile
+    for p in path:
+        try:
+            node = node[p]
+        except (KeyError, TypeError):
+            return None
+    return node
+
+
+# Attributes left out of profile digests: CIS updates them on every write, whether anything else changed or not
+DIGEST_IGNORED_ATTRIBUTES = ("last_modified",)
+
+
+def profile_digest(profile, ignored_attributes=DIGEST_IGNORED_ATTRIBUTES):
+    """
+    Returns str the SHA-256 hex digest of the canonical JSON (sorted keys, no whitespace) of @profile, to tell whether
+    a profile changed without comparing it attribute by attribute. Signatures are part of the digest.
+    @profile User, dict or JSON str a profile structure
+    @ignored_attributes tuple of the top level attributes left out of the digest
+    """
+    if isinstance(profile, str):
+        profile = json.loads(profile)
+    elif hasattr(profile, "as_dict"):
+        profile = profile.as_dict()
+    content = {k: v for k, v in profile.items() if k not in ignored_attributes}
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
 class DotDict(dict):
     """
     Convert a dict to a fake class/object with attributes, such as:
@@ -48,6 +154,27 @@ class DotDict(dict):
 
     __setattr__ = __setitem__
 
+    @staticmethod
+    def clone(o):
+        """
+        Returns a deep copy of @o where all `dict` objects are converted to `DotDict` objects, like DotDict(o) does.
+        This is much cheaper than DotDict(o) as every node is only visited once and the copies are built without going
+        through DotDict.__setitem__. Immutable values (str, int, None, ...) are shared with @o.
+        @o dict, list, or any JSON-like value (e.g. get_null_profile())
+        """
+        if isinstance(o, dict):
+            d = dict.__new__(DotDict)
+            for k, v in o.items():
+                dict.__setitem__(d, k, DotDict.clone(v))
+            return d
+        elif isinstance(o, list):
+            return [DotDict.clone(v) for v in o]
+        elif isinstance(o, set):
+            return set(DotDict.clone(v) for v in o)
+        elif isinstance(o, tuple):
+            return tuple(DotDict.clone(v) for v in o)
+        return o
+
     def __delattr__(self, k):
         try:
             dict.__delitem__(self, k)
@@ -102,55 +229,200 @@ class DisplayLevel(DotDict):
     NULL = None
 
 
+class PublisherRules(object):
+    """
+    Compiled copy of the CIS publisher rules (see WellKnown.get_publisher_rules()).
+    Rules are compiled once per rules version and every attribute path is mapped to a frozenset of allowed creators
+    and to the single allowed updator, so that lookups are O(1) dict accesses.
+
+    Attribute paths are the attribute name for top level attributes (e.g. `user_id`) and `parent.attribute` for 2nd
+    level attributes (e.g. `access_information.ldap`). Parents which have a single rule for all of their children (e.g.
+    `identities` or `staff_information`) are stored under the parent name and apply to every child (`identities.*`),
+    for creation only: see updator().
+
+    Ex:
+    rules = PublisherRules.compile(WellKnown().get_publisher_rules())
+    "ldap" in rules.creators("title", parent_name="staff_information")
+    <True>
+    """
+
+    # Compiled rules, per rules version (digest of the rules document)
+    _compiled = {}
+
+    def __init__(self, rules, version=None):
+        """
+        @rules dict the publisher rules, as returned by WellKnown.get_publisher_rules()
+        @version str the rules version (digest). Computed from @rules if not passed.
+        """
+        self.version = version or self.digest(rules)
+        self._creators = {}
+        self._updators = {}
+
+        for attr, creators in rules["create"].items():
+            if isinstance(creators, dict):
+                for subattr, subcreators in creators.items():
+                    self._creators["{}.{}".format(attr, subattr)] = frozenset(subcreators)
+            else:
+                self._creators[attr] = frozenset(creators)
+
+        for attr, updator in rules["update"].items():
+            if isinstance(updator, dict):
+                for subattr, subupdator in updator.items():
+                    self._updators["{}.{}".format(attr, subattr)] = subupdator
+            else:
+                self._updators[attr] = updator
+
+    @staticmethod
+    def digest(rules):
+        """
+        Returns str a stable digest of a rules document, used as the rules version
+        """
+        return hashlib.sha256(json.dumps(rules, sort_keys=True).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def compile(cls, rules):
+        """
+        Returns the compiled PublisherRules for this rules document. Compilation only happens once per rules version.
+        @rules dict the publisher rules, as returned by WellKnown.get_publisher_rules()
+        """
+        version = cls.digest(rules)
+        compiled = cls._compiled.get(version)
+        if compiled is None:
+            logger.debug("Compiling publisher rules version {}".format(version))
+            compiled = cls(rules, version=version)
+            cls._compiled[version] = compiled
+        return compiled
+
+    def _lookup(self, table, attr_name, parent_name=None):
+        if parent_name is None:
+            return table[attr_name]
+        try:
+            return table["{}.{}".format(parent_name, attr_name)]
+        except KeyError:
+            # Parent has a single rule for all its children, such as `identities` or `staff_information`
+            return table[parent_name]
+
+    def creators(self, attr_name, parent_name=None):
+        """
+        Returns frozenset of publishers allowed to create (set from `null`) this attribute
+        @attr_name str the attribute name
+        @parent_name str the parent name of the attribute for 2nd level attributes, None otherwise
+        """
+        return self._lookup(self._creators, attr_name, parent_name)
+
+    def updator(self, attr_name, parent_name=None):
+        """
+        Returns str the only publisher allowed to update (change an already set value of) this attribute
+        @attr_name str the attribute name
+        @parent_name str the parent name of the attribute for 2nd level attributes, None otherwise
+        """
+        if parent_name is not None and "{}.{}".format(parent_name, attr_name) not in self._updators:
+            # Children of parents with a single rule (`identities`, `staff_information`) have always been checked
+            # against the list of creators of the parent, which no publisher name equals: they cannot be updated.
+            return self._creators[parent_name]
+        return self._lookup(self._updators, attr_name, parent_name)
+
+
 class WellKnown(object):
     """
-    CIS JSON WellKnown and Schema loader with memory and disk cache and builtin fallback support.
+    CIS JSON WellKnown and Schema loader with memory cache and builtin fallback support.
     This object cannot fail to return the schema, but the schema is not garanteed to be up to date in case of network
     issues.
 
-    Tries to get the well-known URL and schema from local cache if the cache has not expired.
-    Else, tries to get the schema from well-known URL and cache it.
+    Tries to get the well-known URL and schema from memory if it has been loaded already.
+    Else, tries to get the schema from well-known URL and keep it in memory.
     Else, uses a library-builtin copy of schema.
 
+    Once the in-memory copies are older than the TTL (`well_known_ttl`, in seconds), they are refreshed in a background
+    thread while the stale copies keep being served, so that callers never wait on the network after the first load.
+
+    Use WellKnown.shared() to get the process-wide object for a discovery URL instead of loading the documents again.
+
     Return: dict Schema dictionary (can be converted to JSON)
 
     Ex:
     import cis_profile.common.WellKnown
-    wk = WellKnown
+    wk = WellKnown.shared()
     print(wk.get_schema())
     <Dict: schema>
     """
 
+    # Process-wide WellKnown objects, per discovery URL. See WellKnown.shared()
+    _registry = {}
+    _registry_lock = threading.Lock()
+
     def __init__(self, discovery_url="https://auth.mozilla.com/.well-known/mozilla-iam"):
-        self._request_cache = "/var/tmp/cis_request_cache"  # XXX use `get_config` to configure that
-        self._request_cache_ttl = 3600
-        # Memory cached copies
-        self._well_known_json = None
-        self._schema_json = None
         self.discovery_url = discovery_url
         self.config = get_config()
-        logger.debug("Initializing requests_cache TTL={} at {}".format(self._request_cache_ttl, self._request_cache))
-        requests_cache.install_cache(
-            self._request_cache,
-            expire_after=self._request_cache_ttl,
-            backend=self.config("requests_cache_backend", namespace="cis", default="sqlite"),
-        )
+        self._ttl = int(self.config("well_known_ttl", namespace="cis", default="3600"))
+        self._timeout = float(self.config("well_known_timeout", namespace="cis", default="5"))
+        # Memory cached copies: (well-known, schema, rules), None until loaded.
+        # Readers only read this reference, writers replace the whole tuple under _documents_lock, so that readers
+        # never see the documents of a refresh mixed up with those of another
+        self._documents = (None, None, None)
+        self._documents_lock = threading.Lock()
+        self._publisher_rules = None  # (rules document, PublisherRules compiled from it)
+        self._loaded_at = None
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+
+    @classmethod
+    def shared(cls, discovery_url="https://auth.mozilla.com/.well-known/mozilla-iam"):
+        """
+        Returns the process-wide WellKnown object for @discovery_url, creating it if needed.
+        All its users share the same in-memory copies of the well-known, schema and rules documents.
+        """
+        well_known = cls._registry.get(discovery_url)
+        if well_known is None:
+            with cls._registry_lock:
+                well_known = cls._registry.get(discovery_url)
+                if well_known is None:
+                    logger.debug("Registering shared WellKnown for {}".format(discovery_url))
+                    well_known = cls(discovery_url=discovery_url)
+                    cls._registry[discovery_url] = well_known
+        return well_known
+
+    def __copy__(self):
+        # Copies of objects holding a WellKnown (e.g. User) keep sharing the same documents
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
     def get_publisher_rules(self):
         """
         Public wrapper for _load_rules
         """
-        self._well_known_json = self._load_well_known()
-        rules_url = self._well_known_json.get("publishers_rules_uri")
-        return self._load_publisher_rules(rules_url)
+        self._refresh_if_stale()
+        rules = self._documents[2]
+        if rules is None:
+            rules_url = self.get_well_known().get("publishers_rules_uri")
+            rules = self._set_document(2, self._load_publisher_rules(rules_url))
+        return rules
+
+    def get_compiled_publisher_rules(self):
+        """
+        Returns PublisherRules the compiled publisher rules. These are kept in memory, so that only the first call
+        loads (and compiles) the rules.
+        """
+        rules = self.get_publisher_rules()
+        compiled = self._publisher_rules
+        # The rules may have been swapped by a background refresh since they were compiled
+        if compiled is None or compiled[0] is not rules:
+            compiled = (rules, PublisherRules.compile(rules))
+            self._publisher_rules = compiled
+        return compiled[1]
 
     def get_schema(self):
         """
         Public wrapper for _load_well_known()
         """
-        self._well_known_json = self._load_well_known()
-        schema_url = self._well_known_json.get("api").get("data/profile_schema")
-        return self._load_schema(schema_url, stype="data/profile.schema")
+        self._refresh_if_stale()
+        schema = self._documents[1]
+        if schema is None:
+            schema_url = self.get_well_known().get("api").get("data/profile_schema")
+            schema = self._set_document(1, self._load_schema(schema_url, stype="data/profile.schema"))
+        return schema
 
     def get_core_schema(self):
         """ Deprecated """
@@ -164,60 +436,122 @@ class WellKnown(object):
         """
         Public wrapper for _load_well_known
         """
-        return self._load_well_known()
+        self._refresh_if_stale()
+        well_known = self._documents[0]
+        if well_known is None:
+            well_known = self._set_document(0, self._load_well_known())
+            self._loaded_at = time.time()
+        return well_known
+
+    def _set_document(self, index, document):
+        """
+        Publishes a document loaded for the first time, unless another thread did already
+        @index int the index of the document in _documents
+        Return dict the published document
+        """
+        with self._documents_lock:
+            documents = list(self._documents)
+            if documents[index] is None:
+                documents[index] = document
+                self._documents = tuple(documents)
+            return self._documents[index]
+
+    def _refresh_if_stale(self):
+        """
+        Starts a background refresh of the in-memory copies if they are older than the TTL. Never blocks.
+        """
+        if self._loaded_at is None or self._refreshing or time.time() - self._loaded_at < self._ttl:
+            return
+
+        with self._refresh_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        logger.debug("Well-known data for {} is stale, refreshing in the background".format(self.discovery_url))
+        refresh = threading.Thread(target=self._refresh, name="cis-well-known-refresh")
+        refresh.daemon = True
+        refresh.start()
+
+    def _refresh(self):
+        """
+        Fetches fresh copies of the documents that have already been loaded. Documents that fail to load are kept as-is.
+        """
+        try:
+            documents = self._documents
+            well_known = self._fetch_json(self.discovery_url)
+            if well_known is None:
+                well_known = documents[0]
+
+            schema = None
+            if documents[1] is not None:
+                schema = self._fetch_json(well_known.get("api").get("data/profile_schema"))
+
+            rules = None
+            if documents[2] is not None:
+                rules = self._fetch_json(well_known.get("publishers_rules_uri"))
+
+            # Swap all documents at once
+            with self._documents_lock:
+                _, current_schema, current_rules = self._documents
+                if schema is None:
+                    schema = current_schema
+                # Unchanged rules are kept, so that their compiled copy is kept too
+                if rules is None or rules == current_rules:
+                    rules = current_rules
+                self._documents = (well_known, schema, rules)
+        finally:
+            self._loaded_at = time.time()
+            self._refreshing = False
+
+    def _fetch_json(self, url):
+        """
+        Fetches a JSON document from an URL
+        Return dict,None the JSON document or None if it could not be fetched
+        """
+        if url is None:
+            return None
+        try:
+            return requests.get(url, timeout=self._timeout).json()
+        except (ValueError, requests.exceptions.RequestException) as e:
+            logger.debug("Failed to fetch {} ({})".format(url, e))
+            return None
+
+    def _load_builtin(self, filename):
+        """
+        Loads a library-builtin, local copy of a JSON document
+        """
+        if not os.path.isfile(filename):
+            dirname = os.path.dirname(os.path.realpath(__file__))
+            path = dirname + "/" + filename
+        else:
+            path = filename
+
+        with open(path) as fd:
+            return json.load(fd)
 
     def _load_publisher_rules(self, rules_url):
         """
         Get the CIS integration rules
         """
-        rules = None
-        if rules_url is not None:
-            try:
-                r = requests.get(rules_url)
-                rules = r.json()
-                if r.from_cache:
-                    logger.debug("Loaded rules data from requests cache")
-            except (json.JSONDecodeError, requests.exceptions.ConnectionError) as e:
-                logger.debug("Failed to load rules data from rules_url {} ({})".format(rules_url, e))
+        rules = self._fetch_json(rules_url)
 
         # Fall-back to built-in copy
         if rules is None:
-            rules_file = "data/well-known/mozilla-iam-publisher-rules"
-            if not os.path.isfile(rules_file):
-                dirname = os.path.dirname(os.path.realpath(__file__))
-                path = dirname + "/" + rules_file
-            else:
-                path = rules_file
-
-            rules = json.load(open(path))
+            rules = self._load_builtin("data/well-known/mozilla-iam-publisher-rules")
         return rules
 
     def _load_well_known(self):
         """
         Gets the discovery url's data ("well-known")
-        Return dict,None the well-known JSON data copy
+        Return dict the well-known JSON data copy
         """
-        # Memory cache
-        if self._well_known_json is not None:
-            return self._well_known_json
-
-        try:
-            r = requests.get(self.discovery_url)
-            self._well_known_json = r.json()
-            if r.from_cache:
-                logger.debug("Loaded well-known url from requests cache")
-        except (json.JSONDecodeError, requests.exceptions.ConnectionError) as e:
-            logger.debug("Failed to fetch schema url from discovery {} ({})".format(self.discovery_url, e))
-            logger.debug("Using builtin copy")
-            well_known_file = "data/well-known/mozilla-iam"  # Local fall-back
-            if not os.path.isfile(well_known_file):
-                dirname = os.path.dirname(os.path.realpath(__file__))
-                path = dirname + "/" + well_known_file
-            else:
-                path = well_known_file
-            self._well_known_json = json.load(open(path))
+        well_known = self._fetch_json(self.discovery_url)
 
-        return self._well_known_json
+        if well_known is None:
+            logger.debug("Failed to fetch schema url from discovery {}, using builtin copy".format(self.discovery_url))
+            well_known = self._load_builtin("data/well-known/mozilla-iam")  # Local fall-back
+        return well_known
 
     def _load_schema(self, schema_url, stype="data/profile.schema"):
         """
@@ -226,25 +560,9 @@ class WellKnown(object):
         @stype: str, type of schema to load. This is also the name of the library builtin, local copy.
         Return dict JSON object which is the CIS Profile Schema
         """
-        schema = None
-        if schema_url is not None:
-            try:
-                r = requests.get(schema_url)
-                schema = r.json()
-                if r.from_cache:
-                    logger.debug("Loaded schema data from requests cache")
-            except (json.JSONDecodeError, requests.exceptions.ConnectionError) as e:
-                logger.debug("Failed to load schema from schema_url {} ({})".format(schema_url, e))
+        schema = self._fetch_json(schema_url)
 
         # That did not work, fall-back to local, built-in copy
         if schema is None:
-            # Builtin, hardcoded schema from library
-            schema_file = stype
-            if not os.path.isfile(schema_file):
-                dirname = os.path.dirname(os.path.realpath(__file__))
-                path = dirname + "/" + schema_file
-            else:
-                path = schema_file
-
-            schema = json.load(open(path))
+            schema = self._load_builtin(stype)
         return schema
@@ -4,9 +4,19 @@ from cis_profile.common import WellKnown
 from cis_profile.common import DotDict
 from cis_profile.common import MozillaDataClassification
 from cis_profile.common import DisplayLevel
+from cis_profile.common import get_attribute
+from cis_profile.common import get_attribute_paths
+from cis_profile.common import get_attribute_tree
+from cis_profile.common import get_null_profile
+from cis_profile.attributes import AttributeView
+from cis_profile.attributes import clone
+from cis_profile.attributes import unwrap
+from cis_profile.attributes import wrap_attribute
+from cis_profile.attributes import wrap_profile
 
 import cis_crypto.operation
 import cis_profile.exceptions
+import cis_profile.validation
 import jose.exceptions
 import json
 import json.decoder
@@ -15,13 +25,15 @@ try:
     from json.decoder import JSONDecodeError
 except ImportError:
     JSONDecodeError = ValueError
-import jsonschema
 import logging
 import os
 import time
 
 logger = logging.getLogger(__name__)
 
+# Profile signature `alg` values (see the profile schema), per JWS algorithm of cis_crypto
+_SIGNATURE_ALGS = {"RS256": "RS256", "EdDSA": "ED25519"}
+
 
 class User(object):
     """
@@ -39,6 +51,10 @@ class User(object):
     if skel_user.validate():
         profile = skel_user.as_json()
     ```
+
+    Attributes are DotDict objects by default. Use `representation="slots"` to use the compact views of
+    cis_profile.attributes instead, which are recommended when holding many profiles in memory. Both representations
+    offer the same interface.
     """
 
     def __init__(
@@ -46,23 +62,31 @@ class User(object):
         user_structure_json=None,
         user_structure_json_file=None,
         discovery_url="https://auth.mozilla.com/.well-known/mozilla-iam",
+        representation="dotdict",
         **kwargs
     ):
         """
         @user_structure_json an existing user structure to load in this class
         @user_structure_json_file an existing user structure to load in this class, from a JSON file
         @discovery_url the well-known Mozilla IAM URL
+        @representation str "dotdict" (default) or "slots", the representation of the user attributes. With "slots",
+        @user_structure_json is not copied and changes to the user are written to it.
         @kwargs any user profile attribute name to override on initializing, eg "user_id='test'"
         """
-        self.__well_known = WellKnown()
+        if representation not in ["dotdict", "slots"]:
+            raise ValueError("Unknown user profile representation {}".format(representation))
+        self.__representation = representation
+        self.__well_known = WellKnown.shared(discovery_url)
 
         if user_structure_json is not None:
             self.load(user_structure_json)
         elif user_structure_json_file is not None:
-            self.load(self.get_profile_from_file(user_structure_json_file))
+            self.load(self._read_profile_file(user_structure_json_file))
+        elif representation == "slots":
+            self.load(clone(get_null_profile()))
         else:
-            # Load builtin defaults
-            self.load(self.get_profile_from_file("data/user_profile_null.json"))
+            # Load builtin defaults, from the parsed template rather than from disk
+            self.load(get_null_profile())
 
         # Insert defaults from kwargs
         for kw in kwargs:
@@ -75,9 +99,9 @@ class User(object):
                 logger.error("Unknown user profile attribute {}".format(kw))
                 raise Exception("Unknown user profile attribute {}".format(kw))
 
-        self.__signop = cis_crypto.operation.Sign()
-        self.__verifyop = cis_crypto.operation.Verify()
-        self.__verifyop.well_known = self.__well_known.get_well_known()
+        # Signing and verification operations are only created when needed, see _get_signop() and _get_verifyop()
+        self.__signop = None
+        self.__verifyop = None
 
     def load(self, profile_json):
         """
@@ -85,24 +109,34 @@ class User(object):
         @profile_json: dict (e.g. from json.load() or json.loads())
         """
         logger.debug("Loading profile JSON data structure into class object")
-        self.__dict__.update(DotDict(profile_json))
+        if self.__representation == "slots":
+            self.__dict__.update(wrap_profile(profile_json))
+        else:
+            self.__dict__.update(DotDict.clone(profile_json))
 
     def get_profile_from_file(self, user_structure_json_path):
         """
         Load the json structure into a 'DotDict' so that attributes appear as addressable object values
         Usually used with load().
         """
+        return DotDict.clone(self._read_profile_file(user_structure_json_path))
+
+    def _read_profile_file(self, user_structure_json_path):
+        """
+        Returns dict the json structure of a profile file
+        """
         logger.debug("Loading default profile JSON structure from {}".format(user_structure_json_path))
         if not os.path.isfile(user_structure_json_path):
             dirname = os.path.dirname(os.path.realpath(__file__))
             path = dirname + "/" + user_structure_json_path
         else:
             path = user_structure_json_path
-        return DotDict(json.load(open(path)))
+        with open(path) as fd:
+            return json.load(fd)
 
     def merge(self, user_to_merge_in, publisher, level=None, _internal_level=None):
         """
-        Recursively merge user attributes:
+        Merge user attributes:
         Merge a User object with another User object. This will override all fields from the current user by non-null
         (non-None) fields from `user_to_merge_in` which have a publisher set to `publisher`.
         Ex:
@@ -122,11 +156,41 @@ class User(object):
         @publisher str the publisher name that attempts to merge data in. any data from `user_to_merge_in` that is not
         originating from this publisher will be ignored
         @level dict of an attribute. This can be user_to_merge_in.__dict__ for the top level (recurses through all
-        attributes). The level MUST be from user_to_merge_in, not from the original/current user.
+        attributes). The level MUST be from user_to_merge_in, not from the original/current user. If None, all
+        attributes of the profile structure are merged (see get_attribute_paths()).
         @_internal_level str attribute name  of previous level attribute from the current user. Used internally.
 
         This function always returns None and is always successful.
         """
+        if level is not None or _internal_level is not None:
+            return self._merge_level(user_to_merge_in, publisher, level, _internal_level)
+
+        for path in get_attribute_paths():
+            attr = get_attribute(user_to_merge_in.__dict__, path)
+            # Check if this is an attribute we want to merge back
+            if attr is None or attr["signature"]["publisher"]["name"] != publisher:
+                continue
+
+            # We skip null/None attributes even if the original/current user does not match (ie is not null)
+            if attr.get("value") is not None or attr.get("values") is not None:
+                parent = get_attribute(self.__dict__, path[:-1])
+                if parent is None:
+                    continue
+                logger.debug("Merging in attribute {} for publisher {}".format(".".join(path), publisher))
+                # Copy the attribute (once) so that both users do not share it
+                attr = unwrap(attr)
+                if isinstance(parent, (AttributeView, DotDict)):
+                    # Both copy the values they are assigned
+                    parent[path[-1]] = attr
+                elif self.__representation == "slots":
+                    parent[path[-1]] = wrap_attribute(path[0], clone(attr))
+                else:
+                    parent[path[-1]] = DotDict.clone(attr)
+
+    def _merge_level(self, user_to_merge_in, publisher, level=None, _internal_level=None):
+        """
+        Recursively merge the user attributes of @level into @_internal_level, see merge()
+        """
         tomerge = []
         # Default to top level
         if level is None:
@@ -136,11 +200,11 @@ class User(object):
 
         for attr in level.keys():
             # If this is an internal class object, skip it
-            if attr.startswith("_") or not isinstance(level[attr], dict):
+            if attr.startswith("_") or not isinstance(level[attr], (dict, AttributeView)):
                 continue
             # If we have no signature (or metadata in theory), this is not a "User attribute", keep doing deeper
             if "signature" not in level[attr].keys():
-                self.merge(
+                self._merge_level(
                     user_to_merge_in, publisher=publisher, level=level[attr], _internal_level=_internal_level[attr]
                 )
             # Check if this is an attribute we want to merge back
@@ -160,19 +224,12 @@ class User(object):
         now = self._get_current_utc_time()
         logger.debug("Setting all profile metadata fields and profile modification timestamps to now: {}".format(now))
 
-        for item in self.__dict__:
-            if type(self.__dict__[item]) is not DotDict:
+        for path in get_attribute_paths():
+            attr = get_attribute(self.__dict__, path)
+            if attr is None:
                 continue
-            if "metadata" in self.__dict__[item]:
-                self.__dict__[item]["metadata"]["created"] = now
-                self.__dict__[item]["metadata"]["last_modified"] = now
-            else:
-                # This is a 2nd level attribute such as `access_information`
-                # Note that we do not have a 3rd level so this is sufficient
-                for subitem in self.__dict__[item]:
-                    if isinstance(self.__dict__[item][subitem], dict) and "metadata" in self.__dict__[item][subitem]:
-                        self.__dict__[item][subitem]["metadata"]["created"] = now
-                        self.__dict__[item][subitem]["metadata"]["last_modified"] = now
+            attr["metadata"]["created"] = now
+            attr["metadata"]["last_modified"] = now
 
         # XXX Hard-coded special profile values
         self.__dict__["last_modified"].value = now
@@ -183,11 +240,7 @@ class User(object):
         Updates metadata timestamps for that attribute
         @attr a valid user profile attribute
         """
-        req_attrs = req_attr.split(".")  # Support subitems/subattributes such as 'access_information.ldap'
-        if len(req_attrs) == 1:
-            attr = self.__dict__[req_attr]
-        else:
-            attr = self.__dict__[req_attrs[0]][req_attrs[1]]
+        attr = self._get_attribute(req_attr)
 
         if "metadata" not in attr:
             raise KeyError("This attribute does not have metadata to update")
@@ -197,6 +250,35 @@ class User(object):
         logger.debug("Updating to metadata.last_modified={} for attribute {}".format(now, req_attr))
         attr["metadata"]["last_modified"] = now
 
+    def _get_attribute(self, req_attr):
+        """
+        Returns the attribute of this user found at @req_attr, raises KeyError if there is none
+        @req_attr str or tuple this user's attribute name, supports subitems/subattributes such as
+        'access_information.ldap'
+        """
+        attr = get_attribute(self.__dict__, req_attr)
+        if attr is None:
+            raise KeyError(req_attr)
+        return attr
+
+    def _get_signop(self):
+        """
+        Returns the cis_crypto Sign operation of this user, creating it on first use
+        """
+        if self.__signop is None:
+            self.__signop = cis_crypto.operation.Sign()
+        return self.__signop
+
+    def _get_verifyop(self):
+        """
+        Returns the cis_crypto Verify operation of this user, creating it on first use. Its well-known data is kept
+        in sync with the (shared) WellKnown object.
+        """
+        if self.__verifyop is None:
+            self.__verifyop = cis_crypto.operation.Verify()
+        self.__verifyop.well_known = self.__well_known.get_well_known()
+        return self.__verifyop
+
     def _get_current_utc_time(self):
         """
         returns str of current time that is valid for the CIS user profiles
@@ -221,6 +303,11 @@ class User(object):
         for d in todel:
             del user[d]
 
+        if self.__representation == "slots":
+            # Views are replaced by the raw data they wrap (not a copy)
+            for k, v in user.items():
+                user[k] = unwrap(v)
+
         return user
 
     def as_json(self):
@@ -237,29 +324,36 @@ class User(object):
         Filters out reserved values
         """
         user = self._clean_dict()
+        # Like a dict() of the DotDict attributes, attributes are not copied (see cis_profile.attributes.clone())
         return dict(user)
 
     def filter_scopes(self, scopes=MozillaDataClassification.PUBLIC, level=None):
         """
         Filter in place/the current user profile object (self) to only contain attributes with scopes listed in @scopes
         @scopes list of str
+        @level dict of an attribute to filter (e.g. self.access_information), the whole profile if None
         """
-        self._filter_all(level=self.__dict__, valid=scopes, check="classification")
+        self._filter_all(valid=scopes, check="classification", level=level)
 
     def filter_display(self, display_levels=[DisplayLevel.PUBLIC], level=None):
         """
         Filter in place/the current user profile object (self) to only contain attributes with display levels listed
         in @display_levels
         @display_levels list of str
+        @level dict of an attribute to filter (e.g. self.access_information), the whole profile if None
         """
-        self._filter_all(level=self.__dict__, valid=display_levels, check="display")
+        self._filter_all(valid=display_levels, check="display", level=level)
 
-    def validate(self):
+    def validate(self, previous_user=None):
         """
         Validates against a JSON schema
+        @previous_user profile.User object the previous, valid, version of this user (e.g. as stored in the identity
+        vault). If set, only the attributes that differ from @previous_user are validated.
         """
-
-        return jsonschema.validate(self.as_dict(), self.__well_known.get_schema())
+        previous_profile = previous_user.as_dict() if previous_user is not None else None
+        return cis_profile.validation.validate(
+            self.as_dict(), self.__well_known.get_schema(), previous_profile=previous_profile
+        )
 
     def verify_all_publishers(self, previous_user):
         """
@@ -272,22 +366,17 @@ class User(object):
 
         Returns True on success, False if validation fails.
         """
-        for item in self.__dict__:
-            if type(self.__dict__[item]) is not DotDict:
+        for path in get_attribute_paths():
+            attr = get_attribute(self.__dict__, path)
+            if attr is None:
                 continue
-            try:
-                attr = self.__dict__[item]
-                ret = self.verify_can_publish(attr, attr_name=item, previous_attribute=previous_user.as_dict()[item])
-            except (AttributeError, KeyError):
-                # This is the 2nd level attribute match, see also initialize_timestamps()
-                for subitem in self.__dict__[item]:
-                    attr = self.__dict__[item][subitem]
-                    ret = self.verify_can_publish(
-                        attr,
-                        attr_name=subitem,
-                        parent_name=item,
-                        previous_attribute=previous_user.as_dict()[item][subitem],
-                    )
+            previous_attribute = get_attribute(previous_user.__dict__, path)
+            if len(path) == 1:
+                ret = self.verify_can_publish(attr, attr_name=path[0], previous_attribute=previous_attribute)
+            else:
+                ret = self.verify_can_publish(
+                    attr, attr_name=path[1], parent_name=path[0], previous_attribute=previous_attribute
+                )
             if ret is not True:
                 logger.warning("Verification of publisher failed for attribute {}".format(attr))
                 return False
@@ -323,17 +412,10 @@ class User(object):
         # DO NOTE: "create" is a list while "update" is a single item/str (ie check in the list of creators, but check
         # equality against updators). This is because we explicitely do not support multiple update mechanisms, while we
         # do support multiple create mechanisms.
-        rules = self.__well_known.get_publisher_rules()
-        if parent_name is None:
-            allowed_creators = rules["create"][attr_name]
-            allowed_updators = rules["update"][attr_name]
-        else:
-            try:
-                allowed_creators = rules["create"][parent_name][attr_name]
-                allowed_updators = rules["update"][parent_name][attr_name]
-            except TypeError:  # This is not access_information, this is identities or staff_information
-                allowed_creators = rules["create"][parent_name]
-                allowed_updators = rules["create"][parent_name]
+        # See also cis_profile.common.PublisherRules - rules are compiled once and shared by all attributes.
+        rules = self.__well_known.get_compiled_publisher_rules()
+        allowed_creators = rules.creators(attr_name, parent_name=parent_name)
+        allowed_updators = rules.updator(attr_name, parent_name=parent_name)
 
         # Do we have an attribute to check against?
         if previous_attribute is not None:
@@ -385,21 +467,16 @@ class User(object):
     def verify_all_signatures(self):
         """
         Verifies all child nodes with a non-null value's signature against a publisher signature
+        Empty values are skipped, as they are not signed by sign_all() either.
+
+        Returns True on success, False if verification fails.
         """
-        for item in self.__dict__:
-            if type(self.__dict__[item]) is not DotDict:
+        for path in get_attribute_paths():
+            attr = get_attribute(self.__dict__, path)
+            if attr is None or not self._attribute_value_set(attr, strict=False):
                 continue
-            try:
-                attr = self.__dict__[item]
-                if self._attribute_value_set(attr):
-                    attr = self._verify_attribute_signature(attr)
-            except KeyError:
-                # This is the 2nd level attribute match, see also initialize_timestamps()
-                for subitem in self.__dict__[item]:
-                    attr = self.__dict__[item][subitem]
-                    if self._attribute_value_set(attr):
-                        attr = self._verify_attribute_signature(attr)
-            if attr is not True:
+            ret = self._verify_attribute_signature(attr)
+            if ret is not True:
                 logger.warning("Verification failed for attribute {}".format(attr))
                 return False
         return True
@@ -409,11 +486,7 @@ class User(object):
         Verify the signature of an attribute
         @req_attr str this is this user's attribute name, which will be looked up and verified in place
         """
-        req_attrs = req_attr.split(".")  # Support subitems/subattributes such as 'access_information.ldap'
-        if len(req_attrs) == 1:
-            attr = self.__dict__[req_attr]
-        else:
-            attr = self.__dict__[req_attrs[0]][req_attrs[1]]
+        attr = self._get_attribute(req_attr)
         return self._verify_attribute_signature(attr)
 
     def _verify_attribute_signature(self, attr, publisher_name=None):
@@ -427,9 +500,16 @@ class User(object):
         if publisher_name is not None and attr["signature"]["publisher"]["value"] != publisher_name:
             raise cis_profile.exceptions.SignatureVerificationFailure("Incorrect publisher")
 
-        self.__verifyop.load(attr["signature"]["publisher"]["value"])
+        attrnosig = attr.copy()
+        del attrnosig["signature"]
+
+        # Signatures which have been verified already are found in the cis_crypto verified signature cache, which
+        # verifyop.jws() consults before doing any RSA operation
+        verifyop = self._get_verifyop()
+        # The attribute itself is the payload of detached payload signatures
+        verifyop.load(attr["signature"]["publisher"]["value"], payload=attrnosig)
         try:
-            signed = json.loads(self.__verifyop.jws(publisher_name))
+            signed = json.loads(verifyop.jws(publisher_name))
         except jose.exceptions.JWSError as e:
             logger.warning("Attribute signature verification failure: {} ({})".format(attr, publisher_name))
             raise cis_profile.exceptions.SignatureVerificationFailure(
@@ -437,9 +517,6 @@ class User(object):
             )
 
         # Finally check our object matches the stored data
-        attrnosig = attr.copy()
-        del attrnosig["signature"]
-
         if signed is None:
             raise cis_profile.exceptions.SignatureVerificationFailure(
                 "No data returned by jws() call for " "attribute {}".format(attr)
@@ -448,6 +525,7 @@ class User(object):
             raise cis_profile.exceptions.SignatureVerificationFailure(
                 "Signature data in jws does not match " "attribute data => {} != {}".format(attrnosig, signed)
             )
+        return True
 
     def sign_all(self, publisher_name):
         """
@@ -463,19 +541,10 @@ class User(object):
         """
 
         logger.debug("Signing all profile fields that have a value set with publisher {}".format(publisher_name))
-        for item in self.__dict__:
-            if type(self.__dict__[item]) is not DotDict:
-                continue
-            try:
-                attr = self.__dict__[item]
-                if self._attribute_value_set(attr, strict=False):
-                    attr = self._sign_attribute(attr, publisher_name)
-            except KeyError:
-                # This is the 2nd level attribute match, see also initialize_timestamps()
-                for subitem in self.__dict__[item]:
-                    attr = self.__dict__[item][subitem]
-                    if self._attribute_value_set(attr, strict=False):
-                        attr = self._sign_attribute(attr, publisher_name)
+        for path in get_attribute_paths():
+            attr = get_attribute(self.__dict__, path)
+            if attr is not None and self._attribute_value_set(attr, strict=False):
+                self._sign_attribute(attr, publisher_name)
 
     def sign_attribute(self, req_attr, publisher_name):
         """
@@ -484,11 +553,7 @@ class User(object):
         @publisher_name str a publisher name (will be set in signature.publisher.name) which corresponds to the
         signing key
         """
-        req_attrs = req_attr.split(".")  # Support subitems/subattributes such as 'access_information.ldap'
-        if len(req_attrs) == 1:
-            attr = self.__dict__[req_attr]
-        else:
-            attr = self.__dict__[req_attrs[0]][req_attrs[1]]
+        attr = self._get_attribute(req_attr)
         return self._sign_attribute(attr, publisher_name)
 
     def _attribute_value_set(self, attr, strict=True):
@@ -517,41 +582,73 @@ class User(object):
             raise KeyError(attr)
         return True
 
-    def _sign_attribute(self, attr, publisher_name):
+    def _sign_attribute(self, attr, publisher_name, detached=None):
         """
         Perform the actual signature operation
         See also https://github.com/mozilla-iam/cis/blob/profilev2/docs/Profiles.md
         @attr: a CIS Profilev2 attribute
         @publisher_name str a publisher name (will be set in signature.publisher.name) which corresponds to the
         signing key
+        @detached bool if True, the signature does not embed a copy of the attribute, which is then needed to verify
+        it. Defaults to the cis_crypto `signature_detached_payload` setting.
         """
         # Extract the attribute without the signature structure itself
         attrnosig = attr.copy()
         del attrnosig["signature"]
-        self.__signop.load(attrnosig)
+        signop = self._get_signop()
+        signop.load(attrnosig)
 
         # Add the signed attribute back to the original complete attribute structure (with the signature struct)
         # This ensure we also don't touch any existing non-publisher signatures
         sigattr = attr["signature"]["publisher"]
         sigattr["name"] = publisher_name
-        sigattr["alg"] = "RS256"  # Currently hardcoded in cis_crypto
-        sigattr["typ"] = "JWS"  # ""
-        sigattr["value"] = self.__signop.jws()
+        sigattr["alg"] = _SIGNATURE_ALGS.get(signop.algorithm(), signop.algorithm())
+        sigattr["typ"] = "JWS"
+        sigattr["value"] = signop.jws(detached=detached)
         return attr
 
-    def _filter_all(self, level, valid, check):
+    def _filter_all(self, valid, check, level=None):
+        """
+        Filters out (i.e. deletes) attributes.
+        Attributes of the builtin profile structure are reached through the attribute path index. Any other attribute
+        (e.g. added by a newer schema) is reached by walking the profile, so that it is filtered as well.
+        @valid list of valid attributes values, i.e. attribute values that will be retained
+        @check str the attribute metadata to check
+        @level dict of an attribute to filter (e.g. self.access_information) instead of the whole profile
+        """
+        if level is not None:
+            self._filter_level(level, valid=valid, check=check)
+            return
+
+        for path in get_attribute_paths():
+            attr = get_attribute(self.__dict__, path)
+            if attr is not None and attr["metadata"][check] not in valid:
+                logger.debug("Removing attribute {} because it's not in {}".format(".".join(path), valid))
+                del get_attribute(self.__dict__, path[:-1])[path[-1]]
+
+        tree = get_attribute_tree()
+        unknown = []
+        for name, node in list(self.__dict__.items()):
+            if name not in tree:
+                unknown.append(name)
+            elif tree[name] is not None and isinstance(node, (dict, AttributeView)):
+                self._filter_level(node, valid=valid, check=check, names=[k for k in node if k not in tree[name]])
+        self._filter_level(self.__dict__, valid=valid, check=check, names=unknown)
+
+    def _filter_level(self, level, valid, check, names=None):
         """
         Recursively filters out (i.e. deletes) attribute values.
         @level dict of an attribute. This can be self.__dict__ for the top level (recurses through all attributes)
         @valid list of valid attributes values, i.e. attribute values that will be retained
         @check str the attribute to check
+        @names list of str the names of the attributes of @level to filter, all of them if None
         """
         todel = []
-        for attr in level.keys():
-            if attr.startswith("_") or not isinstance(level[attr], dict):
+        for attr in list(level.keys()) if names is None else names:
+            if attr.startswith("_") or not isinstance(level[attr], (dict, AttributeView)):
                 continue
             if "metadata" not in level[attr].keys():
-                self._filter_all(valid=valid, level=level[attr], check=check)
+                self._filter_level(level[attr], valid=valid, check=check)
             elif level[attr]["metadata"][check] not in valid:
                 todel.append(attr)
 
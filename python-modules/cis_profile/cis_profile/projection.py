@@ -0,0 +1,66 @@
+"""
+Compiled profile filters ("projection plans").
+
+A ProjectionPlan keeps the user attributes whose data classification and display level are allowed, like
+User.filter_scopes() followed by User.filter_display(), but in a single pass over a plain profile dict (e.g. straight
+from json.loads()), building the filtered profile rather than deleting from it. Like the User filters, every attribute
+carrying metadata is checked, including attributes the builtin profile structure does not know (e.g. added by a newer
+schema). Plans do not depend on the profile, so a plan can be built once and applied to many profiles.
+
+Ex:
+from cis_profile.projection import ProjectionPlan
+plan = ProjectionPlan(classifications=MozillaDataClassification.PUBLIC, display_levels=[DisplayLevel.PUBLIC])
+public_profiles = [plan.apply(profile) for profile in profiles]
+"""
+
+
+class ProjectionPlan(object):
+    def __init__(self, classifications=None, display_levels=None):
+        """
+        @classifications list of str the data classifications to keep, or None to keep all classifications
+        @display_levels list of str the display levels to keep, or None to keep all display levels
+        """
+        self.classifications = frozenset(classifications) if classifications is not None else None
+        self.display_levels = frozenset(display_levels) if display_levels is not None else None
+
+    def __repr__(self):
+        return "ProjectionPlan(classifications={}, display_levels={})".format(
+            sorted(self.classifications) if self.classifications is not None else None,
+            sorted(self.display_levels, key=str) if self.display_levels is not None else None,
+        )
+
+    def allows(self, attr):
+        """Returns True if the user attribute @attr (dict) is kept."""
+        if not isinstance(attr, dict):
+            return True
+        metadata = attr.get("metadata", {})
+        if self.classifications is not None and metadata.get("classification") not in self.classifications:
+            return False
+        if self.display_levels is not None and metadata.get("display") not in self.display_levels:
+            return False
+        return True
+
+    def apply(self, profile):
+        """
+        Returns dict the attributes of @profile this plan keeps. Attributes are not copied and @profile is not modified
+        @profile dict a profile structure, such as json.loads() of a vault profile or User.as_dict()
+        """
+        if self.classifications is None and self.display_levels is None:
+            return profile
+
+        return self._project(profile)
+
+    def _project(self, level):
+        """
+        Returns dict the attributes of @level this plan keeps, recursing into the nodes that are not user attributes
+        @level dict a profile structure, or a node of it (e.g. access_information)
+        """
+        filtered = {}
+        for name, node in level.items():
+            if name.startswith("_") or not isinstance(node, dict):
+                filtered[name] = node
+            elif "metadata" not in node:
+                filtered[name] = self._project(node)
+            elif self.allows(node):
+                filtered[name] = node
+        return filtered
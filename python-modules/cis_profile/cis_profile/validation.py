@@ -0,0 +1,252 @@
+"""
+JSON schema validation of user profiles, with validators compiled once per schema version and cached process-wide.
+
+Profiles can also be validated incrementally against a previous (valid) version of the profile, in which case only the
+attributes that changed are validated, each with its own subschema of the profile schema.
+
+Ex:
+from cis_profile.validation import validate_many
+errors = validate_many([profile_a, profile_b])
+<[None, ValidationError(...)]>
+validate(new_profile, previous_profile=old_profile)
+"""
+
+import hashlib
+import json
+import jsonschema
+import jsonschema.exceptions
+import jsonschema.validators
+import logging
+import threading
+
+from cis_profile.common import WellKnown
+from cis_profile.common import get_attribute
+from cis_profile.common import get_attribute_paths
+
+logger = logging.getLogger(__name__)
+
+# Compiled validators, per schema version (digest of the schema document)
+_validators = {}
+# Compiled validators, per schema object. This avoids computing the digest of schemas we have already seen.
+_validators_by_id = {}
+_validators_lock = threading.Lock()
+# Compiled per-attribute validators, per profile validator. See get_attribute_validators()
+_attribute_validators = {}
+# Validators for which `$ref` siblings are ignored, see _inline_refs()
+_INLINE_REFS_VALIDATORS = [
+    jsonschema.validators.Draft4Validator,
+    jsonschema.validators.Draft6Validator,
+    jsonschema.validators.Draft7Validator,
+]
+
+
+def schema_digest(schema):
+    """
+    Returns str a stable digest of a schema document, used as the schema version
+    """
+    return hashlib.sha256(json.dumps(schema, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _inline_refs(schema):
+    """
+    Returns a copy of @schema where local references (`{"$ref": "#/definitions/..."}`) are replaced by the definition
+    they point to, so that the validator does not have to resolve them on every validation.
+    Recursive references are kept as-is. Like draft 4 to 7 validators do, keywords next to a `$ref` are ignored.
+    """
+    definitions = schema.get("definitions", {})
+
+    def inline(node, seen):
+        if isinstance(node, list):
+            return [inline(v, seen) for v in node]
+        elif not isinstance(node, dict):
+            return node
+
+        ref = node.get("$ref")
+        if isinstance(ref, str) and ref.startswith("#/definitions/"):
+            name = ref.split("/")[-1]
+            if name in definitions and name not in seen:
+                return inline(definitions[name], seen | {name})
+            return node
+        return {k: inline(v, seen) for k, v in node.items()}
+
+    inlined = {k: inline(v, frozenset()) for k, v in schema.items() if k != "definitions"}
+    if "definitions" in schema:
+        inlined["definitions"] = schema["definitions"]
+    if isinstance(schema.get("$ref"), str):
+        # The root itself is a reference (e.g. `#/definitions/Profile`)
+        root = inline({"$ref": schema["$ref"]}, frozenset())
+        if "$ref" not in root:
+            del inlined["$ref"]
+            inlined.update(root)
+    return inlined
+
+
+def get_validator(schema=None):
+    """
+    Returns the jsonschema validator for @schema. The schema is checked and the validator is compiled once per schema
+    version, then shared by all callers.
+    @schema dict a JSON schema. Defaults to the profile schema from the shared WellKnown object.
+    """
+    if schema is None:
+        schema = WellKnown.shared().get_schema()
+
+    cached = _validators_by_id.get(id(schema))
+    if cached is not None and cached[0] is schema:
+        return cached[1]
+
+    with _validators_lock:
+        version = schema_digest(schema)
+        validator = _validators.get(version)
+        if validator is None:
+            logger.debug("Compiling JSON schema validator for schema version {}".format(version))
+            cls = jsonschema.validators.validator_for(schema)
+            cls.check_schema(schema)
+            if cls in _INLINE_REFS_VALIDATORS:
+                validator = cls(_inline_refs(schema))
+            else:
+                validator = cls(schema)
+            _validators[version] = validator
+        if len(_validators_by_id) >= 32:
+            _validators_by_id.clear()
+        # Keep a reference to the schema so that its id() cannot be reused by another object
+        _validators_by_id[id(schema)] = (schema, validator)
+    return validator
+
+
+def _profile_dict(profile):
+    """
+    Returns dict the profile data of @profile, which can be a User object, a dict or a JSON str
+    """
+    if isinstance(profile, str):
+        return json.loads(profile)
+    elif isinstance(profile, dict):
+        return profile
+    return profile.as_dict()
+
+
+def get_attribute_validators(schema=None):
+    """
+    Returns dict the validators of each user attribute, per attribute path (see cis_profile.common.get_attribute_paths,
+    "schema" is included as ("schema",)). Each validator checks the attribute against its own subschema of the profile
+    schema. Validators are compiled once per schema version.
+    Returns None if the profile schema cannot be split per attribute (i.e. its references could not be inlined).
+    @schema dict a JSON schema. Defaults to the profile schema from the shared WellKnown object.
+    """
+    validator = get_validator(schema)
+    validators = _attribute_validators.get(id(validator))
+    if validator.schema.get("properties") is None:
+        return None
+    if validators is not None:
+        return validators
+
+    with _validators_lock:
+        validators = {}
+        root = validator.schema
+        for path in get_attribute_paths() + (("schema",),):
+            subschema = root
+            for p in path:
+                subschema = subschema.get("properties", {}).get(p)
+                if subschema is None:
+                    break
+            if subschema is None:
+                continue
+            subschema = dict(subschema)
+            if "definitions" in root:
+                # Non-inlined (recursive) references may still point to the profile definitions
+                subschema["definitions"] = root["definitions"]
+            validators[path] = validator.__class__(subschema)
+        # Compiled validators are never dropped, so that their id() cannot be reused
+        _attribute_validators[id(validator)] = validators
+    return validators
+
+
+def _same_structure(profile, previous_profile):
+    """
+    Returns True if @profile has the same top level attributes and the same 2nd level attributes (e.g.
+    access_information.*) as @previous_profile.
+    """
+    if profile.keys() != previous_profile.keys():
+        return False
+    for k, v in profile.items():
+        if isinstance(v, dict) and "signature" not in v:
+            previous = previous_profile[k]
+            if not isinstance(previous, dict) or v.keys() != previous.keys():
+                return False
+    return True
+
+
+def validate_changes(profile, previous_profile, schema=None):
+    """
+    Validates only the attributes of @profile that differ from @previous_profile, which must be valid already (e.g.
+    the profile as stored in the identity vault). The cost of the validation depends on the size of the change rather
+    than on the size of the profile.
+    Falls back to a full validation if attributes have been added or removed, if the profiles declare different schema
+    versions (the `schema` attribute, e.g. a profile stored under an older schema), or if the schema cannot be split
+    per attribute.
+    @profile User, dict or str the profile to validate
+    @previous_profile User, dict or str the previous version of the profile
+    @schema dict a JSON schema. Defaults to the profile schema from the shared WellKnown object.
+    Raises jsonschema.exceptions.ValidationError if the profile is invalid.
+    """
+    profile = _profile_dict(profile)
+    previous_profile = _profile_dict(previous_profile)
+    validators = get_attribute_validators(schema)
+
+    if validators is None or len(validators) != len(get_attribute_paths()) + 1:
+        logger.debug("Profile schema cannot be split per attribute, validating the full profile")
+        return validate(profile, schema)
+    if profile.get("schema") != previous_profile.get("schema"):
+        logger.debug("Profile schema version changed, validating the full profile")
+        return validate(profile, schema)
+    if not _same_structure(profile, previous_profile):
+        logger.debug("Profile structure changed, validating the full profile")
+        return validate(profile, schema)
+
+    for path, validator in validators.items():
+        attr = get_attribute(profile, path)
+        if attr == get_attribute(previous_profile, path):
+            continue
+
+        logger.debug("Validating changed attribute {}".format(".".join(path)))
+        error = jsonschema.exceptions.best_match(validator.iter_errors(attr))
+        if error is not None:
+            # Make the error path relative to the profile, like it is for full validations
+            error.path.extendleft(reversed(path))
+            raise error
+
+
+def validate(profile, schema=None, previous_profile=None):
+    """
+    Validates a profile, like jsonschema.validate() but with a cached validator
+    @profile User, dict or str the profile to validate
+    @schema dict a JSON schema. Defaults to the profile schema from the shared WellKnown object.
+    @previous_profile User, dict or str the previous, valid, version of the profile. If set, only the attributes that
+    changed are validated (see validate_changes())
+    Raises jsonschema.exceptions.ValidationError if the profile is invalid.
+    """
+    if previous_profile is not None:
+        return validate_changes(profile, previous_profile, schema)
+
+    error = jsonschema.exceptions.best_match(get_validator(schema).iter_errors(_profile_dict(profile)))
+    if error is not None:
+        raise error
+
+
+def validate_many(profiles, schema=None):
+    """
+    Validates many profiles without stopping at the first invalid one
+    @profiles list of User, dict or str the profiles to validate
+    @schema dict a JSON schema. Defaults to the profile schema from the shared WellKnown object.
+    Returns list, for each profile (in the same order): None if the profile is valid, else its
+    jsonschema.exceptions.ValidationError (the same error validate() would raise).
+    Profiles that cannot be parsed get a ValidationError too.
+    """
+    validator = get_validator(schema)
+    errors = []
+    for profile in profiles:
+        try:
+            error = jsonschema.exceptions.best_match(validator.iter_errors(_profile_dict(profile)))
+        except ValueError as e:
+            error = jsonschema.exceptions.ValidationError("Invalid profile JSON: {}".format(e))
+        errors.append(error)
+    return errors
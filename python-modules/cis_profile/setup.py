@@ -9,7 +9,6 @@ with open("README.md", "r") as fh:
 requirements = [
     "jsonschema",
     "requests",
-    "requests-cache",
     "graphene",
     "Faker",
     "everett",
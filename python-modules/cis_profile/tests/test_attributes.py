@@ -0,0 +1,107 @@
+from cis_profile import profile
+from cis_profile.attributes import AttributeView
+from cis_profile.attributes import clone
+from cis_profile.attributes import get_attribute_classes
+from cis_profile.attributes import unwrap
+from cis_profile.attributes import wrap_attribute
+from cis_profile.common import get_null_profile
+
+import copy
+import json
+import os
+import pickle
+import pytest
+
+
+class TestAttributes(object):
+    def setup(self):
+        os.environ["CIS_CONFIG_INI"] = "tests/fixture/mozilla-cis.ini"
+
+    def test_generated_classes(self):
+        classes = get_attribute_classes()
+        assert classes is get_attribute_classes()
+        for name in ["Profile", "StandardAttributeString", "Metadata", "Signature", "AccessInformationValuesArray"]:
+            assert issubclass(classes[name], AttributeView)
+
+        attr = wrap_attribute("user_id", copy.deepcopy(get_null_profile()["user_id"]))
+        assert isinstance(attr, classes["StandardAttributeString"])
+        assert isinstance(attr.metadata, classes["Metadata"])
+        assert isinstance(attr.signature.publisher, classes["Publisher"])
+        assert isinstance(wrap_attribute("access_information", {}).get("ldap", {}), dict)
+        assert wrap_attribute("schema", "https://example.net") == "https://example.net"
+        assert not hasattr(attr, "__dict__")
+
+    def test_views_write_through(self):
+        raw = copy.deepcopy(get_null_profile()["user_id"])
+        attr = wrap_attribute("user_id", raw)
+        attr.value = "test"
+        attr.metadata.display = "staff"
+        attr["signature"]["publisher"]["name"] = "ldap"
+        assert raw["value"] == "test"
+        assert raw["metadata"]["display"] == "staff"
+        assert raw["signature"]["publisher"]["name"] == "ldap"
+        assert unwrap(attr) is raw
+        assert attr == raw
+        # as_dict() is a shallow copy, like dict() of a DotDict, clone() a deep one
+        assert attr.as_dict() == raw and attr.as_dict() is not raw
+        assert attr.as_dict()["metadata"] is raw["metadata"]
+        clone(attr.as_dict())["metadata"]["display"] = "public"
+        assert raw["metadata"]["display"] == "staff"
+
+        # The schema does not allow additional attributes
+        with pytest.raises(AttributeError):
+            attr.nonexistent = "test"
+        with pytest.raises(AttributeError):
+            attr.nonexistent
+
+    def test_copies(self):
+        attr = wrap_attribute("user_id", copy.deepcopy(get_null_profile()["user_id"]))
+        other = copy.deepcopy(attr)
+        other.metadata.display = "staff"
+        assert attr.metadata.display != "staff"
+        assert pickle.loads(pickle.dumps(attr)) == attr
+
+    def test_slots_user(self):
+        u = profile.User(user_id="test", representation="slots")
+        assert isinstance(u.user_id, AttributeView)
+        assert u.as_dict() == profile.User(user_id="test").as_dict()
+        assert json.loads(u.as_json()) == u.as_dict()
+        u.validate()
+
+        u.initialize_timestamps()
+        u.sign_all(publisher_name="ldap")
+        assert u.verify_all_signatures() is True
+        assert u.verify_all_publishers(profile.User(representation="slots")) is True
+
+        # Users do not share data
+        u2 = profile.User(representation="slots")
+        u2.merge(u, "ldap")
+        assert u2.user_id.value == "test"
+        u2.user_id.value = "test2"
+        assert u.user_id.value == "test"
+        u.access_information.ldap["values"] = {"group": None}
+        u.sign_attribute("access_information.ldap", publisher_name="ldap")
+        u2.merge(u, "ldap")
+        u2.access_information.ldap["values"]["group2"] = None
+        assert u.access_information.ldap["values"] == {"group": None}
+
+        u.filter_display(display_levels=["public"])
+        assert "access_information" not in u.as_dict() or "ldap" not in u.as_dict()["access_information"]
+
+    def test_slots_user_zero_copy(self):
+        raw = json.loads(json.dumps(get_null_profile()))
+        u = profile.User(user_structure_json=raw, representation="slots")
+        u.user_id.value = "test"
+        assert raw["user_id"]["value"] == "test"
+        assert u.as_dict() == raw
+        # as_dict() is not copied further than DotDict users are
+        assert u.as_dict() is not raw
+        assert u.as_dict()["access_information"] is raw["access_information"]
+
+        # Short strings are shared between profiles
+        other = json.loads(json.dumps(get_null_profile()))
+        profile.User(user_structure_json=other, representation="slots")
+        assert other["first_name"]["metadata"]["display"] is raw["first_name"]["metadata"]["display"]
+
+        with pytest.raises(ValueError):
+            profile.User(representation="nonexistent")
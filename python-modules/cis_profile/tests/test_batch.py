@@ -0,0 +1,95 @@
+from cis_profile import profile
+from cis_profile.batch import all_verified
+from cis_profile.batch import sign_all_many
+from cis_profile.batch import verify_signatures_many
+from cis_profile.exceptions import SignatureVerificationFailure
+
+import os
+
+
+class TestBatch(object):
+    def setup(self):
+        os.environ["CIS_CONFIG_INI"] = "tests/fixture/mozilla-cis.ini"
+
+    def _signed_users(self, number):
+        users = []
+        for i in range(number):
+            u = profile.User(user_id="test{}".format(i))
+            u.first_name.value = "test"
+            u.sign_all(publisher_name="ldap")
+            u.sign_attribute("access_information.hris", publisher_name="hris")
+            users.append(u)
+        return users
+
+    def test_verify_signatures_many(self):
+        users = self._signed_users(3)
+        # Tamper with signed data
+        users[1].first_name.value = "evil"
+
+        for processes in [1, 2]:
+            results = verify_signatures_many(users, processes=processes, chunk_size=2)
+            assert len(results) == 3
+            assert all_verified(results[0])
+            assert all_verified(results[2])
+            assert results[0]["user_id"] is True
+            assert results[0]["first_name"] is True
+            # Empty attributes are not verified
+            assert "fun_title" not in results[0]
+
+            assert not all_verified(results[1])
+            assert results[1]["user_id"] is True
+            assert isinstance(results[1]["first_name"], SignatureVerificationFailure)
+
+    def test_verify_signatures_many_slots(self):
+        users = [profile.User(user_structure_json=u.as_dict(), representation="slots") for u in self._signed_users(2)]
+        results = verify_signatures_many(users, processes=1)
+        assert all(all_verified(r) for r in results)
+        assert verify_signatures_many([]) == []
+
+    def test_sign_all_many(self):
+        for processes in [1, 2]:
+            users = [profile.User(user_id="test{}".format(i)) for i in range(3)]
+            users.append(profile.User(user_id="test", representation="slots"))
+            assert sign_all_many(users, publisher_name="ldap", processes=processes, chunk_size=3) == [None] * 4
+            for u in users:
+                assert u.user_id.signature.publisher.name == "ldap"
+                assert u.user_id.signature.publisher.value != ""
+                # Empty attributes are not signed
+                assert u.fun_title.signature.publisher.value == ""
+                assert u.verify_all_signatures() is True
+
+    def test_sign_all_many_failures(self):
+        from cis_profile.exceptions import SigningFailure
+
+        users = [profile.User(user_id="test{}".format(i)) for i in range(3)]
+        # An attribute that cannot be signed (its signature structure is missing)
+        del users[1].user_id["signature"]
+        for processes in [1, 2]:
+            results = sign_all_many(users, publisher_name="ldap", processes=processes, chunk_size=2)
+            assert results[0] is None and results[2] is None
+            assert isinstance(results[1], SigningFailure)
+            assert "user_id" in str(results[1])
+            # Other users are signed
+            assert users[2].user_id.signature.publisher.value != ""
+            assert users[2].verify_all_signatures() is True
+
+    def test_pool_is_shared(self):
+        from cis_profile import batch
+
+        users = self._signed_users(2)
+        verify_signatures_many(users, processes=2, chunk_size=1)
+        pool = batch._pool
+        assert pool is not None
+        sign_all_many(users, publisher_name="ldap", processes=2, chunk_size=1)
+        assert batch._pool is pool
+
+    def test_no_pool_in_lambda(self, monkeypatch):
+        from cis_profile import batch
+
+        monkeypatch.setattr(batch, "_pool", None)
+        monkeypatch.setattr(batch, "_pool_unavailable", False)
+        monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "test")
+        results = verify_signatures_many(self._signed_users(2), processes=2, chunk_size=1)
+        assert all(all_verified(r) for r in results)
+        assert batch._pool is None
+        assert batch._pool_unavailable is True
@@ -1,6 +1,11 @@
 from cis_profile import profile
 from cis_profile.common import MozillaDataClassification
 from cis_profile.common import DisplayLevel
+from cis_profile.common import get_attribute
+from cis_profile.common import get_attribute_paths
+from cis_profile.common import get_null_profile
+from cis_profile.common import profile_digest
+from cis_profile.common import DotDict
 
 import copy
 import cis_profile.exceptions
@@ -31,6 +36,28 @@ class TestProfile(object):
         assert "user_id" not in u.as_dict().keys()
         assert "title" not in u.as_dict()["staff_information"].keys()
 
+    def test_filter_unknown_attributes(self):
+        # Attributes the builtin profile structure does not know (e.g. from a newer schema) are filtered too
+        for representation in ["dotdict", "slots"]:
+            profile_json = profile.User().as_dict()
+            confidential = copy.deepcopy(profile_json["user_id"])
+            confidential["metadata"]["classification"] = MozillaDataClassification.MOZILLA_CONFIDENTIAL[0]
+            confidential["metadata"]["display"] = DisplayLevel.STAFF
+            profile_json["new_attribute"] = confidential
+            profile_json["identities"]["new_identity"] = copy.deepcopy(confidential)
+            profile_json["identities"]["new_public_identity"] = copy.deepcopy(profile_json["user_id"])
+
+            u = profile.User(user_structure_json=copy.deepcopy(profile_json), representation=representation)
+            u.filter_scopes(MozillaDataClassification.PUBLIC)
+            assert "new_attribute" not in u.as_dict()
+            assert "new_identity" not in u.as_dict()["identities"]
+            assert "new_public_identity" in u.as_dict()["identities"]
+
+            u = profile.User(user_structure_json=copy.deepcopy(profile_json), representation=representation)
+            u.filter_display([DisplayLevel.PUBLIC])
+            assert "new_attribute" not in u.as_dict()
+            assert "new_identity" not in u.as_dict()["identities"]
+
     def test_filter_display(self):
         u = profile.User()
         # Make sure a value is non-public
@@ -95,7 +122,12 @@ class TestProfile(object):
     def test_full_profile_signing_verification(self):
         u = profile.User(user_id="test")
         u.sign_all(publisher_name="ldap")
-        u.verify_all_signatures()
+        assert u.verify_all_signatures() is True
+
+        # Attributes nested under a parent attribute are verified too
+        u.access_information.ldap.values = {"tampered": None}
+        with pytest.raises(cis_profile.exceptions.SignatureVerificationFailure):
+            u.verify_all_signatures()
 
     def test_single_attribute_signing_verification(self):
         u = profile.User(user_id="test")
@@ -104,6 +136,23 @@ class TestProfile(object):
         with pytest.raises(cis_profile.exceptions.SignatureVerificationFailure):
             u.verify_attribute_signature("fun_title")  # Unsigned, so should raise and fail
 
+    def test_detached_signature_verification(self):
+        u = profile.User(user_id="test")
+        u._sign_attribute(u.user_id, publisher_name="ldap", detached=True)
+        embedded = copy.deepcopy(u.user_id)
+        u._sign_attribute(embedded, publisher_name="ldap", detached=False)
+
+        value = u.user_id.signature.publisher.value
+        assert value.split(".")[1] == ""
+        assert len(value) < len(embedded.signature.publisher.value)
+        u.verify_attribute_signature("user_id")
+        u._verify_attribute_signature(embedded)
+
+        # The payload is rebuilt from the attribute, so changes are detected
+        u.user_id.value = "tampered"
+        with pytest.raises(cis_profile.exceptions.SignatureVerificationFailure):
+            u.verify_attribute_signature("user_id")
+
     def test_verify_can_publish(self):
         u = profile.User(user_id="test")
 
@@ -149,3 +198,71 @@ class TestProfile(object):
 
         u_orig.merge(u_patch, "ldap")
         assert u_orig.as_dict()["access_information"]["ldap"]["values"] == {"test_replacement": None}
+
+    def test_attribute_paths(self):
+        paths = get_attribute_paths()
+        assert paths is get_attribute_paths()
+        assert ("user_id",) in paths
+        assert ("access_information", "ldap") in paths
+        assert ("staff_information", "title") in paths
+        assert ("identities",) not in paths
+
+        u = profile.User(user_id="test")
+        for path in paths:
+            assert "signature" in get_attribute(u.__dict__, path)
+        assert get_attribute(u.__dict__, "access_information.ldap") is u.access_information.ldap
+        assert get_attribute(u.__dict__, "access_information.nonexistent") is None
+
+    def test_null_profile_template(self):
+        template = get_null_profile()
+        assert template is get_null_profile()
+        with open("cis_profile/data/user_profile_null.json") as fd:
+            null_profile = json.load(fd)
+        assert DotDict.clone(template) == DotDict(null_profile)
+
+        # Users get their own copy of the template
+        u = profile.User(user_id="test")
+        u.access_information.ldap["values"] = {"test": None}
+        u.user_id.metadata.display = "staff"
+        assert isinstance(u.access_information.ldap, DotDict)
+        assert template == null_profile
+        assert profile.User().as_dict() == null_profile
+
+    def test_profile_digest(self):
+        u = profile.User(user_id="test")
+        digest = profile_digest(u)
+        assert digest == profile_digest(u.as_dict())
+        assert digest == profile_digest(json.dumps(u.as_dict(), indent=2))
+
+        # Key order and attributes owned by CIS do not matter, content does
+        reordered = dict(reversed(list(u.as_dict().items())))
+        assert profile_digest(reordered) == digest
+        u.last_modified.value = "2019-01-01T00:00:00.000Z"
+        assert profile_digest(u) == digest
+        u.user_id.value = "changed"
+        assert profile_digest(u) != digest
+
+    def test_merge_profiles_ignores_other_publishers(self):
+        u_orig = profile.User()
+        u_patch = profile.User()
+        u_patch.access_information.hris.values = {"test": None}
+        u_patch.staff_information.title.signature.publisher.name = "hris"
+        u_patch.staff_information.title.value = "test"
+
+        u_orig.merge(u_patch, "ldap")
+        assert u_orig.access_information.hris["values"] != {"test": None}
+        assert u_orig.staff_information.title.value is None
+        u_orig.merge(u_patch, "hris")
+        assert u_orig.access_information.hris["values"] == {"test": None}
+        assert u_orig.staff_information.title.value == "test"
+
+    def test_merge_level(self):
+        u_orig = profile.User()
+        u_patch = profile.User()
+        u_patch.access_information.ldap.values = {"test": None}
+        u_patch.user_id.value = "test"
+
+        # Only the passed level is merged
+        u_orig.merge(u_patch, "ldap", level=u_patch.access_information, _internal_level=u_orig.access_information)
+        assert u_orig.access_information.ldap["values"] == {"test": None}
+        assert u_orig.user_id.value is None
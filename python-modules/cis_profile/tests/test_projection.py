@@ -0,0 +1,62 @@
+from cis_profile import profile
+from cis_profile.common import DisplayLevel
+from cis_profile.common import MozillaDataClassification
+from cis_profile.fake_profile import FakeUser
+from cis_profile.projection import ProjectionPlan
+
+import copy
+import json
+import os
+
+
+class TestProjection(object):
+    def setup(self):
+        os.environ["CIS_CONFIG_INI"] = "tests/fixture/mozilla-cis.ini"
+
+    def test_plan_matches_user_filters(self):
+        classifications = MozillaDataClassification.PUBLIC + MozillaDataClassification.STAFF_ONLY
+        display_levels = [DisplayLevel.PUBLIC, DisplayLevel.AUTHENTICATED, DisplayLevel.STAFF]
+        plan = ProjectionPlan(classifications=classifications, display_levels=display_levels)
+
+        for seed in range(5):
+            fake_profile = FakeUser(seed=seed).as_dict()
+            raw = json.loads(json.dumps(fake_profile))
+            expected = profile.User(user_structure_json=copy.deepcopy(fake_profile))
+            expected.filter_scopes(classifications)
+            expected.filter_display(display_levels)
+
+            assert plan.apply(raw) == expected.as_dict()
+            # The source profile is left untouched
+            assert raw == fake_profile
+
+    def test_plan_without_filters(self):
+        fake_profile = FakeUser(seed=1).as_dict()
+        assert ProjectionPlan().apply(fake_profile) is fake_profile
+
+        plan = ProjectionPlan(display_levels=[DisplayLevel.PUBLIC])
+        filtered = plan.apply(fake_profile)
+        for attr in filtered.values():
+            if isinstance(attr, dict) and "metadata" in attr:
+                assert attr["metadata"]["display"] == DisplayLevel.PUBLIC
+
+    def test_plan_filters_unknown_attributes(self):
+        fake_profile = FakeUser(seed=1).as_dict()
+        restricted = copy.deepcopy(fake_profile["first_name"])
+        restricted["metadata"]["classification"] = MozillaDataClassification.MOZILLA_CONFIDENTIAL[0]
+        restricted["metadata"]["display"] = DisplayLevel.PRIVATE
+        public = copy.deepcopy(fake_profile["first_name"])
+        public["metadata"]["classification"] = MozillaDataClassification.PUBLIC[0]
+        public["metadata"]["display"] = DisplayLevel.PUBLIC
+        # Attributes the builtin profile structure does not have, at all levels
+        fake_profile["new_attribute"] = restricted
+        fake_profile["new_parent"] = {"secret": restricted, "open": public}
+        fake_profile["access_information"]["new_source"] = restricted
+
+        for plan in [
+            ProjectionPlan(classifications=MozillaDataClassification.PUBLIC),
+            ProjectionPlan(display_levels=[DisplayLevel.PUBLIC]),
+        ]:
+            filtered = plan.apply(fake_profile)
+            assert "new_attribute" not in filtered
+            assert filtered["new_parent"] == {"open": public}
+            assert "new_source" not in filtered["access_information"]
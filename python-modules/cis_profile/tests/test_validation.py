@@ -0,0 +1,98 @@
+from cis_profile import profile
+from cis_profile.common import WellKnown
+from cis_profile.validation import get_attribute_validators
+from cis_profile.validation import get_validator
+from cis_profile.validation import validate
+from cis_profile.validation import validate_changes
+from cis_profile.validation import validate_many
+
+import copy
+import json
+import jsonschema
+import os
+import pytest
+
+
+class TestValidation(object):
+    def setup(self):
+        os.environ["CIS_CONFIG_INI"] = "tests/fixture/mozilla-cis.ini"
+        self.schema = WellKnown.shared().get_schema()
+
+    def test_cached_validator(self):
+        validator = get_validator()
+        assert validator is get_validator(self.schema)
+        # Same schema version, different object
+        assert validator is get_validator(copy.deepcopy(self.schema))
+
+    def test_validate(self):
+        u = profile.User(user_id="test")
+        validate(u)
+        validate(u.as_dict())
+        validate(u.as_json())
+
+        u.user_id.value = 1
+        with pytest.raises(jsonschema.exceptions.ValidationError):
+            validate(u)
+        with pytest.raises(jsonschema.exceptions.ValidationError):
+            u.validate()
+
+    def test_validate_many(self):
+        valid = profile.User(user_id="test").as_dict()
+        invalid = profile.User(user_id="test").as_dict()
+        invalid["active"]["value"] = "yes"
+        errors = validate_many([valid, invalid, json.dumps(valid), "{not json", profile.User()])
+        assert len(errors) == 5
+        assert errors[0] is None
+        assert isinstance(errors[1], jsonschema.exceptions.ValidationError)
+        assert list(errors[1].path) == ["active", "value"]
+        assert errors[2] is None
+        assert isinstance(errors[3], jsonschema.exceptions.ValidationError)
+        assert errors[4] is None
+
+    def test_attribute_validators(self):
+        validators = get_attribute_validators()
+        assert validators is get_attribute_validators(self.schema)
+        assert ("user_id",) in validators
+        assert ("access_information", "ldap") in validators
+        assert ("schema",) in validators
+
+    def test_validate_changes(self):
+        previous = profile.User(user_id="test")
+        u = profile.User(user_id="test")
+        u.access_information.access_provider["values"] = {"test": None}
+        u.validate(previous_user=previous)
+        validate_changes(u, previous)
+
+        # Only changed attributes are validated
+        previous.active.value = "yes"
+        u.active.value = "yes"
+        validate(u, previous_profile=previous)
+        with pytest.raises(jsonschema.exceptions.ValidationError):
+            validate(u)
+
+        u.staff_information.title.value = 1
+        with pytest.raises(jsonschema.exceptions.ValidationError) as e:
+            u.validate(previous_user=previous)
+        assert list(e.value.path) == ["staff_information", "title", "value"]
+
+    def test_validate_changes_structure(self):
+        previous = profile.User(user_id="test").as_dict()
+        u = profile.User(user_id="test").as_dict()
+        u["access_information"]["nonexistent"] = copy.deepcopy(u["access_information"]["ldap"])
+        with pytest.raises(jsonschema.exceptions.ValidationError):
+            validate_changes(u, previous)
+
+        u = profile.User(user_id="test").as_dict()
+        del u["user_id"]
+        with pytest.raises(jsonschema.exceptions.ValidationError):
+            validate_changes(u, previous)
+
+    def test_validate_changes_schema_version(self):
+        # The stored profile is invalid (e.g. stored under an older schema): only a full validation finds it
+        previous = profile.User(user_id="test").as_dict()
+        previous["active"]["value"] = "yes"
+        previous["schema"] = "https://person-api.sso.mozilla.com/schema/v2/profile-old"
+        u = copy.deepcopy(previous)
+        u["schema"] = profile.User().as_dict()["schema"]
+        with pytest.raises(jsonschema.exceptions.ValidationError):
+            validate_changes(u, previous)
@@ -1,3 +1,6 @@
+import threading
+
+from cis_profile.common import PublisherRules
 from cis_profile.common import WellKnown
 
 
@@ -18,3 +21,70 @@ class Test_WellKnown(object):
         data = wk.get_publisher_rules()
         assert isinstance(data, dict)
         assert isinstance(data.get("create"), dict)
+
+    def test_compiled_rules(self):
+        wk = WellKnown()
+        rules = wk.get_compiled_publisher_rules()
+        assert rules is wk.get_compiled_publisher_rules()
+        assert rules is PublisherRules.compile(wk.get_publisher_rules())
+        assert "ldap" in rules.creators("user_id")
+        assert rules.updator("user_id") == "access_provider"
+        assert rules.creators("ldap", parent_name="access_information") == frozenset(["ldap"])
+        assert rules.updator("hris", parent_name="access_information") == "hris"
+        # Parents with a single rule apply it to all of their children
+        assert "hris" in rules.creators("title", parent_name="staff_information")
+        # ...but their children are not updatable by any publisher
+        assert rules.updator("title", parent_name="staff_information") != "hris"
+        assert rules.updator("github_id_v3", parent_name="identities") != "mozilliansorg"
+
+    def test_compiled_rules_follow_swapped_rules(self):
+        wk = WellKnown()
+        rules = wk.get_compiled_publisher_rules()
+        # As done by a background refresh
+        swapped = dict(wk.get_publisher_rules(), update=dict(wk.get_publisher_rules()["update"], user_id="ldap"))
+        wk._documents = wk._documents[:2] + (swapped,)
+        assert wk.get_compiled_publisher_rules().version != rules.version
+        assert wk.get_compiled_publisher_rules().updator("user_id") == "ldap"
+
+    def test_shared(self):
+        wk = WellKnown.shared()
+        assert wk is WellKnown.shared()
+        assert wk is not WellKnown.shared("https://auth.allizom.org/.well-known/mozilla-iam")
+        assert wk.get_well_known() is wk.get_well_known()
+        assert wk.get_schema() is wk.get_schema()
+
+    def test_stale_data_is_served_while_refreshing(self):
+        wk = WellKnown()
+        data = wk.get_well_known()
+        rules = wk.get_compiled_publisher_rules()
+        # Expire the in-memory copies
+        wk._loaded_at -= wk._ttl + 1
+        assert wk.get_well_known() is data
+        refresh = [t for t in threading.enumerate() if t.name == "cis-well-known-refresh"]
+        for t in refresh:
+            t.join()
+        assert wk._refreshing is False
+        assert wk.get_compiled_publisher_rules().version == rules.version
+
+    def test_refresh_swaps_all_documents(self, monkeypatch):
+        wk = WellKnown()
+        wk.get_schema()
+        wk.get_publisher_rules()
+        documents = wk._documents
+
+        refreshed = {
+            wk.discovery_url: {"api": {"data/profile_schema": "schema"}, "publishers_rules_uri": "rules"},
+            "schema": {"refreshed": "schema"},
+            "rules": {"refreshed": "rules"},
+        }
+        monkeypatch.setattr(wk, "_fetch_json", lambda url: refreshed[url])
+        wk._refresh()
+        assert wk._documents is not documents
+        assert wk._documents == (refreshed[wk.discovery_url], refreshed["schema"], refreshed["rules"])
+        assert wk.get_schema() is refreshed["schema"]
+
+        # Documents which could not be fetched are kept
+        monkeypatch.setattr(wk, "_fetch_json", lambda url: None)
+        documents = wk._documents
+        wk._refresh()
+        assert wk._documents == documents
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Compares the cost of turning stored vault profiles into person API responses (filtering, then JSON serialization with
+Flask's jsonify), for a single user and for a page of 25 users:
+- `user`: what the API used to do, building a cis_profile User per profile and calling filter_scopes(),
+  filter_display() and as_dict()
+- `plan`: what it does now, applying a cached projection plan to the parsed JSON (no User, signing or verification
+  objects)
+Responses of both paths are checked to be byte-for-byte identical first.
+
+Usage: python benchmarks/bench_read_path.py [iterations]
+"""
+
+import json
+import os
+import sys
+import timeit
+
+SCOPES = [
+    ("no scopes", [], None),
+    ("staff", ["classification:workgroup:staff_only", "display:staff"], None),
+    ("full", ["read:fullprofile", "display:all"], "ndaed"),
+]
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    os.environ.setdefault("CIS_CONFIG_INI", os.path.join(os.path.dirname(__file__), "../tests/mozilla-cis.ini"))
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+
+    from flask import jsonify
+    from cis_profile.fake_profile import FakeUser
+    from cis_profile.profile import User
+    from cis_profile_retrieval_service import v2_api
+
+    blobs = [json.dumps(FakeUser(seed=seed).as_dict()) for seed in range(25)]
+
+    def with_user(blob, scopes, filter_display):
+        v2_profile = User(user_structure_json=json.loads(blob))
+        if "read:fullprofile" not in scopes:
+            v2_profile.filter_scopes(v2_api.scope_to_mozilla_data_classification(scopes))
+        if "display:all" not in scopes:
+            v2_profile.filter_display(v2_api.scope_to_display_level(scopes))
+        if filter_display is not None:
+            v2_profile.filter_display(v2_api.DisplayLevelParms.map(filter_display))
+        return v2_profile.as_dict()
+
+    def with_plan(blob, scopes, filter_display):
+        return v2_api.get_projection_plan(frozenset(scopes), filter_display).apply(json.loads(blob))
+
+    with v2_api.app.app_context():
+        for name, scopes, filter_display in SCOPES:
+            for blob in blobs:
+                before = jsonify(with_user(blob, scopes, filter_display)).get_data()
+                after = jsonify(with_plan(blob, scopes, filter_display)).get_data()
+                assert before == after, "Responses differ for scopes {}".format(name)
+
+            for path, fn in [("user", with_user), ("plan", with_plan)]:
+                single = min(
+                    timeit.repeat(lambda: jsonify(fn(blobs[0], scopes, filter_display)), number=iterations, repeat=3)
+                )
+                page = min(
+                    timeit.repeat(
+                        lambda: jsonify({"Items": [fn(blob, scopes, filter_display) for blob in blobs]}),
+                        number=max(1, iterations // 25),
+                        repeat=3,
+                    )
+                )
+                print(
+                    "{:>10} {:>5}: {:8.1f} us/user, {:8.1f} us/page of 25".format(
+                        name, path, single / iterations * 1e6, page / max(1, iterations // 25) * 1e6
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main()
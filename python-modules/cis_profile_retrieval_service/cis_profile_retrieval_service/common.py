@@ -68,8 +68,10 @@ def seed(number_of_fake_users=100):
         table = get_table_resource()
         user_profile = user.Profile(table, None, False)
 
-        if len(user_profile.all) > 0:
-            pass
+        # Only check for a single item, rather than reading the whole vault
+        existing = user_profile.scan(projection_expression="#id", expression_attribute_names={"#id": "id"})
+        if next(existing, None) is not None:
+            existing.close()
         else:
             identities = batch_create_fake_profiles(1337, number_of_fake_users)
 
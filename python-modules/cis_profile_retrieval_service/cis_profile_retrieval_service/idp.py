@@ -7,6 +7,7 @@ from flask import _request_ctx_stack
 from six.moves.urllib.request import urlopen
 from jose import jwt
 
+from cis_crypto import auth
 from cis_profile_retrieval_service.common import get_config
 from cis_profile_retrieval_service.exceptions import AuthError
 
@@ -17,6 +18,7 @@ CONFIG = get_config()
 AUTH0_DOMAIN = CONFIG("auth0_domain", namespace="person_api", default="auth-dev.mozilla.auth0.com")
 API_IDENTIFIER = CONFIG("api_identifier", namespace="person_api", default="api.dev.sso.allizom.org")
 ALGORITHMS = CONFIG("algorithms", namespace="change_service", default="RS256")
+JWKS_URL = "https://" + AUTH0_DOMAIN + "/.well-known/jwks.json"
 
 
 # Format error response and append status code
@@ -46,11 +48,21 @@ def get_token_auth_header():
 
 def get_jwks():
     # XXX TBD do this with request purely instead of six
-    jsonurl = urlopen("https://" + AUTH0_DOMAIN + "/.well-known/jwks.json")
+    jsonurl = urlopen(JWKS_URL)
     jwks = json.loads(jsonurl.read())
     return jwks
 
 
+def get_jwks_cache():
+    """Returns the process-wide cache of the keys of the JWKS, fetched with get_jwks()."""
+    return auth.get_jwks_cache(JWKS_URL, fetch=lambda: get_jwks())
+
+
+def token_options():
+    """Returns the audience, issuer and algorithms tokens are verified for."""
+    return dict(algorithms=ALGORITHMS, audience=API_IDENTIFIER, issuer="https://" + AUTH0_DOMAIN + "/")
+
+
 def requires_auth(f):
     """Determines if the Access Token is valid
     """
@@ -65,43 +77,32 @@ def requires_auth(f):
             return f(*args, **kwargs)
         else:
             token = get_token_auth_header()
-            jwks = get_jwks()
-            unverified_header = jwt.get_unverified_header(token)
-            rsa_key = {}
-            for key in jwks["keys"]:
-                if key["kid"] == unverified_header["kid"]:
-                    rsa_key = {"kty": key["kty"], "kid": key["kid"], "use": key["use"], "n": key["n"], "e": key["e"]}
-            if rsa_key:
-                try:
-                    logger.debug(token)
-                    payload = jwt.decode(
-                        token,
-                        rsa_key,
-                        algorithms=ALGORITHMS,
-                        audience=API_IDENTIFIER,
-                        issuer="https://" + AUTH0_DOMAIN + "/",
-                    )
-                except jwt.ExpiredSignatureError as e:
-                    logger.error(e)
-                    raise AuthError({"code": "token_expired", "description": "token is expired"}, 401)
-                except jwt.JWTClaimsError as e:
-                    logger.error(e)
-                    raise AuthError(
-                        {
-                            "code": "invalid_claims",
-                            "description": "incorrect claims," "please check the audience and issuer",
-                        },
-                        401,
-                    )
-                except Exception as e:
-                    logger.error(e)
-                    raise AuthError(
-                        {"code": "invalid_header", "description": "Unable to parse authentication" " token."}, 401
-                    )
-
-                _request_ctx_stack.top.current_user = payload
-                return f(*args, **kwargs)
-            raise AuthError({"code": "invalid_header", "description": "Unable to find appropriate key"}, 401)
+            try:
+                # Verified once per token, with keys parsed once per process
+                payload = auth.verify_token(token, get_jwks_cache(), **token_options())
+            except auth.UnknownKeyError as e:
+                logger.error(e)
+                raise AuthError({"code": "invalid_header", "description": "Unable to find appropriate key"}, 401)
+            except jwt.ExpiredSignatureError as e:
+                logger.error(e)
+                raise AuthError({"code": "token_expired", "description": "token is expired"}, 401)
+            except jwt.JWTClaimsError as e:
+                logger.error(e)
+                raise AuthError(
+                    {
+                        "code": "invalid_claims",
+                        "description": "incorrect claims," "please check the audience and issuer",
+                    },
+                    401,
+                )
+            except Exception as e:
+                logger.error(e)
+                raise AuthError(
+                    {"code": "invalid_header", "description": "Unable to parse authentication" " token."}, 401
+                )
+
+            _request_ctx_stack.top.current_user = payload
+            return f(*args, **kwargs)
 
     return decorated
 
@@ -109,7 +110,10 @@ def requires_auth(f):
 def get_scopes(token):
     try:
         split_bearer = token.split()
-        unverified_claims = jwt.get_unverified_claims(split_bearer[1])
+        # Claims of tokens requires_auth() verified are not decoded again
+        unverified_claims = auth.verified_claims(split_bearer[1], get_jwks_cache(), **token_options())
+        if unverified_claims is None:
+            unverified_claims = jwt.get_unverified_claims(split_bearer[1])
     except AttributeError:
         logger.warning("Could not parse bearer token, this client will have empty scopes")
         unverified_claims = {}
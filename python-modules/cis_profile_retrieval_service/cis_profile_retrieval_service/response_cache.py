@@ -0,0 +1,111 @@
+"""In-process cache of the serialized, filtered profiles the person API returns.
+
+The same documents are requested over and over (e.g. the public view of a user for DinoPark), so the JSON bytes of each
+response are kept per (lookup, scopes, filterDisplay) together with the `sequence_number` of the vault item they were
+built from.  A cached response is only served for the same sequence number, so that it is dropped as soon as the
+profile changes, and it skips JSON decoding, filtering and encoding.  When the vault lookup cache is enabled as well
+(`person_api.vault_cache`), the sequence number comes from memory and cached responses do not reach DynamoDB at all.
+
+The cache is bounded both in number of entries (`response_cache_max_entries`) and in bytes
+(`response_cache_max_bytes`), evicting the least recently used first, and entries expire after `response_cache_ttl`
+seconds.
+"""
+import collections
+import threading
+import time
+from cis_profile_retrieval_service.common import get_config
+
+
+# Process-wide cache, see get_response_cache()
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Returns the process-wide ResponseCache, created from the settings on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
+
+
+def response_key(find_by, value, scopes, filter_display=None):
+    """Returns the cache key of the response to the @find_by lookup of @value, for a token with @scopes and the
+    filterDisplay parameter @filter_display. Scopes are normalised, so that their order does not matter."""
+    return (find_by, value, frozenset(scopes), filter_display)
+
+
+class ResponseCache(object):
+    """LRU cache of response bodies (bytes), each valid for one sequence number of the profile it was built from."""
+
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None):
+        config = get_config()
+        if max_entries is None:
+            max_entries = int(config("response_cache_max_entries", namespace="person_api", default="10000"))
+        if max_bytes is None:
+            max_bytes = int(config("response_cache_max_bytes", namespace="person_api", default=str(64 * 1024 * 1024)))
+        if ttl is None:
+            ttl = int(config("response_cache_ttl", namespace="person_api", default="300"))
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key: (expiry time, sequence number, body)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, sequence_number):
+        """Returns bytes the cached body for @key if it was built from @sequence_number and has not expired, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] < time.time() or entry[1] != sequence_number):
+                if entry[1] != sequence_number:
+                    self.invalidations += 1
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, sequence_number, body):
+        """Caches the response @body (bytes) built from the profile at @sequence_number."""
+        if sequence_number is None or self.ttl <= 0 or len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + self.ttl, sequence_number, body)
+            self.bytes += len(body)
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry[2])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Returns dict of the counters of the cache."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
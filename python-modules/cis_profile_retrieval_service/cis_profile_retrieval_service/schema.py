@@ -32,7 +32,7 @@ class Query(graphene.ObjectType):
                 for profile in search.get("Items"):
                     profiles.append(json.loads())
         else:
-            for vault_profile in vault.all:
+            for vault_profile in vault.scan(projection_expression="#p", expression_attribute_names={"#p": "profile"}):
                 profiles.append(json.loads(vault_profile.get("profile")))
 
     def resolve_profile(self, info, **kwargs):
@@ -1,7 +1,10 @@
+import functools
+import hashlib
 import json
 import re
 
 from flask import Flask
+from flask import request
 from flask_cors import CORS
 from flask_graphql import GraphQLView
 from flask_restful import Api
@@ -12,15 +15,19 @@ from graphene import Schema
 from logging import getLogger
 import urllib.parse
 
+from cis_identity_vault.cache import CachedProfile
+from cis_identity_vault.cache import StreamInvalidator
 from cis_identity_vault.models import user
 from cis_profile.common import MozillaDataClassification
 from cis_profile.common import DisplayLevel
-from cis_profile.profile import User
+from cis_profile.projection import ProjectionPlan
 from cis_profile_retrieval_service.common import get_config
 from cis_profile_retrieval_service.common import initialize_vault
 from cis_profile_retrieval_service.common import get_dynamodb_client
 from cis_profile_retrieval_service.common import get_table_resource
 from cis_profile_retrieval_service.common import seed
+from cis_profile_retrieval_service.response_cache import get_response_cache
+from cis_profile_retrieval_service.response_cache import response_key
 from cis_profile_retrieval_service.schema import Query
 from cis_profile_retrieval_service.schema import AuthorizationMiddleware
 from cis_profile_retrieval_service.idp import requires_auth
@@ -44,6 +51,18 @@ dynamodb_table = get_table_resource()
 dynamodb_client = get_dynamodb_client()
 transactions = config("transactions", namespace="cis", default="false")
 
+# Single user lookups are served from an in-process cache, see cis_identity_vault.cache
+vault_cache = config("vault_cache", namespace="person_api", default="false") == "true"
+# Only for long-running deployments with few API processes, others rely on the TTL: see cis_identity_vault.cache
+if vault_cache and config("vault_cache_stream", namespace="person_api", default="false") == "true":
+    stream_invalidator = StreamInvalidator(dynamodb_table).start()
+
+# Filtered single user responses are kept serialized per profile sequence number, see response_cache
+response_cache = config("response_cache", namespace="person_api", default="false") == "true"
+
+# Lifetime of public only responses in shared (edge) caches, see cache_control()
+public_max_age = int(config("public_max_age", namespace="person_api", default="60"))
+
 
 def load_dirty_json(dirty_json):
     regex_replace = [
@@ -131,6 +150,85 @@ def scope_to_display_level(scopes):
     return display_levels
 
 
+@functools.lru_cache(maxsize=int(config("projection_plan_cache_size", namespace="person_api", default="256")))
+def get_projection_plan(scopes, filter_display=None):
+    """
+    Returns the ProjectionPlan filtering profiles for a token with @scopes (frozenset) and the filterDisplay
+    parameter @filter_display. Plans are cached, so that they are built once per combination.
+    """
+    classifications = None
+    display_levels = None
+    if "read:fullprofile" in scopes:
+        logger.debug("read:fullprofile in token returning the full user profile.")
+    else:
+        classifications = scope_to_mozilla_data_classification(scopes)
+
+    if "display:all" in scopes:
+        logger.debug("display:all in token not filtering profile.")
+    else:
+        display_levels = scope_to_display_level(scopes)
+
+    if filter_display is not None:
+        requested = DisplayLevelParms.map(filter_display)
+        if display_levels is None:
+            display_levels = requested
+        else:
+            display_levels = [level for level in display_levels if level in requested]
+    return ProjectionPlan(classifications=classifications, display_levels=display_levels)
+
+
+def item_version(item):
+    """Returns str what identifies the content of the vault @item: its sequence number, else its profile digest."""
+    version = item.get("sequence_number") or item.get("profile_digest")
+    if version is None:
+        version = hashlib.sha256(item["profile"].encode("utf-8")).hexdigest()
+    return str(version)
+
+
+def entity_tag(versions, scopes, filter_display=None):
+    """
+    Returns str the strong ETag of a response built from profiles at @versions (list of str, see item_version()), for a
+    token with @scopes and the filterDisplay parameter @filter_display. It is computed without decoding the profiles.
+    """
+    tag = hashlib.sha256()
+    for part in [json.dumps(sorted(scopes)), str(filter_display)] + list(versions):
+        tag.update(part.encode("utf-8"))
+        tag.update(b"\0")
+    return tag.hexdigest()
+
+
+def is_public_only(plan):
+    """Returns True if @plan (ProjectionPlan) only keeps public attributes, i.e. anyone could be served its output."""
+    if plan.classifications is None or plan.display_levels is None:
+        return False
+    public_display = plan.display_levels <= set([DisplayLevel.PUBLIC])
+    return public_display and plan.classifications <= set(MozillaDataClassification.PUBLIC)
+
+
+def cache_control(response, etag, plan):
+    """
+    Sets the ETag of @response and lets shared caches keep it if @plan only keeps public data. Returns @response.
+    The filtered representation depends on the scopes of the token, so it varies with the Authorization header.
+    """
+    response.set_etag(etag)
+    response.vary.add("Authorization")
+    if is_public_only(plan):
+        response.cache_control.public = True
+        response.cache_control.max_age = public_max_age
+    else:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag, plan):
+    """Returns a 304 response if the client already has the representation @etag (If-None-Match), else None."""
+    # If-None-Match uses the weak comparison (RFC 7232 3.2), and contains_weak() matches "*" as well
+    if request.if_none_match.contains_weak(etag):
+        return cache_control(app.response_class(status=304), etag, plan)
+    return None
+
+
 def graphql_view():
     view_func = GraphQLView.as_view(
         "graphql",
@@ -148,7 +246,7 @@ class v2UserByUserId(Resource):
 
     def get(self, user_id):
         logger.debug("Attempting to locate a user for user_id: {}".format(user_id))
-        return getUser(user_id, user.Profile.find_by_id)
+        return getUser(user_id, "find_by_id")
 
 
 class v2UserByUuid(Resource):
@@ -158,7 +256,7 @@ class v2UserByUuid(Resource):
 
     def get(self, uuid):
         logger.debug("Attempting to locate a user for uuid: {}".format(uuid))
-        return getUser(uuid, user.Profile.find_by_uuid)
+        return getUser(uuid, "find_by_uuid")
 
 
 class v2UserByPrimaryEmail(Resource):
@@ -168,7 +266,7 @@ class v2UserByPrimaryEmail(Resource):
 
     def get(self, primary_email):
         logger.debug("Attempting to locate a user for primary_email: {}".format(primary_email))
-        return getUser(primary_email, user.Profile.find_by_email)
+        return getUser(primary_email, "find_by_email")
 
 
 class v2UserByPrimaryUsername(Resource):
@@ -178,11 +276,11 @@ class v2UserByPrimaryUsername(Resource):
 
     def get(self, primary_username):
         logger.debug("Attempting to locate a user for primary_username: {}".format(primary_username))
-        return getUser(primary_username, user.Profile.find_by_username)
+        return getUser(primary_username, "find_by_username")
 
 
 def getUser(id, find_by):
-    """Return a single user with identifier using find_by."""
+    """Return a single user with identifier using the find_by method (name) of the vault Profile."""
     id = urllib.parse.unquote(id)
     parser = reqparse.RequestParser()
     parser.add_argument("Authorization", location="headers")
@@ -191,31 +289,38 @@ def getUser(id, find_by):
     scopes = get_scopes(args.get("Authorization"))
     filter_display = args.get("filterDisplay", None)
 
-    if transactions == "false":
+    if vault_cache:
+        identity_vault = CachedProfile(dynamodb_table, dynamodb_client, transactions=(transactions == "true"))
+
+    elif transactions == "false":
         identity_vault = user.Profile(dynamodb_table, dynamodb_client, transactions=False)
 
-    if transactions == "true":
+    elif transactions == "true":
         identity_vault = user.Profile(dynamodb_table, dynamodb_client, transactions=True)
 
-    result = find_by(identity_vault, id)
+    result = getattr(identity_vault, find_by)(id)
+    if vault_cache:
+        logger.debug("Vault cache stats: {}".format(identity_vault.cache.stats()))
 
     if len(result["Items"]) > 0:
-        vault_profile = result["Items"][0]["profile"]
-        v2_profile = User(user_structure_json=json.loads(vault_profile))
-        if "read:fullprofile" in scopes:
-            logger.debug("read:fullprofile in token returning the full user profile.")
-        else:
-            v2_profile.filter_scopes(scope_to_mozilla_data_classification(scopes))
-
-        if "display:all" in scopes:
-            logger.debug("display:all in token not filtering profile.")
-        else:
-            v2_profile.filter_display(scope_to_display_level(scopes))
-
-        if filter_display is not None:
-            v2_profile.filter_display(DisplayLevelParms.map(filter_display))
-
-        return jsonify(v2_profile.as_dict())
+        item = result["Items"][0]
+        plan = get_projection_plan(frozenset(scopes), filter_display)
+        etag = entity_tag([item_version(item)], scopes, filter_display)
+        response = not_modified(etag, plan)
+        if response is not None:
+            return response
+
+        if response_cache:
+            key = response_key(find_by, id, scopes, filter_display)
+            body = get_response_cache().get(key, item.get("sequence_number"))
+            if body is not None:
+                return cache_control(app.response_class(body, mimetype=app.json.mimetype), etag, plan)
+
+        response = jsonify(plan.apply(json.loads(item["profile"])))
+        if response_cache:
+            get_response_cache().put(key, item.get("sequence_number"), response.get_data())
+            logger.debug("Response cache stats: {}".format(get_response_cache().stats()))
+        return cache_control(response, etag, plan)
     else:
         return jsonify({})
 
@@ -258,28 +363,20 @@ class v2Users(Resource):
             result = identity_vault.find_by_email(primary_email)
         v2_profiles = []
 
+        # Without read:fullprofile, filtering falls back to public data. The plan is the same for the whole page.
+        plan = get_projection_plan(frozenset(scopes), filter_display)
+        versions = [item_version(profile) for profile in result.get("Items")]
+        etag = entity_tag(versions + [json.dumps(next_page_token, sort_keys=True, default=str)], scopes, filter_display)
+        response = not_modified(etag, plan)
+        if response is not None:
+            return response
+
         for profile in result.get("Items"):
             vault_profile = json.loads(profile.get("profile"))
-            v2_profile = User(user_structure_json=vault_profile)
-            if "read:fullprofile" in scopes:
-                # Assume someone has asked for all the data.
-                pass
-            else:
-                # Assume the we are filtering falls back to public with no scopes
-                v2_profile.filter_scopes(scope_to_mozilla_data_classification(scopes))
-
-            if "display:all" in scopes:
-                logger.debug("display:all in token not filtering profile.")
-            else:
-                v2_profile.filter_display(scope_to_display_level(scopes))
-
-            if filter_display is not None:
-                v2_profile.filter_display(DisplayLevelParms.map(filter_display))
-
-            v2_profiles.append(v2_profile.as_dict())
+            v2_profiles.append(plan.apply(vault_profile))
 
         response = {"Items": v2_profiles, "nextPage": next_page_token}
-        return jsonify(response)
+        return cache_control(jsonify(response), etag, plan)
 
 
 if config("graphql", namespace="person_api", default="false") == "true":
@@ -0,0 +1,83 @@
+import copy
+import itertools
+import json
+import os
+
+
+def recursive_filter(level, valid, check):
+    """The filtering of profiles before projection plans (User._filter_all() of cis_profile 0.x), on plain dicts."""
+    todel = []
+    for attr in level.keys():
+        if attr.startswith("_") or not isinstance(level[attr], dict):
+            continue
+        if "metadata" not in level[attr].keys():
+            recursive_filter(level[attr], valid=valid, check=check)
+        elif level[attr]["metadata"][check] not in valid:
+            todel.append(attr)
+
+    for _ in todel:
+        del level[_]
+
+
+class TestProjection(object):
+    def setup(self):
+        os.environ["CIS_CONFIG_INI"] = "tests/mozilla-cis.ini"
+
+    def filter_profile(self, profile, scopes, filter_display):
+        """Filters @profile in place like getUser() did before projection plans."""
+        from cis_profile_retrieval_service import v2_api
+
+        if "read:fullprofile" not in scopes:
+            recursive_filter(profile, v2_api.scope_to_mozilla_data_classification(scopes), "classification")
+        if "display:all" not in scopes:
+            recursive_filter(profile, v2_api.scope_to_display_level(scopes), "display")
+        if filter_display is not None:
+            recursive_filter(profile, v2_api.DisplayLevelParms.map(filter_display), "display")
+        return profile
+
+    def profiles(self):
+        from cis_profile.common import DisplayLevel
+        from cis_profile.common import MozillaDataClassification
+        from cis_profile.fake_profile import FakeUser
+
+        levels = list(
+            itertools.product(
+                [
+                    MozillaDataClassification.PUBLIC[0],
+                    MozillaDataClassification.STAFF_ONLY[0],
+                    MozillaDataClassification.MOZILLA_CONFIDENTIAL[0],
+                ],
+                [DisplayLevel.PUBLIC, DisplayLevel.STAFF, DisplayLevel.PRIVATE],
+            )
+        )
+        for seed in range(3):
+            profile = FakeUser(seed=seed).as_dict()
+            # Attributes the builtin profile structure does not have, with all combinations of metadata
+            new_parent = {}
+            for i, (classification, display) in enumerate(levels):
+                attr = copy.deepcopy(profile["first_name"])
+                attr["metadata"]["classification"] = classification
+                attr["metadata"]["display"] = display
+                profile["new_attribute_{}".format(i)] = attr
+                profile["access_information"]["new_source_{}".format(i)] = copy.deepcopy(attr)
+                new_parent["child_{}".format(i)] = copy.deepcopy(attr)
+            profile["new_parent"] = new_parent
+            yield json.dumps(profile)
+
+    def test_plan_matches_recursive_filtering(self):
+        from cis_profile_retrieval_service import v2_api
+
+        scopes_list = [
+            [],
+            ["read:fullprofile"],
+            ["display:all"],
+            ["read:fullprofile", "display:all"],
+            ["classification:mozilla_confidential", "display:staff"],
+            ["classification:workgroup:staff_only", "display:ndaed", "display:vouched"],
+            ["classification:workgroup", "classification:individual", "display:authenticated"],
+        ]
+        for blob in self.profiles():
+            for scopes, filter_display in itertools.product(scopes_list, [None, "public", "staff", "private", "x"]):
+                expected = self.filter_profile(json.loads(blob), scopes, filter_display)
+                plan = v2_api.get_projection_plan(frozenset(scopes), filter_display)
+                assert plan.apply(json.loads(blob)) == expected, (scopes, filter_display)
@@ -0,0 +1,114 @@
+import json
+import os
+import time
+
+
+class TestResponseCache(object):
+    def setup(self):
+        os.environ["CIS_CONFIG_INI"] = "tests/mozilla-cis.ini"
+
+    def test_sequence_number_invalidates(self):
+        from cis_profile_retrieval_service.response_cache import ResponseCache
+        from cis_profile_retrieval_service.response_cache import response_key
+
+        cache = ResponseCache(max_entries=10, max_bytes=1024, ttl=60)
+        user_id = "ad|Mozilla-LDAP|jdoe"
+        key = response_key("find_by_id", user_id, ["display:staff", "read:fullprofile"], "public")
+        assert key == response_key("find_by_id", user_id, ["read:fullprofile", "display:staff"], "public")
+
+        assert cache.get(key, "1") is None
+        cache.put(key, "1", b'{"user_id": 1}\n')
+        assert cache.get(key, "1") == b'{"user_id": 1}\n'
+        # The profile changed
+        assert cache.get(key, "2") is None
+        assert cache.get(key, "1") is None
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["invalidations"], stats["entries"]) == (1, 3, 1, 0)
+
+    def test_bounds(self):
+        from cis_profile_retrieval_service.response_cache import ResponseCache
+
+        cache = ResponseCache(max_entries=2, max_bytes=100, ttl=60)
+        cache.put("a", "1", b"a")
+        cache.put("b", "1", b"b")
+        cache.get("a", "1")
+        cache.put("c", "1", b"c")
+        # "b" was the least recently used
+        assert cache.get("b", "1") is None
+        assert cache.get("a", "1") == b"a"
+
+        cache.put("big", "1", b"x" * 101)
+        assert cache.get("big", "1") is None
+        cache.put("d", "1", b"x" * 90)
+        assert cache.stats()["bytes"] <= 100
+        assert cache.stats()["evictions"] == 2
+
+        cache = ResponseCache(max_entries=2, max_bytes=100, ttl=0.01)
+        cache.put("a", "1", b"a")
+        time.sleep(0.02)
+        assert cache.get("a", "1") is None
+
+    def test_entity_tag(self):
+        from cis_profile_retrieval_service import v2_api
+
+        scopes = ["display:staff", "classification:workgroup:staff_only"]
+        etag = v2_api.entity_tag(["1"], scopes, None)
+        assert etag == v2_api.entity_tag(["1"], list(reversed(scopes)), None)
+        assert etag != v2_api.entity_tag(["2"], scopes, None)
+        assert etag != v2_api.entity_tag(["1"], scopes, "public")
+        assert etag != v2_api.entity_tag(["1"], scopes + ["display:all"], None)
+
+        assert v2_api.is_public_only(v2_api.get_projection_plan(frozenset(), None))
+        assert v2_api.is_public_only(v2_api.get_projection_plan(frozenset(["display:staff"]), "public"))
+        assert not v2_api.is_public_only(v2_api.get_projection_plan(frozenset(scopes), None))
+        assert not v2_api.is_public_only(v2_api.get_projection_plan(frozenset(["read:fullprofile"]), "public"))
+
+    def test_conditional_requests(self, monkeypatch):
+        from cis_profile.fake_profile import FakeUser
+        from cis_profile_retrieval_service import v2_api
+        from jose import jwt
+
+        fake_profile = json.dumps(FakeUser(seed=1).as_dict())
+        items = [{"profile": fake_profile, "sequence_number": "1"}]
+
+        class FakeProfile(object):
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def find_by_id(self, user_id):
+                return {"Items": items}
+
+        monkeypatch.setattr(v2_api.user, "Profile", FakeProfile)
+        client = v2_api.app.test_client()
+        url = "/v2/user/user_id/ad%7CMozilla-LDAP%7Cjdoe"
+
+        # Without a token, only public data is returned and shared caches may keep it
+        response = client.get(url, json={})
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+        assert "public" in response.headers["Cache-Control"]
+        assert "max-age" in response.headers["Cache-Control"]
+        assert "Authorization" in response.headers["Vary"]
+
+        response = client.get(url, json={}, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        assert "Authorization" in response.headers["Vary"]
+        assert response.get_data() == b""
+        # Weak comparison, and the "*" tag
+        assert client.get(url, json={}, headers={"If-None-Match": "W/" + etag}).status_code == 304
+        assert client.get(url, json={}, headers={"If-None-Match": "*"}).status_code == 304
+
+        # Another token sees another representation, which shared caches must not keep
+        token = jwt.encode({"scope": "read:fullprofile display:all"}, "secret", algorithm="HS256")
+        headers = {"Authorization": "Bearer {}".format(token), "If-None-Match": etag}
+        response = client.get(url, json={}, headers=headers)
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+        assert "private" in response.headers["Cache-Control"]
+        assert "no-cache" in response.headers["Cache-Control"]
+        assert "Authorization" in response.headers["Vary"]
+
+        # The profile changed
+        items[0] = {"profile": fake_profile, "sequence_number": "2"}
+        assert client.get(url, json={}, headers={"If-None-Match": etag}).status_code == 200
@@ -1,5 +1,6 @@
 """Send a profile: full or partial to kinesis.  Report back stream entry status."""
 import cis_profile
+import cis_profile.validation
 import http.client
 import json
 import jsonschema
@@ -20,7 +21,7 @@ class Publish(object):
         self.config = get_config()
         self.connection_object = connect.AWS()
         self.kinesis_client = None
-        self.wk = cis_profile.common.WellKnown()
+        self.wk = cis_profile.common.WellKnown.shared()
         self.schema = self.wk.get_schema()
 
     def _connect(self):
@@ -39,23 +40,18 @@ class Publish(object):
         valid_profiles = []
         status = []
 
-        for profile in profiles:
-            try:
-                if isinstance(profile, str):
-                    profile = json.loads(profile)
+        # Validate all profiles at once, with the cached schema validator
+        errors = cis_profile.validation.validate_many(profiles, schema=self.wk.get_schema())
+        partition_key = self.config("publisher_id", namespace="cis", default="generic-publisher")
 
-                cis_profile.profile.User(user_structure_json=profile).validate()
-                valid_profiles.append(
-                    dict(
-                        Data=json.dumps(profile),
-                        PartitionKey=self.config("publisher_id", namespace="cis", default="generic-publisher"),
-                    )
-                )
-            except jsonschema.exceptions.ValidationError as e:
-                logger.info("Reason for schema failure was: {}".format(e))
-                status = 400
-                sequence_number = None
-                rejected_profiles.append({"status_code": status, "sequence_number": sequence_number})
+        for profile, error in zip(profiles, errors):
+            if error is None:
+                if not isinstance(profile, str):
+                    profile = json.dumps(profile)
+                valid_profiles.append(dict(Data=profile, PartitionKey=partition_key))
+            else:
+                logger.info("Reason for schema failure was: {}".format(error))
+                rejected_profiles.append({"status_code": 400, "sequence_number": None})
 
         try:
             # Send to kinesis
@@ -85,7 +81,7 @@ class Publish(object):
         # Assume the following ( publisher has signed the new attributes and regenerated metadata )
         # Validate JSON schema
         try:
-            cis_profile.profile.User(user_structure_json=profile_json).validate()
+            cis_profile.validation.validate(profile_json, schema=self.wk.get_schema())
             logger.info(
                 "Schema validated successfully for user_id: {}".format(profile_json.get("user_id").get("value"))
             )
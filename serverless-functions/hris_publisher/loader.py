@@ -1,5 +1,7 @@
 import boto3
+import cis_crypto.secret
 import cis_profile
+import cis_profile.batch
 import json
 import logging
 import requests
@@ -24,7 +26,7 @@ class cisAPI(object):
         self.logger = self.setup_logging()
         config = {"client_id": client_id, "client_secret": client_secret, "uri": authorizer_url}
         self.az = AuthZero(config)
-        self.well_known = cis_profile.WellKnown()
+        self.well_known = cis_profile.WellKnown.shared()
         wk = self.well_known.get_well_known()
         self.api_url = wk.api.endpoints[api_type]
         self.api_audience = wk.api.audience
@@ -220,13 +222,19 @@ class hris_processor(object):
             # Typical required user values
             p.active.value = True
             p.initialize_timestamps()
-            try:
-                p.sign_all(publisher_name="hris")
-            except Exception as e:
+            user_array.append(p)
+
+        # Sign all profiles at once, this reuses the same signing key for every profile and uses all CPUs if possible
+        # A profile that fails to sign does not affect the others
+        signing_errors = cis_profile.batch.sign_all_many(user_array, publisher_name="hris")
+
+        for p, signing_error in zip(user_array, signing_errors):
+            if signing_error is not None:
                 self.logger.critical(
                     "Profile data signing failed for user {} - skipped signing, verification "
-                    "WILL FAIL ({})".format(p.primary_email.value, e)
+                    "WILL FAIL ({})".format(p.primary_email.value, signing_error)
                 )
+
             try:
                 p.validate()
             except Exception as e:
@@ -242,12 +250,17 @@ class hris_processor(object):
                     "Profile signing failed for user {} - skipped signing, verification "
                     "WILL FAIL ({})".format(p.primary_email.value, e)
                 )
-            user_array.append(p)
 
         return user_array
 
 
 def handle(event=None, context={}):
+    # Fetch the signing key before the profiles are built.  It is cached process-wide, so warm invocations reuse it.
+    try:
+        cis_crypto.secret.prewarm()
+    except Exception as e:
+        logging.getLogger(__name__).warning("Could not prewarm the signing key ({})".format(e))
+
     cis_environment = getenv("CIS_ENVIRONMENT", "development")
     hris = hris_processor(cis_environment)
     hris.get_parameters()
@@ -3,6 +3,7 @@
 # This is, essentially, the reverse of "jwks_to_pem.py".
 # Given a PEM encoded public key, it will extract the modulus and exponent
 # from the key and return JWKS formatted JSON
+# Ed25519 public keys are returned as OKP keys (RFC 8037) for the EdDSA algorithm
 
 input_key = ""
 
@@ -14,6 +15,7 @@ import sys
 import json
 
 from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
 from cryptography.hazmat.backends import default_backend
 
 
@@ -59,6 +61,20 @@ public_key = serialization.load_pem_public_key(
     input_key,
     backend=default_backend())
 
+if isinstance(public_key, Ed25519PublicKey):
+    raw_bytes = public_key.public_bytes(encoding=serialization.Encoding.Raw,
+            format=serialization.PublicFormat.Raw)
+    jwk = {
+        "alg": "EdDSA",
+        "crv": "Ed25519",
+        "x": base64.urlsafe_b64encode(raw_bytes).rstrip(b'=').decode("ascii"),
+        "kid": args.kid,
+        "kty": "OKP",
+        "use": "sig"
+    }
+    print(json.dumps(jwk))
+    sys.exit(0)
+
 public_numbers = public_key.public_numbers()
 pem_bytes = public_key.public_bytes(encoding=serialization.Encoding.PEM,
         format=serialization.PublicFormat.SubjectPublicKeyInfo)